@@ -5,10 +5,13 @@ from sqlalchemy import pool
 
 from alembic import context
 
-from database.engine import Base
-from users.models import User
-from comments.models import Comment
-from posts.models import Post
+from database.engine import DB_SHARDS, Base, create_db_engine
+from users.models import RefreshToken, User
+from comments.models import Comment, CommentArchive
+from posts.models import Post, PostScore, TrendingEpoch
+from changes.models import Change
+from idempotency.models import IdempotencyKey
+from jobs.models import Job
 
 
 # this is the Alembic Config object, which provides
@@ -32,6 +35,11 @@ target_metadata = Base.metadata
 # ... etc.
 
 
+def include_object(object, name, type_, reflected, compare_to):
+    # Monthly comment archives are created on demand by comments/archive.py.
+    return not (type_ == "table" and name.startswith("comments_archive_"))
+
+
 def run_migrations_offline() -> None:
     """Run migrations in 'offline' mode.
 
@@ -48,6 +56,7 @@ def run_migrations_offline() -> None:
     context.configure(
         url=url,
         target_metadata=target_metadata,
+        include_object=include_object,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
     )
@@ -62,20 +71,33 @@ def run_migrations_online() -> None:
     In this scenario we need to create an Engine
     and associate a connection with the context.
 
+    With DB_SHARDS set, the main database and then every shard are
+    migrated; revisions only touch the tables the database holds
+    (see database.sharding.holds_table).
+
     """
     connectable = engine_from_config(
         config.get_section(config.config_ini_section, {}),
         prefix="sqlalchemy.",
         poolclass=pool.NullPool,
     )
-
-    with connectable.connect() as connection:
-        context.configure(
-            connection=connection, target_metadata=target_metadata
-        )
-
-        with context.begin_transaction():
-            context.run_migrations()
+    databases = [(connectable, "global" if DB_SHARDS else None)]
+    databases += [(create_db_engine(url), "shard") for url in DB_SHARDS]
+
+    for database, shard_role in databases:
+        with database.connect() as connection:
+            context.configure(
+                connection=connection,
+                target_metadata=target_metadata,
+                include_object=include_object,
+                # Commit each revision on its own, so a long upgrade never holds one big write lock.
+                transaction_per_migration=True,
+                shard_role=shard_role,
+            )
+
+            with context.begin_transaction():
+                context.run_migrations()
+        database.dispose()
 
 
 if context.is_offline_mode():
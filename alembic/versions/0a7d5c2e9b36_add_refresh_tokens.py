@@ -0,0 +1,46 @@
+"""add refresh tokens
+
+Revision ID: 0a7d5c2e9b36
+Revises: 8e2a4f7c1d90
+Create Date: 2026-10-19 18:33:12.948675
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from database.sharding import holds_table
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0a7d5c2e9b36'
+down_revision: Union[str, None] = '8e2a4f7c1d90'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    if not holds_table(op.get_context().opts.get("shard_role"), "refresh_tokens"):
+        return
+    op.create_table(
+        "refresh_tokens",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("family_id", sa.String(length=32), nullable=False),
+        sa.Column("token_hash", sa.String(length=64), nullable=False),
+        sa.Column("expires_at", sa.DateTime(), nullable=False),
+        sa.Column("used_at", sa.DateTime(), nullable=True),
+        sa.Column("revoked_at", sa.DateTime(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"]),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("token_hash"),
+    )
+    op.create_index("ix_refresh_tokens_user_id", "refresh_tokens", ["user_id"])
+    op.create_index("ix_refresh_tokens_family_id", "refresh_tokens", ["family_id"])
+
+
+def downgrade() -> None:
+    if holds_table(op.get_context().opts.get("shard_role"), "refresh_tokens"):
+        op.drop_table("refresh_tokens")
@@ -0,0 +1,84 @@
+"""baseline schema
+
+Revision ID: 1b7e0c5d3a90
+Revises:
+Create Date: 2026-10-19 17:40:02.361570
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from database.sharding import holds_table
+
+
+# revision identifiers, used by Alembic.
+revision: str = '1b7e0c5d3a90'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _users():
+    op.create_table(
+        "users",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("username", sa.String(length=20), nullable=False),
+        sa.Column("email", sa.String(length=50), nullable=False),
+        sa.Column("password", sa.String(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("email"),
+        sa.UniqueConstraint("username"),
+    )
+
+
+def _posts():
+    op.create_table(
+        "posts",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("title", sa.String(length=255), nullable=True),
+        sa.Column("content", sa.String(length=10000), nullable=True),
+        sa.Column("user_id", sa.Integer(), nullable=True),
+        sa.Column("auto_replay_enabled", sa.Boolean(), nullable=True),
+        sa.Column("auto_replay_delay", sa.Integer(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+
+
+def _comments():
+    op.create_table(
+        "comments",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("content", sa.String(length=500), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=True),
+        sa.Column("post_id", sa.Integer(), nullable=True),
+        sa.Column("is_blocked", sa.Boolean(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(["post_id"], ["posts.id"]),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+
+
+# In dependency order.
+TABLES = {"users": _users, "posts": _posts, "comments": _comments}
+
+
+def upgrade() -> None:
+    # Databases set up before the first revision already have these tables; upgrading them
+    # creates nothing here and carries on with the later revisions.
+    role = op.get_context().opts.get("shard_role")
+    inspector = sa.inspect(op.get_bind())
+    for name, create in TABLES.items():
+        if holds_table(role, name) and not inspector.has_table(name):
+            create()
+
+
+def downgrade() -> None:
+    role = op.get_context().opts.get("shard_role")
+    for name in reversed(TABLES):
+        if holds_table(role, name):
+            op.drop_table(name)
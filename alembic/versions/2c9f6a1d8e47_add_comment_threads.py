@@ -0,0 +1,43 @@
+"""add comment threads
+
+Revision ID: 2c9f6a1d8e47
+Revises: b8e14d6a0c52
+Create Date: 2026-10-19 18:02:33.590142
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from database.sharding import holds_table
+
+
+# revision identifiers, used by Alembic.
+revision: str = '2c9f6a1d8e47'
+down_revision: Union[str, None] = 'b8e14d6a0c52'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    if not holds_table(op.get_context().opts.get("shard_role"), "comments"):
+        return
+    # SQLite can add a column with a reference without rebuilding the table, but Alembic only
+    # knows the rebuild. Existing comments get their paths from the comment-thread-paths online
+    # migration.
+    op.execute("ALTER TABLE comments ADD COLUMN parent_id INTEGER REFERENCES comments (id)")
+    op.add_column("comments", sa.Column("path", sa.String(length=231), nullable=True))
+    op.add_column("comments", sa.Column("depth", sa.Integer(), server_default="0", nullable=False))
+    op.create_index("ix_comments_parent_id", "comments", ["parent_id"])
+    op.create_index("ix_comments_path", "comments", ["path"])
+
+
+def downgrade() -> None:
+    if not holds_table(op.get_context().opts.get("shard_role"), "comments"):
+        return
+    op.drop_index("ix_comments_path", table_name="comments")
+    op.drop_index("ix_comments_parent_id", table_name="comments")
+    with op.batch_alter_table("comments", reflect_kwargs={"resolve_fks": False}) as batch_op:
+        for name in ("depth", "path", "parent_id"):
+            batch_op.drop_column(name)
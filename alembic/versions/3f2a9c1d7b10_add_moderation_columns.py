@@ -0,0 +1,47 @@
+"""add admins, comment moderation and job progress
+
+Revision ID: 3f2a9c1d7b10
+Revises: 6b1f9e3a7c58
+Create Date: 2026-10-19 18:54:12.418320
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from database.sharding import holds_table
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f2a9c1d7b10'
+down_revision: Union[str, None] = '6b1f9e3a7c58'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _columns():
+    """The new columns of the tables this database holds."""
+    role = op.get_context().opts.get("shard_role")
+    archives = [
+        name for name in sa.inspect(op.get_bind()).get_table_names() if name.startswith("comments_archive_")
+    ]
+    columns = [
+        ("users", sa.Column("is_admin", sa.Boolean(), server_default=sa.false(), nullable=False)),
+        *((table, sa.Column("moderated_at", sa.DateTime(), nullable=True)) for table in ["comments", *archives]),
+        ("jobs", sa.Column("total", sa.Integer(), nullable=True)),
+        ("jobs", sa.Column("params", sa.JSON(), nullable=True)),
+    ]
+    return [(table, column) for table, column in columns if holds_table(role, table)]
+
+
+def upgrade() -> None:
+    # Adding a nullable or defaulted column only rewrites the schema in SQLite, not the rows.
+    for table, column in _columns():
+        op.add_column(table, column)
+
+
+def downgrade() -> None:
+    for table, column in _columns():
+        with op.batch_alter_table(table, reflect_kwargs={"resolve_fks": False}) as batch_op:
+            batch_op.drop_column(column.name)
@@ -0,0 +1,42 @@
+"""add change log
+
+Revision ID: 4d0e7b2c9a13
+Revises: 1b7e0c5d3a90
+Create Date: 2026-10-19 17:48:15.027431
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from database.sharding import holds_table
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4d0e7b2c9a13'
+down_revision: Union[str, None] = '1b7e0c5d3a90'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    if not holds_table(op.get_context().opts.get("shard_role"), "changes"):
+        return
+    op.create_table(
+        "changes",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("entity", sa.String(length=50), nullable=False),
+        sa.Column("entity_id", sa.Integer(), nullable=False),
+        sa.Column("op", sa.String(length=10), nullable=False),
+        sa.Column("payload", sa.JSON(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+        sqlite_autoincrement=True,
+    )
+    op.create_index("ix_changes_entity_row", "changes", ["entity", "entity_id"])
+
+
+def downgrade() -> None:
+    if holds_table(op.get_context().opts.get("shard_role"), "changes"):
+        op.drop_table("changes")
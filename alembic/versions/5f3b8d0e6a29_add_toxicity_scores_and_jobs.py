@@ -0,0 +1,55 @@
+"""add toxicity scores and jobs
+
+Revision ID: 5f3b8d0e6a29
+Revises: 2c9f6a1d8e47
+Create Date: 2026-10-19 18:24:50.276903
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from database.sharding import holds_table
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5f3b8d0e6a29'
+down_revision: Union[str, None] = '2c9f6a1d8e47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    role = op.get_context().opts.get("shard_role")
+    if holds_table(role, "comments"):
+        # Existing comments stay unscored until `python -m comments.backfill` reaches them.
+        op.add_column("comments", sa.Column("toxicity_score", sa.Float(), nullable=True))
+        op.add_column("comments", sa.Column("toxicity_model", sa.String(length=64), nullable=True))
+        op.add_column("comments", sa.Column("scored_at", sa.DateTime(), nullable=True))
+        op.create_index("ix_comments_toxicity_score", "comments", ["toxicity_score"])
+    if holds_table(role, "jobs"):
+        op.create_table(
+            "jobs",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("name", sa.String(length=100), nullable=False),
+            sa.Column("status", sa.String(length=20), nullable=False),
+            sa.Column("cursor", sa.Integer(), nullable=False),
+            sa.Column("processed", sa.Integer(), nullable=False),
+            sa.Column("error", sa.String(length=500), nullable=True),
+            sa.Column("created_at", sa.DateTime(), nullable=False),
+            sa.Column("updated_at", sa.DateTime(), nullable=False),
+            sa.PrimaryKeyConstraint("id"),
+        )
+        op.create_index("ix_jobs_name", "jobs", ["name"])
+
+
+def downgrade() -> None:
+    role = op.get_context().opts.get("shard_role")
+    if holds_table(role, "jobs"):
+        op.drop_table("jobs")
+    if holds_table(role, "comments"):
+        op.drop_index("ix_comments_toxicity_score", table_name="comments")
+        with op.batch_alter_table("comments", reflect_kwargs={"resolve_fks": False}) as batch_op:
+            for name in ("scored_at", "toxicity_model", "toxicity_score"):
+                batch_op.drop_column(name)
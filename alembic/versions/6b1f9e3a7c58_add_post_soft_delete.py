@@ -0,0 +1,35 @@
+"""add post soft delete
+
+Revision ID: 6b1f9e3a7c58
+Revises: 0a7d5c2e9b36
+Create Date: 2026-10-19 18:50:04.503817
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from database.sharding import holds_table
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6b1f9e3a7c58'
+down_revision: Union[str, None] = '0a7d5c2e9b36'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    if not holds_table(op.get_context().opts.get("shard_role"), "posts"):
+        return
+    op.add_column("posts", sa.Column("deleted_at", sa.DateTime(), nullable=True))
+    op.create_index("ix_posts_deleted_at", "posts", ["deleted_at"])
+
+
+def downgrade() -> None:
+    if not holds_table(op.get_context().opts.get("shard_role"), "posts"):
+        return
+    op.drop_index("ix_posts_deleted_at", table_name="posts")
+    with op.batch_alter_table("posts", reflect_kwargs={"resolve_fks": False}) as batch_op:
+        batch_op.drop_column("deleted_at")
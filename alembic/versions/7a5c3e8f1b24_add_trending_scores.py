@@ -0,0 +1,47 @@
+"""add trending scores
+
+Revision ID: 7a5c3e8f1b24
+Revises: 4d0e7b2c9a13
+Create Date: 2026-10-19 17:55:41.803216
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from database.sharding import holds_table
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7a5c3e8f1b24'
+down_revision: Union[str, None] = '4d0e7b2c9a13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    role = op.get_context().opts.get("shard_role")
+    if holds_table(role, "post_scores"):
+        op.create_table(
+            "post_scores",
+            sa.Column("post_id", sa.Integer(), nullable=False),
+            sa.Column("score", sa.Float(), nullable=False),
+            sa.ForeignKeyConstraint(["post_id"], ["posts.id"]),
+            sa.PrimaryKeyConstraint("post_id"),
+        )
+        op.create_index("ix_post_scores_score", "post_scores", ["score"])
+    if holds_table(role, "trending_epoch"):
+        op.create_table(
+            "trending_epoch",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("epoch", sa.Float(), nullable=False),
+            sa.PrimaryKeyConstraint("id"),
+        )
+
+
+def downgrade() -> None:
+    role = op.get_context().opts.get("shard_role")
+    for name in ("trending_epoch", "post_scores"):
+        if holds_table(role, name):
+            op.drop_table(name)
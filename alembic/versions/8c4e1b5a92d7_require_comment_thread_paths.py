@@ -0,0 +1,48 @@
+"""require thread paths on every comment
+
+Revision ID: 8c4e1b5a92d7
+Revises: 3f2a9c1d7b10
+Create Date: 2026-10-19 19:07:45.902117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+from database.online_migrations import require
+from database.sharding import holds_table
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8c4e1b5a92d7'
+down_revision: Union[str, None] = '3f2a9c1d7b10'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# SQLite can only make a column NOT NULL by copying the whole table under one write lock;
+# triggers refuse new NULL paths without touching the rows. See comments.models.PATH_TRIGGERS.
+TRIGGERS = {
+    "comments_path_not_null_insert": "BEFORE INSERT ON comments",
+    "comments_path_not_null_update": "BEFORE UPDATE OF path ON comments",
+}
+
+
+def upgrade() -> None:
+    if not holds_table(op.get_context().opts.get("shard_role"), "comments"):
+        return
+    # Comments written before threaded replies are filled in online first:
+    #     python -m database.online_migrations comment-thread-paths
+    if not op.get_context().as_sql:
+        require(op.get_bind(), "comment-thread-paths")
+    for name, event in TRIGGERS.items():
+        op.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {name} {event} WHEN NEW.path IS NULL "
+            "BEGIN SELECT RAISE(ABORT, 'NOT NULL constraint failed: comments.path'); END"
+        )
+
+
+def downgrade() -> None:
+    if not holds_table(op.get_context().opts.get("shard_role"), "comments"):
+        return
+    for name in TRIGGERS:
+        op.execute(f"DROP TRIGGER IF EXISTS {name}")
@@ -0,0 +1,43 @@
+"""add comment archive catalog
+
+Revision ID: 8e2a4f7c1d90
+Revises: 5f3b8d0e6a29
+Create Date: 2026-10-19 18:26:37.651280
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from database.sharding import holds_table
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8e2a4f7c1d90'
+down_revision: Union[str, None] = '5f3b8d0e6a29'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # The monthly archive tables themselves are created on demand by comments/archive.py.
+    role = op.get_context().opts.get("shard_role")
+    if holds_table(role, "comment_archives"):
+        op.create_table(
+            "comment_archives",
+            sa.Column("month", sa.String(length=6), nullable=False),
+            sa.Column("table_name", sa.String(length=64), nullable=False),
+            sa.Column("row_count", sa.Integer(), nullable=False),
+            sa.PrimaryKeyConstraint("month"),
+        )
+    if holds_table(role, "comments"):
+        op.create_index("ix_comments_created_at", "comments", ["created_at"])
+
+
+def downgrade() -> None:
+    role = op.get_context().opts.get("shard_role")
+    if holds_table(role, "comments"):
+        op.drop_index("ix_comments_created_at", table_name="comments")
+    if holds_table(role, "comment_archives"):
+        op.drop_table("comment_archives")
@@ -0,0 +1,93 @@
+import random
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from comments.models import Comment
+from posts.models import Post
+from users.models import User
+from users.services import hase_password
+
+BENCH_PASSWORD = "benchpassword"
+
+
+def zipf_weights(n: int, s: float = 1.1):
+    return [1 / (rank ** s) for rank in range(1, n + 1)]
+
+
+def _insert_chunked(db: Session, model, rows, chunk_size):
+    for start in range(0, len(rows), chunk_size):
+        db.execute(insert(model), rows[start:start + chunk_size])
+
+
+def generate(
+        db: Session,
+        users: int = 100,
+        posts: int = 1000,
+        comments: int = 10000,
+        days: int = 90,
+        seed: int = 42,
+        now: datetime | None = None,
+        chunk_size: int = 5000,
+):
+    """Fill an empty database with a reproducible, skewed dataset.
+
+    A few authors write most posts, recent posts draw most comments and a
+    few commenters are responsible for most of the activity.
+    """
+    rng = random.Random(seed)
+    now = now or datetime.now()
+    password = hase_password(BENCH_PASSWORD)
+
+    user_ids = list(range(1, users + 1))
+    _insert_chunked(db, User, [
+        {"id": i, "username": f"user{i}", "email": f"user{i}@example.com", "password": password}
+        for i in user_ids
+    ], chunk_size)
+
+    authors = rng.choices(user_ids, weights=zipf_weights(users), k=posts)
+    post_times = sorted(
+        (now - timedelta(seconds=rng.uniform(0, days * 86400)) for _ in range(posts)),
+        reverse=True,
+    )
+    post_rows = [
+        {
+            "id": i + 1,
+            "title": f"Post {i + 1}",
+            "content": " ".join(rng.choices(WORDS, k=rng.randint(20, 200))),
+            "user_id": authors[i],
+            "auto_replay_enabled": rng.random() < 0.1,
+            "auto_replay_delay": rng.randint(1, 5),
+            "created_at": post_times[i],
+        }
+        for i in range(posts)
+    ]
+    _insert_chunked(db, Post, post_rows, chunk_size)
+
+    # Post ids are ordered newest first, so zipf weights favour recent posts.
+    commenters = rng.sample(user_ids, len(user_ids))
+    targets = rng.choices(post_rows, weights=zipf_weights(posts), k=comments)
+    comment_users = rng.choices(commenters, weights=zipf_weights(users), k=comments)
+    comment_rows = []
+    for i, post in enumerate(targets):
+        delay = timedelta(seconds=rng.expovariate(1 / 86400))
+        comment_rows.append({
+            "id": i + 1,
+            "content": " ".join(rng.choices(WORDS, k=rng.randint(3, 60))),
+            "post_id": post["id"],
+            "user_id": comment_users[i],
+            "is_blocked": rng.random() < 0.05,
+            "created_at": min(post["created_at"] + delay, now),
+        })
+    _insert_chunked(db, Comment, comment_rows, chunk_size)
+
+    db.commit()
+    return {"users": users, "posts": posts, "comments": comments}
+
+
+WORDS = (
+    "the quick brown fox jumps over lazy dog api server request response cache "
+    "database query index latency throughput comment post user thread reply great "
+    "thanks agree disagree interesting question answer idea update release bug fix"
+).split()
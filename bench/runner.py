@@ -0,0 +1,209 @@
+"""Benchmark the API in-process against a synthetic dataset.
+
+    python -m bench.runner --requests 2000 --concurrency 16
+    python -m bench.runner --save-baseline
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from bench.dataset import BENCH_PASSWORD, generate, zipf_weights
+from bench.stubs import StubServer
+
+BASELINE_PATH = Path(__file__).with_name("baseline.json")
+
+WORKLOADS = {
+    "list_posts": 0.15,
+    "get_post": 0.4,
+    "get_comments": 0.3,
+    "create_comment": 0.1,
+    "login": 0.05,
+}
+
+
+def percentile(values, q: float):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, math.ceil(q / 100 * len(ordered)) - 1)
+    return ordered[index]
+
+
+def summarize(latencies: dict, errors: dict, elapsed: float):
+    report = {}
+    for name, values in latencies.items():
+        report[name] = {
+            "count": len(values),
+            "errors": errors.get(name, 0),
+            "rps": round(len(values) / elapsed, 2),
+            "p50": round(percentile(values, 50), 2),
+            "p95": round(percentile(values, 95), 2),
+            "p99": round(percentile(values, 99), 2),
+        }
+    return report
+
+
+def compare(report: dict, baseline: dict, tolerance: float):
+    regressions = []
+    for name, current in report.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        if current["p95"] > previous["p95"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {previous['p95']}ms -> {current['p95']}ms")
+        if current["rps"] < previous["rps"] * (1 - tolerance):
+            regressions.append(f"{name}: rps {previous['rps']} -> {current['rps']}")
+    return regressions
+
+
+def print_report(report: dict):
+    print(f"{'endpoint':<16}{'count':>8}{'errors':>8}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, row in sorted(report.items()):
+        print(
+            f"{name:<16}{row['count']:>8}{row['errors']:>8}{row['rps']:>10}"
+            f"{row['p50']:>10}{row['p95']:>10}{row['p99']:>10}"
+        )
+
+
+async def run_workload(app, args):
+    import httpx
+
+    rng = random.Random(args.seed)
+    post_ids = list(range(1, args.posts + 1))
+    post_weights = zipf_weights(args.posts)
+    bench_users = [f"user{i}" for i in range(1, min(args.users, 10) + 1)]
+    operations = rng.choices(list(WORKLOADS), weights=list(WORKLOADS.values()), k=args.requests)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        tokens = {}
+        for username in bench_users:
+            response = await client.post("/token", data={"username": username, "password": BENCH_PASSWORD})
+            tokens[username] = response.json()["access_token"]
+
+        def build(name):
+            post_id = rng.choices(post_ids, weights=post_weights)[0]
+            username = rng.choice(bench_users)
+            if name == "list_posts":
+                return "GET", "/posts/", {}
+            if name == "get_post":
+                return "GET", f"/posts/{post_id}", {}
+            if name == "get_comments":
+                return "GET", f"/comments/{post_id}", {}
+            if name == "create_comment":
+                return "POST", f"/posts/{post_id}/comments", {
+                    "json": {"content": "Benchmark comment"},
+                    "headers": {"Authorization": f"Bearer {tokens[username]}"},
+                }
+            return "POST", "/token", {"data": {"username": username, "password": BENCH_PASSWORD}}
+
+        requests = [(name, *build(name)) for name in operations]
+        queue = asyncio.Queue()
+        for request in requests:
+            queue.put_nowait(request)
+
+        latencies = {name: [] for name in WORKLOADS}
+        errors = {}
+
+        async def worker():
+            while not queue.empty():
+                name, method, url, kwargs = queue.get_nowait()
+                start = time.perf_counter()
+                response = await client.request(method, url, **kwargs)
+                latencies[name].append((time.perf_counter() - start) * 1000)
+                if response.status_code >= 500 or response.status_code == 429:
+                    errors[name] = errors.get(name, 0) + 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - start
+
+    return summarize(latencies, errors, elapsed), len(requests) / elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--posts", type=int, default=1000)
+    parser.add_argument("--comments", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--api-latency", type=float, default=0.05, help="stub API latency in seconds")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    stub = StubServer(latency=args.api_latency).start()
+    os.environ["PERSPECTIVE_DISCOVERY_URL"] = stub.perspective_discovery_url
+    os.environ["COHERE_BASE_URL"] = stub.url.rstrip("/")
+    for name in ("SECRET_KEY", "PERSPECTIVE_API_KEY", "COHERE_API_KEY"):
+        os.environ.setdefault(name, "bench")
+    for name in ("LOGIN", "REGISTER", "CREATE_POST", "CREATE_COMMENT", "UPDATE_COMMENT"):
+        os.environ.setdefault(f"RATE_LIMIT_{name}", "1000000/1")
+
+    # The application reads its configuration at import time.
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+
+    from database.engine import Base, get_db
+    from database.instrumentation import instrument
+    from main import app
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(
+            f"sqlite:///{directory}/bench.db", connect_args={"check_same_thread": False}
+        )
+        instrument(engine)
+        Base.metadata.create_all(bind=engine)
+        SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+        with SessionLocal() as db:
+            generate(db, users=args.users, posts=args.posts, comments=args.comments, seed=args.seed)
+
+        def bench_get_db():
+            db = SessionLocal()
+            try:
+                yield db
+            finally:
+                db.close()
+
+        app.dependency_overrides[get_db] = bench_get_db
+        try:
+            report, total_rps = asyncio.run(run_workload(app, args))
+        finally:
+            # Scheduled auto-replies still need the stub and the database.
+            for thread in threading.enumerate():
+                if isinstance(thread, threading.Timer):
+                    thread.join()
+            app.dependency_overrides.pop(get_db, None)
+            stub.stop()
+            engine.dispose()
+
+    print_report(report)
+    print(f"\ntotal: {total_rps:.1f} rps")
+
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(report, indent=2))
+        print(f"baseline saved to {args.baseline}")
+        return 0
+
+    if args.baseline.exists():
+        regressions = compare(report, json.loads(args.baseline.read_text()), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,66 @@
+"""Compare CPU time per list response: ORM + Pydantic + FastAPI encoder vs column tuples + orjson.
+
+    python -m bench.serialization --posts 1000 --repeat 20
+"""
+import argparse
+import json
+import time
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from bench.dataset import generate
+from core.responses import rows_response
+from database.engine import Base
+from posts import crud, schemas
+
+posts_adapter = TypeAdapter(list[schemas.Post])
+
+
+def pydantic_path(db):
+    # What FastAPI does for a response_model endpoint returning ORM objects.
+    posts = crud.get_all_posts(db)
+    validated = posts_adapter.validate_python(posts, from_attributes=True)
+    content = jsonable_encoder(posts_adapter.dump_python(validated, mode="json"))
+    return json.dumps(content, separators=(",", ":")).encode()
+
+
+def fast_path(db):
+    return rows_response(crud.POST_FIELDS, crud.get_all_post_rows(db)).body
+
+
+def cpu_per_call(fn, db, repeat):
+    fn(db)
+    start = time.process_time()
+    for _ in range(repeat):
+        db.expunge_all()
+        fn(db)
+    return (time.process_time() - start) / repeat
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--posts", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    engine = create_engine("sqlite:///:memory:", poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    generate(db, users=50, posts=args.posts, comments=0)
+
+    assert json.loads(pydantic_path(db)) == json.loads(fast_path(db))
+
+    before = cpu_per_call(pydantic_path, db, args.repeat)
+    after = cpu_per_call(fast_path, db, args.repeat)
+    print(f"GET /posts/ with {args.posts} posts, CPU per response")
+    print(f"  orm + pydantic + jsonable_encoder: {before * 1000:8.2f} ms")
+    print(f"  column tuples + orjson:            {after * 1000:8.2f} ms")
+    print(f"  speedup:                           {before / after:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
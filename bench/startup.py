@@ -0,0 +1,57 @@
+"""Measure application import time and resident memory in fresh interpreters.
+
+    python -m bench.startup --runs 5
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+SNIPPET = """
+import json, sys, time
+import psutil
+start = time.perf_counter()
+{imports}
+seconds = time.perf_counter() - start
+print(json.dumps({{
+    "seconds": seconds,
+    "rss_mb": psutil.Process().memory_info().rss / 2 ** 20,
+    "sdks": sorted(m for m in ("cohere", "googleapiclient") if m in sys.modules),
+}}))
+"""
+
+SCENARIOS = {
+    "app": "import main",
+    "app + AI SDKs": "import main, cohere, googleapiclient.discovery",
+}
+
+
+def measure(imports: str, runs: int):
+    samples = []
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-c", SNIPPET.format(imports=imports)],
+            capture_output=True, text=True, check=True,
+        )
+        samples.append(json.loads(result.stdout.strip().splitlines()[-1]))
+    return {
+        "seconds": statistics.median(s["seconds"] for s in samples),
+        "rss_mb": statistics.median(s["rss_mb"] for s in samples),
+        "sdks": samples[-1]["sdks"],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    print(f"{'scenario':<16}{'import s':>10}{'rss MB':>10}  sdks loaded")
+    for name, imports in SCENARIOS.items():
+        result = measure(imports, args.runs)
+        print(f"{name:<16}{result['seconds']:>10.3f}{result['rss_mb']:>10.1f}  {', '.join(result['sdks']) or '-'}")
+
+
+if __name__ == "__main__":
+    main()
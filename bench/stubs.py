@@ -0,0 +1,111 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def perspective_discovery(root_url: str):
+    return {
+        "kind": "discovery#restDescription",
+        "discoveryVersion": "v1",
+        "id": "commentanalyzer:v1alpha1",
+        "name": "commentanalyzer",
+        "version": "v1alpha1",
+        "protocol": "rest",
+        "rootUrl": root_url,
+        "servicePath": "",
+        "baseUrl": root_url,
+        "parameters": {},
+        "schemas": {
+            "AnalyzeCommentRequest": {"id": "AnalyzeCommentRequest", "type": "object"},
+            "AnalyzeCommentResponse": {"id": "AnalyzeCommentResponse", "type": "object"},
+        },
+        "resources": {
+            "comments": {
+                "methods": {
+                    "analyze": {
+                        "id": "commentanalyzer.comments.analyze",
+                        "path": "v1alpha1/comments:analyze",
+                        "flatPath": "v1alpha1/comments:analyze",
+                        "httpMethod": "POST",
+                        "parameters": {},
+                        "request": {"$ref": "AnalyzeCommentRequest"},
+                        "response": {"$ref": "AnalyzeCommentResponse"},
+                    }
+                }
+            }
+        },
+    }
+
+
+class StubServer:
+    """Local stand-in for the Perspective and Cohere APIs with a fixed response latency."""
+
+    def __init__(self, latency: float = 0.05, toxicity: float = 0.1, reply: str = "Thanks for your comment!"):
+        self.latency = latency
+        self.toxicity = toxicity
+        self.reply = reply
+        self.requests = 0
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}/"
+
+    @property
+    def perspective_discovery_url(self):
+        return self.url + "$discovery/rest?version=v1alpha1"
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, payload):
+                body = json.dumps(payload).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path.startswith("/$discovery"):
+                    self._reply(perspective_discovery(stub.url))
+                else:
+                    self.send_error(404)
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                stub.requests += 1
+                time.sleep(stub.latency)
+                if self.path.startswith("/v1alpha1/comments:analyze"):
+                    score = {"value": stub.toxicity, "type": "PROBABILITY"}
+                    self._reply({
+                        "attributeScores": {
+                            "TOXICITY": {"spanScores": [{"score": score}], "summaryScore": score}
+                        }
+                    })
+                elif self.path.startswith("/v2/chat"):
+                    self._reply({
+                        "id": "stub",
+                        "finish_reason": "COMPLETE",
+                        "message": {"role": "assistant", "content": [{"type": "text", "text": stub.reply}]},
+                    })
+                else:
+                    self.send_error(404)
+
+        return Handler
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
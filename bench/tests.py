@@ -0,0 +1,85 @@
+import json
+import urllib.request
+from collections import Counter
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from bench.dataset import generate
+from bench.runner import compare, percentile, summarize
+from bench.stubs import StubServer
+from comments.models import Comment
+from database.engine import Base
+from posts.models import Post
+
+NOW = datetime(2024, 6, 1)
+
+
+def make_session():
+    engine = create_engine(
+        "sqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(bind=engine)()
+
+
+@pytest.fixture(scope="module")
+def dataset():
+    db = make_session()
+    generate(db, users=20, posts=100, comments=1000, seed=7, now=NOW)
+    return db
+
+
+def test_dataset_is_reproducible(dataset):
+    other = make_session()
+    generate(other, users=20, posts=100, comments=1000, seed=7, now=NOW)
+
+    def rows(db):
+        return [(c.post_id, c.user_id, c.content) for c in db.query(Comment).order_by(Comment.id)]
+
+    assert rows(dataset) == rows(other)
+
+
+def test_dataset_is_skewed(dataset):
+    posts_per_author = Counter(p.user_id for p in dataset.query(Post))
+    comments_per_post = Counter(c.post_id for c in dataset.query(Comment))
+
+    assert posts_per_author.most_common(1)[0][1] > 100 / 20 * 3
+    assert comments_per_post[1] > comments_per_post.get(100, 0)
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 95) == 95
+    assert percentile(values, 99) == 99
+    assert percentile([], 50) == 0.0
+
+
+def test_compare_flags_regressions():
+    baseline = summarize({"get_post": [10.0] * 100}, {}, elapsed=1.0)
+    slower = summarize({"get_post": [20.0] * 50}, {}, elapsed=1.0)
+
+    regressions = compare(slower, baseline, tolerance=0.2)
+    assert regressions == ["get_post: p95 10.0ms -> 20.0ms", "get_post: rps 100.0 -> 50.0"]
+    assert compare(baseline, baseline, tolerance=0.2) == []
+
+
+def test_stub_server_answers_perspective_requests():
+    stub = StubServer(latency=0, toxicity=0.9).start()
+    try:
+        request = urllib.request.Request(
+            stub.url + "v1alpha1/comments:analyze", data=b"{}", method="POST"
+        )
+        with urllib.request.urlopen(request) as response:
+            body = json.load(response)
+    finally:
+        stub.stop()
+
+    assert body["attributeScores"]["TOXICITY"]["spanScores"][0]["score"]["value"] == 0.9
+    assert stub.requests == 1
@@ -0,0 +1,99 @@
+import datetime
+from collections import defaultdict
+
+from sqlalchemy import event, func, insert, inspect, select
+from sqlalchemy.orm import Session
+
+from changes.models import Change
+from comments.models import Comment
+from posts.models import Post
+
+TRACKED_MODELS = (Post, Comment)
+
+
+def snapshot(row) -> dict:
+    """Every column of the row, so compaction can keep only the latest change of each row."""
+    return {
+        key: value.isoformat() if isinstance(value, (datetime.datetime, datetime.date)) else value
+        for key, value in row.items()
+    }
+
+
+def _snapshots(session: Session, inserted, updated) -> dict:
+    """Payloads by object. Updated rows with expired columns are read back, one query per table and database."""
+    payloads, expired = {}, defaultdict(list)
+    for obj in inserted:
+        # No tracked column has a server default, so what the INSERT left out is NULL.
+        state = inspect(obj)
+        payloads[obj] = snapshot({key: state.dict.get(key) for key in obj.__table__.columns.keys()})
+    for obj in updated:
+        state = inspect(obj)
+        columns = obj.__table__.columns.keys()
+        if state.unloaded.intersection(columns):
+            connection = session.connection(bind_arguments={"mapper": state.mapper, "instance": obj})
+            expired[obj.__table__, connection].append(obj)
+        else:
+            payloads[obj] = snapshot({key: state.dict[key] for key in columns})
+    for (table, connection), objs in expired.items():
+        rows = connection.execute(select(table).where(table.c.id.in_([obj.id for obj in objs]))).mappings()
+        by_id = {row["id"]: snapshot(row) for row in rows}
+        for obj in objs:
+            payloads[obj] = by_id[obj.id]
+    return payloads
+
+
+def change_row(entity: str, entity_id: int, op: str, payload: dict | None = None):
+    return {
+        "entity": entity,
+        "entity_id": entity_id,
+        "op": op,
+        "payload": payload,
+        "created_at": datetime.datetime.now(datetime.UTC),
+    }
+
+
+def record_change(db: Session, entity: str, entity_id: int, op: str, payload: dict | None = None):
+    db.execute(insert(Change.__table__), [change_row(entity, entity_id, op, payload)])
+
+
+@event.listens_for(Session, "after_flush")
+def track_changes(session, flush_context):
+    inserted = [obj for obj in session.new if isinstance(obj, TRACKED_MODELS)]
+    updated = [
+        obj for obj in session.dirty
+        if isinstance(obj, TRACKED_MODELS) and session.is_modified(obj, include_collections=False)
+    ]
+    payloads = _snapshots(session, inserted, updated)
+
+    rows = []
+    for obj in inserted:
+        rows.append(change_row(obj.__tablename__, obj.id, "insert", payloads[obj]))
+    for obj in updated:
+        rows.append(change_row(obj.__tablename__, obj.id, "update", payloads[obj]))
+    for obj in session.deleted:
+        if isinstance(obj, TRACKED_MODELS):
+            rows.append(change_row(obj.__tablename__, obj.id, "delete"))
+
+    if rows:
+        session.connection().execute(insert(Change.__table__), rows)
+
+
+def get_changes(db: Session, cursor: int = 0, limit: int = 500):
+    return (
+        db.query(Change)
+        .filter(Change.id > cursor)
+        .order_by(Change.id)
+        .limit(limit)
+        .all()
+    )
+
+
+def compact_changes(db: Session, before: datetime.datetime):
+    latest = select(func.max(Change.id)).group_by(Change.entity, Change.entity_id)
+    deleted = (
+        db.query(Change)
+        .filter(Change.created_at < before, Change.id.not_in(latest))
+        .delete(synchronize_session=False)
+    )
+    db.commit()
+    return deleted
@@ -0,0 +1,20 @@
+import datetime
+
+from sqlalchemy import Column, Integer, String, DateTime, JSON, Index
+
+from database.engine import Base
+
+
+class Change(Base):
+    __tablename__ = "changes"
+    __table_args__ = (
+        Index("ix_changes_entity_row", "entity", "entity_id"),
+        {"sqlite_autoincrement": True},
+    )
+
+    id = Column(Integer, primary_key=True)
+    entity = Column(String(50), nullable=False)
+    entity_id = Column(Integer, nullable=False)
+    op = Column(String(10), nullable=False)
+    payload = Column(JSON, nullable=True)
+    created_at = Column(DateTime, default=lambda: datetime.datetime.now(datetime.UTC), nullable=False)
@@ -0,0 +1,36 @@
+import os
+from datetime import datetime, timedelta, UTC
+
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.orm import Session
+
+from changes import crud, schemas
+from database.engine import get_db
+from users import models, services
+
+CHANGES_COMPACT_AFTER_DAYS = int(os.getenv("CHANGES_COMPACT_AFTER_DAYS", 7))
+
+changes_router = APIRouter()
+
+
+@changes_router.get("/changes", response_model=schemas.ChangeBatch)
+def get_changes(
+        cursor: int = 0,
+        limit: int = Query(500, ge=1, le=1000),
+        user: models.User = Depends(services.get_current_admin),
+        db: Session = Depends(get_db)
+):
+    # Payloads are whole rows, including soft-deleted posts and toxicity scores.
+    changes = crud.get_changes(db, cursor=cursor, limit=limit)
+    next_cursor = changes[-1].id if changes else cursor
+    return {"changes": changes, "next_cursor": next_cursor, "has_more": len(changes) == limit}
+
+
+@changes_router.post("/changes/compact")
+def compact_changes(
+        older_than_days: int = CHANGES_COMPACT_AFTER_DAYS,
+        user: models.User = Depends(services.get_current_admin),
+        db: Session = Depends(get_db)
+):
+    before = datetime.now(UTC) - timedelta(days=older_than_days)
+    return {"deleted": crud.compact_changes(db, before=before)}
@@ -0,0 +1,21 @@
+from datetime import datetime
+
+from pydantic import BaseModel
+
+
+class Change(BaseModel):
+    id: int
+    entity: str
+    entity_id: int
+    op: str
+    payload: dict | None = None
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
+
+
+class ChangeBatch(BaseModel):
+    changes: list[Change]
+    next_cursor: int
+    has_more: bool
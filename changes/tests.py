@@ -0,0 +1,173 @@
+import pytest
+from datetime import datetime, timedelta, UTC
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from changes import crud
+from changes.models import Change
+from comments.models import Comment
+from database.engine import Base, get_db
+from main import app
+from posts import crud as posts_crud
+from posts.schemas import PostCreate
+from users.models import User
+from users.services import create_access_token
+
+# Setup test database
+SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL,
+    connect_args={"check_same_thread": False},
+    poolclass=StaticPool,
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+Base.metadata.create_all(bind=engine)
+
+
+def override_get_db():
+    db = TestingSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+app.dependency_overrides[get_db] = override_get_db
+
+client = TestClient(app)
+
+
+@pytest.fixture
+def db_session():
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    session = TestingSessionLocal()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def test_user(db_session):
+    user = User(username="testuser", email="test@example.com", password="testpassword")
+    db_session.add(user)
+    db_session.commit()
+    return user
+
+
+def create_post(db_session, user, title="Test Post"):
+    post_data = PostCreate(title=title, content="Test Content", auto_replay_enabled=False, auto_replay_delay=0)
+    return posts_crud.create_post(db_session, post_data, user.id)
+
+
+def test_users_are_not_tracked(db_session, test_user):
+    assert db_session.query(Change).count() == 0
+
+
+def test_insert_update_delete_are_recorded(db_session, test_user):
+    post = create_post(db_session, test_user)
+    post.title = "Updated Title"
+    db_session.commit()
+    db_session.delete(post)
+    db_session.commit()
+
+    changes = crud.get_changes(db_session)
+    assert [(c.entity, c.entity_id, c.op) for c in changes] == [
+        ("posts", post.id, "insert"),
+        ("posts", post.id, "update"),
+        ("posts", post.id, "delete"),
+    ]
+    assert changes[0].payload["title"] == "Test Post"
+    assert changes[1].payload["title"] == "Updated Title"
+    assert changes[2].payload is None
+
+
+def test_update_payload_is_the_whole_row(db_session, test_user):
+    post = create_post(db_session, test_user)
+    db_session.expire(post, ["content", "created_at"])
+    post.title = "Updated Title"
+    db_session.commit()
+
+    update = crud.get_changes(db_session)[-1]
+    assert update.op == "update"
+    assert update.payload["title"] == "Updated Title"
+    assert update.payload["content"] == "Test Content"
+    assert update.payload["created_at"] is not None
+
+
+def test_change_is_rolled_back_with_write(db_session, test_user):
+    db_session.add(Comment(content="Draft", post_id=1, user_id=test_user.id))
+    db_session.flush()
+    db_session.rollback()
+
+    assert db_session.query(Change).count() == 0
+
+
+def test_compact_keeps_latest_change_per_row(db_session, test_user):
+    first = create_post(db_session, test_user, title="First")
+    second = create_post(db_session, test_user, title="Second")
+    first.title = "First updated"
+    db_session.commit()
+
+    deleted = crud.compact_changes(db_session, before=datetime.now(UTC) + timedelta(days=1))
+
+    assert deleted == 1
+    changes = crud.get_changes(db_session)
+    assert [(c.entity_id, c.op) for c in changes] == [(second.id, "insert"), (first.id, "update")]
+
+
+def test_compact_skips_recent_changes(db_session, test_user):
+    post = create_post(db_session, test_user)
+    post.title = "Updated Title"
+    db_session.commit()
+
+    assert crud.compact_changes(db_session, before=datetime.now(UTC) - timedelta(days=1)) == 0
+
+
+def test_compact_endpoint_is_admin_only(db_session, test_user, admin_headers):
+    create_post(db_session, test_user)
+
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': 'testuser'})}"}
+    assert client.post("/changes/compact", headers=headers).status_code == 403
+    response = client.post("/changes/compact", params={"older_than_days": 0}, headers=admin_headers)
+    assert response.status_code == 200
+    assert response.json() == {"deleted": 0}
+
+
+@pytest.fixture
+def admin_headers(db_session):
+    db_session.add(User(username="admin", email="admin@example.com", password="x", is_admin=True))
+    db_session.commit()
+    return {"Authorization": f"Bearer {create_access_token({'sub': 'admin'})}"}
+
+
+def test_get_changes_endpoint_is_admin_only(db_session, test_user):
+    create_post(db_session, test_user)
+
+    assert client.get("/changes").status_code == 401
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': 'testuser'})}"}
+    assert client.get("/changes", headers=headers).status_code == 403
+
+
+def test_get_changes_endpoint_pages_by_cursor(db_session, test_user, admin_headers):
+    for i in range(3):
+        create_post(db_session, test_user, title=f"Post {i}")
+
+    response = client.get("/changes", params={"cursor": 0, "limit": 2}, headers=admin_headers)
+    assert response.status_code == 200
+    batch = response.json()
+    assert [c["payload"]["title"] for c in batch["changes"]] == ["Post 0", "Post 1"]
+    assert batch["has_more"] is True
+
+    response = client.get("/changes", params={"cursor": batch["next_cursor"], "limit": 2}, headers=admin_headers)
+    batch = response.json()
+    assert [c["payload"]["title"] for c in batch["changes"]] == ["Post 2"]
+    assert batch["has_more"] is False
+
+
+def test_get_changes_endpoint_empty(db_session, admin_headers):
+    response = client.get("/changes", params={"cursor": 10}, headers=admin_headers)
+    assert response.status_code == 200
+    assert response.json() == {"changes": [], "next_cursor": 10, "has_more": False}
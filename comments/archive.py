@@ -0,0 +1,146 @@
+"""Move old comments into monthly ``comments_archive_YYYYMM`` tables.
+
+    python -m comments.archive --older-than-days 180
+
+Comments are moved in small id-ordered chunks, each in its own short
+transaction, with a pause in between so the hot table stays writable.
+Every chunk is copied and deleted atomically, so an interrupted run can
+simply be started again. With DB_SHARDS set the comments live on the shards
+and the archive in the main database, so no chunk can be moved atomically;
+the archiver refuses to run.
+"""
+import argparse
+import os
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, UTC
+
+from sqlalchemy import Column, Index, MetaData, Table, delete, func, insert, select, update
+from sqlalchemy.ext.horizontal_shard import ShardedSession
+from sqlalchemy.orm import Session
+
+from comments.models import Comment, CommentArchive
+from database.engine import DB_SHARDS, SessionLocal
+from posts.models import Post
+
+ARCHIVE_AFTER_DAYS = int(os.getenv("COMMENTS_ARCHIVE_AFTER_DAYS", 180))
+ARCHIVE_CHUNK_SIZE = int(os.getenv("COMMENTS_ARCHIVE_CHUNK_SIZE", 1000))
+ARCHIVE_PAUSE_MS = int(os.getenv("COMMENTS_ARCHIVE_PAUSE_MS", 50))
+
+# Archive tables are created on demand, so they live outside Base.metadata.
+archive_metadata = MetaData()
+COLUMNS = tuple(column.name for column in Comment.__table__.columns)
+
+
+def archive_table(table_name: str) -> Table:
+    if table_name in archive_metadata.tables:
+        return archive_metadata.tables[table_name]
+    return Table(
+        table_name,
+        archive_metadata,
+        # Without the path triggers: rows archived before the thread-path backfill have no path.
+        *(
+            Column(column.name, column.type, primary_key=column.primary_key, nullable=column.nullable)
+            for column in Comment.__table__.columns
+        ),
+        Index(f"ix_{table_name}_post_id", "post_id"),
+        Index(f"ix_{table_name}_created_at", "created_at"),
+    )
+
+
+def _ensure_archive(db: Session, month: str) -> Table:
+    archive = db.get(CommentArchive, month)
+    if archive is None:
+        archive = CommentArchive(month=month, table_name=f"comments_archive_{month}", row_count=0)
+        db.add(archive)
+        db.flush()
+    table = archive_table(archive.table_name)
+    table.create(db.connection(), checkfirst=True)
+    return table
+
+
+def archive_comments(
+        db: Session,
+        before: datetime,
+        chunk_size: int = ARCHIVE_CHUNK_SIZE,
+        pause_ms: int = ARCHIVE_PAUSE_MS,
+        sleep=time.sleep,
+):
+    """Move comments created before ``before`` and return how many were moved."""
+    if isinstance(db, ShardedSession):
+        raise ValueError("Comments cannot be archived while DB_SHARDS is set")
+    comments = Comment.__table__
+    before = before.astimezone(UTC).replace(tzinfo=None)  # created_at is stored as naive UTC.
+    moved = 0
+    while True:
+        rows = db.execute(
+            select(comments.c.id, comments.c.created_at)
+            .where(comments.c.created_at < before)
+            .order_by(comments.c.id)
+            .limit(chunk_size)
+        ).all()
+        if not rows:
+            break
+
+        by_month = defaultdict(list)
+        for comment_id, created_at in rows:
+            by_month[created_at.strftime("%Y%m")].append(comment_id)
+        for month, ids in by_month.items():
+            table = _ensure_archive(db, month)
+            db.execute(insert(table).from_select(COLUMNS, select(comments).where(comments.c.id.in_(ids))))
+            db.execute(
+                update(CommentArchive)
+                .where(CommentArchive.month == month)
+                .values(row_count=CommentArchive.row_count + len(ids))
+            )
+        db.execute(delete(comments).where(comments.c.id.in_([row.id for row in rows])))
+        db.commit()
+
+        moved += len(rows)
+        if len(rows) < chunk_size:
+            break
+        sleep(pause_ms / 1000)
+    return moved
+
+
+def tables_for_post(db: Session, post_id: int) -> list[Table]:
+    """Archive tables that can hold comments on this post; none for posts newer than the archive."""
+    post_month = select(func.strftime("%Y%m", Post.created_at)).where(Post.id == post_id).scalar_subquery()
+    names = db.scalars(
+        select(CommentArchive.table_name).where(CommentArchive.month >= post_month).order_by(CommentArchive.month)
+    )
+    return [archive_table(name) for name in names]
+
+
+def all_tables(db: Session) -> list[Table]:
+    names = db.scalars(select(CommentArchive.table_name).order_by(CommentArchive.month))
+    return [archive_table(name) for name in names]
+
+
+def tables_between(db: Session, start: datetime, end: datetime) -> list[Table]:
+    names = db.scalars(
+        select(CommentArchive.table_name)
+        .where(CommentArchive.month.between(start.strftime("%Y%m"), end.strftime("%Y%m")))
+        .order_by(CommentArchive.month)
+    )
+    return [archive_table(name) for name in names]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--older-than-days", type=int, default=ARCHIVE_AFTER_DAYS)
+    parser.add_argument("--chunk-size", type=int, default=ARCHIVE_CHUNK_SIZE)
+    parser.add_argument("--pause-ms", type=int, default=ARCHIVE_PAUSE_MS)
+    args = parser.parse_args(argv)
+    if DB_SHARDS:
+        parser.error("comments cannot be archived while DB_SHARDS is set")
+
+    before = datetime.now(UTC) - timedelta(days=args.older_than_days)
+    with SessionLocal() as db:
+        moved = archive_comments(db, before, chunk_size=args.chunk_size, pause_ms=args.pause_ms)
+    print(f"Archived {moved} comments created before {before:%Y-%m-%d}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+"""Re-score historical comments with the configured toxicity provider.
+
+    python -m comments.backfill --qps 5 --chunk-size 100
+
+Chunks are id ranges, scored on every shard at once when sharded.
+Progress is checkpointed after every chunk, so an interrupted run resumes
+where it stopped. Comments already scored by the current model, or decided
+by a moderator, are skipped.
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+from sqlalchemy import func, or_, select
+from sqlalchemy.orm import Session
+
+from comments.crud import score_toxicity
+from comments.models import Comment
+from comments.providers import get_toxicity_provider
+from core.ratelimit import MemoryBackend
+from database.engine import SessionLocal
+from database.sharding import scatter
+from jobs import crud as jobs
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_QPS = float(os.getenv("TOXICITY_BACKFILL_QPS", 5))
+BACKFILL_CHUNK_SIZE = int(os.getenv("TOXICITY_BACKFILL_CHUNK_SIZE", 100))
+
+
+def job_name(model: str):
+    return f"toxicity-backfill:{model}"
+
+
+def backfill_scores(
+        db: Session,
+        qps: float = BACKFILL_QPS,
+        chunk_size: int = BACKFILL_CHUNK_SIZE,
+        limiter=None,
+        sleep=time.sleep,
+):
+    provider = get_toxicity_provider()
+    if not provider.enabled:
+        raise ValueError("The toxicity provider is disabled")
+
+    limiter = limiter or MemoryBackend(shards=1)
+    pending = (
+        Comment.moderated_at.is_(None),
+        or_(Comment.toxicity_model.is_(None), Comment.toxicity_model != provider.model),
+    )
+
+    def next_start(cursor):
+        """The id just before the next comment to score on any shard, if any."""
+        found = [
+            first for first in scatter(
+                db, lambda session: session.scalar(select(func.min(Comment.id)).where(Comment.id > cursor, *pending))
+            ) if first is not None
+        ]
+        return min(found) - 1 if found else None
+
+    def score_range(session, start, end):
+        chunk = session.scalars(
+            select(Comment).where(Comment.id > start, Comment.id <= end, *pending).order_by(Comment.id)
+        ).all()
+        for comment in chunk:
+            while wait := limiter.consume("toxicity-backfill", rate=qps, capacity=1):
+                sleep(wait)
+            for key, value in score_toxicity(comment.content).items():
+                setattr(comment, key, value)
+        return len(chunk)
+
+    job = jobs.start_job(db, job_name(provider.model))
+    try:
+        while (start := next_start(job.cursor)) is not None:
+            end = start + chunk_size
+            processed = sum(scatter(db, lambda session: score_range(session, start, end)))
+            jobs.checkpoint(job, cursor=end, processed=processed)
+            db.commit()
+            logger.info("Re-scored %d comments up to id %d", job.processed, job.cursor)
+    except Exception as exc:
+        jobs.fail_job(db, job, exc)
+        raise
+
+    jobs.finish_job(db, job)
+    return job
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--qps", type=float, default=BACKFILL_QPS)
+    parser.add_argument("--chunk-size", type=int, default=BACKFILL_CHUNK_SIZE)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    with SessionLocal() as db:
+        job = backfill_scores(db, qps=args.qps, chunk_size=args.chunk_size)
+    print(f"Re-scored {job.processed} comments")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,47 +1,120 @@
+import hashlib
 import os
 import threading
-from datetime import datetime
+from datetime import datetime, UTC
 
-import cohere
-from dotenv import load_dotenv
-from googleapiclient import discovery
-from sqlalchemy import func, and_, case
+from sqlalchemy import func, and_, bindparam, case, select, union_all
 from sqlalchemy.orm import Session
 
-from comments.models import Comment
+from comments import archive
+from comments.models import Comment, thread_path
+from comments.providers import get_reply_provider, get_toxicity_provider
+from core import cache
+from core.singleflight import single_flight
+from database.sharding import on_global, scatter
 from posts.models import Post
 
-load_dotenv()
+TOXICITY_THRESHOLD = float(os.getenv("TOXICITY_THRESHOLD", 0.7))
+TOXICITY_CACHE_TTL = int(os.getenv("TOXICITY_CACHE_TTL", 86400))
 
-perspective_api_key = os.environ.get("PERSPECTIVE_API_KEY")
-cohere_api_key = os.environ.get("COHERE_API_KEY")
+# Auto-replies waiting on their timer, by post, so deleting a post can cancel them.
+_pending_replies: dict[int, set[threading.Timer]] = {}
+_pending_lock = threading.Lock()
 
 
-def check_for_toxicity(comment):
-    client = discovery.build(
-        "commentanalyzer",
-        "v1alpha1",
-        developerKey=perspective_api_key,
-        discoveryServiceUrl="https://commentanalyzer.googleapis.com/$discovery/rest?version=v1alpha1",
-        static_discovery=False,
+def blocked_expression(c):
+    """Moderator decisions and unscored comments keep their flag; the rest are judged by the current threshold."""
+    return case(
+        (c.moderated_at.isnot(None), c.is_blocked),
+        (c.toxicity_score.is_(None), c.is_blocked),
+        else_=c.toxicity_score > bindparam("toxicity_threshold", callable_=lambda: TOXICITY_THRESHOLD),
     )
 
-    analyze_request = {
-        'comment': {'text': comment},
-        'requestedAttributes': {'TOXICITY': {}}
+
+def comment_columns(c):
+    """Columns served by the listing endpoints, for ``Comment`` or an archive table's ``.c``."""
+    return (
+        c.id,
+        c.content,
+        c.user_id,
+        c.post_id,
+        blocked_expression(c).label("is_blocked"),
+        c.created_at,
+        c.parent_id,
+        c.depth,
+    )
+
+
+blocked = blocked_expression(Comment)
+COMMENT_COLUMNS = comment_columns(Comment)
+COMMENT_FIELDS = tuple(column.key for column in COMMENT_COLUMNS)
+
+
+def score_toxicity(text):
+    """Return the fields to store on a comment for ``text``."""
+    provider = get_toxicity_provider()
+    if not provider.enabled:
+        return {"is_blocked": False}
+
+    # Short comments repeat a lot ("Great post!"); a model gives the same text the same score.
+    key = f"toxicity:{provider.model}:{hashlib.sha256(text.encode()).hexdigest()}"
+    cached = cache.backend.get(key)
+    if cached is not None:
+        score = float(cached)
+    else:
+        score = provider.score(text)
+        cache.backend.set(key, repr(score).encode(), ttl=TOXICITY_CACHE_TTL)
+    return {
+        "is_blocked": score > TOXICITY_THRESHOLD,
+        "toxicity_score": score,
+        "toxicity_model": provider.model,
+        "scored_at": datetime.now(UTC),
     }
 
-    response = client.comments().analyze(body=analyze_request).execute()
 
-    if response["attributeScores"]["TOXICITY"]["spanScores"][0]["score"]["value"] > 0.7:
-        return True
-    return False
+def check_for_toxicity(comment):
+    return score_toxicity(comment)["is_blocked"]
 
 
 def get_comments_for_post(db: Session, post_id):
     return db.query(Comment).filter(Comment.post_id == post_id).all()
 
 
+def get_comment_rows_for_post(db: Session, post_id):
+    def load():
+        tables = archive.tables_for_post(db, post_id)
+        # Comments of a deleted post stay hidden until the purge removes them.
+        post_visible = select(Post.id).where(Post.id == post_id, Post.deleted_at.is_(None)).exists()
+        query = db.query(*COMMENT_COLUMNS).filter(Comment.post_id == post_id, post_visible)
+        if not tables:
+            return query.all()
+        archived = (select(*comment_columns(t.c)).where(t.c.post_id == post_id, post_visible) for t in tables)
+        return db.execute(union_all(*archived, query.statement)).all()
+
+    return single_flight.do(("comments", post_id), load)
+
+
+def get_thread_rows(db: Session, comment_id: int, cursor: str | None = None, limit: int = 100):
+    """Return ``(rows, next_cursor)`` for the subtree under a comment, in thread order."""
+    root = db.query(*COMMENT_COLUMNS, Comment.path).filter(Comment.id == comment_id).first()
+    if root is None:
+        return None, None
+
+    prefix = root.path or thread_path(root.id)
+    # Every descendant path starts with the prefix, and "0" sorts right after "/".
+    query = db.query(*COMMENT_COLUMNS, Comment.path).filter(
+        Comment.path >= prefix, Comment.path < prefix[:-1] + "0"
+    )
+    if cursor is not None:
+        query = query.filter(Comment.path > cursor)
+    rows = query.order_by(Comment.path).limit(limit + 1).all()
+    if root.path is None and cursor is None:
+        rows.insert(0, root)
+
+    next_cursor = (rows[limit - 1].path or "") if len(rows) > limit else None
+    return [row[:-1] for row in rows[:limit]], next_cursor
+
+
 def create_comment(db: Session, comment: Comment, post_id: int, user_id: int):
     db_comment = Comment(
         content=comment.content,
@@ -56,7 +129,7 @@ def create_comment(db: Session, comment: Comment, post_id: int, user_id: int):
 
 
 def update_comment_in_db(db: Session, comment: Comment, comment_data):
-    comment.content = comment.content or comment_data.content
+    comment.content = comment_data.content
 
     db.commit()
     db.refresh(comment)
@@ -73,51 +146,82 @@ def comments_analysis(db: Session, date_from: str, date_to: str):
     date_from_dt = datetime.strptime(date_from, "%Y-%m-%d")
     date_to_dt = datetime.strptime(date_to, "%Y-%m-%d")
 
-    results = (
+    # Each shard counts its own comments and the archive, which lives in the main database, is
+    # counted once; days are merged here.
+    parts = scatter(db, lambda session: daily_counts(session, date_from_dt, date_to_dt))
+    tables = archive.tables_between(db, date_from_dt, date_to_dt)
+    if tables:
+        parts.append(on_global(db, lambda session: daily_counts(session, date_from_dt, date_to_dt, tables)))
+
+    days = {}
+    for results in parts:
+        for result in results:
+            day = days.setdefault(result.day, {"day": result.day, "total_comments": 0, "blocked_comments": 0})
+            day["total_comments"] += result.total_comments
+            day["blocked_comments"] += result.blocked_comments or 0
+
+    return [days[day] for day in sorted(days)]
+
+
+def daily_counts(db: Session, date_from_dt: datetime, date_to_dt: datetime, tables=None):
+    """Comments per day in the live table, or in the given archive tables."""
+    c = Comment
+    if tables:
+        c = union_all(*(
+            select(t.c.id, t.c.created_at, t.c.is_blocked, t.c.toxicity_score, t.c.moderated_at)
+            .where(and_(t.c.created_at >= date_from_dt, t.c.created_at < date_to_dt))
+            for t in tables
+        )).subquery().c
+
+    return (
         db.query(
-            func.strftime("%Y-%m-%d", Comment.created_at).label("day"),
-            func.count(Comment.id).label("total_comments"),
+            func.strftime("%Y-%m-%d", c.created_at).label("day"),
+            func.count(c.id).label("total_comments"),
             func.sum(
                 case(
-                    (Comment.is_blocked == True, 1),
+                    (blocked_expression(c), 1),
                     else_=0
                 )
             ).label("blocked_comments"),
         )
-        .filter(and_(Comment.created_at >= date_from_dt, Comment.created_at < date_to_dt))
-        .group_by(func.strftime("%Y-%m-%d", Comment.created_at))
+        .filter(and_(c.created_at >= date_from_dt, c.created_at < date_to_dt))
+        .group_by(func.strftime("%Y-%m-%d", c.created_at))
         .order_by("day")
         .all()
     )
 
-    return [
-        {
-            "day": result.day,
-            "total_comments": result.total_comments,
-            "blocked_comments": result.blocked_comments or 0,
-        }
-        for result in results
-    ]
 
+def auto_replay_for_comments(
+        db: Session, comment: str, post_id: int, delay: int, author_id: int, parent_id: int | None = None
+):
+    provider = get_reply_provider()
+    if not provider.enabled:
+        return
 
-def auto_replay_for_comments(db: Session, comment: str, post_id: int, delay: int, author_id: int):
     def generate_reply():
-        co = cohere.ClientV2(cohere_api_key)
-
-        response = co.chat(
-            model="command-r-plus",
-            messages=[
-                {
-                    "role": "user",
-                    "content": f"Give a response for this comment: {comment}",
-                }
-            ]
-        )
-
-        reply = list(list(dict(response)["message"])[3][1][0])[1][1]
-
-        db_comment_reply = Comment(content=reply, post_id=post_id, user_id=author_id)
+        with _pending_lock:
+            timers = _pending_replies.get(post_id)
+            if timers is not None:
+                timers.discard(timer)
+                if not timers:
+                    del _pending_replies[post_id]
+        if db.query(Post.id).filter(Post.id == post_id, Post.deleted_at.is_(None)).first() is None:
+            return
+        reply = provider.generate(comment)
+
+        db_comment_reply = Comment(content=reply, post_id=post_id, user_id=author_id, parent_id=parent_id)
         db.add(db_comment_reply)
         db.commit()
 
-    threading.Timer(delay, generate_reply).start()
+    timer = threading.Timer(delay, generate_reply)
+    with _pending_lock:
+        _pending_replies.setdefault(post_id, set()).add(timer)
+    timer.start()
+
+
+def cancel_pending_replies(post_id: int) -> int:
+    with _pending_lock:
+        timers = _pending_replies.pop(post_id, set())
+    for timer in timers:
+        timer.cancel()
+    return len(timers)
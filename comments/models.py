@@ -1,17 +1,30 @@
 import datetime
 
 from sqlalchemy import (
+    DDL,
     Column,
     Integer,
     String,
     ForeignKey,
     Boolean,
-    DateTime
+    DateTime,
+    Float,
+    event,
+    select,
+    update,
 )
 from sqlalchemy.orm import relationship
+from sqlalchemy.orm.attributes import set_committed_value
 
 from database.engine import Base
 
+PATH_WIDTH = 10
+MAX_THREAD_DEPTH = 20
+
+
+def thread_path(comment_id: int) -> str:
+    return f"{comment_id:0{PATH_WIDTH}d}/"
+
 
 class Comment(Base):
     __tablename__ = "comments"
@@ -21,7 +34,56 @@ class Comment(Base):
     user_id = Column(Integer, ForeignKey("users.id"))
     post_id = Column(Integer, ForeignKey("posts.id"))
     is_blocked = Column(Boolean, default=False)
-    created_at = Column(DateTime, default=lambda: datetime.datetime.now(datetime.UTC), nullable=False)
+    toxicity_score = Column(Float, nullable=True, index=True)
+    toxicity_model = Column(String(64), nullable=True)
+    scored_at = Column(DateTime, nullable=True)
+    # Set when a moderator decided; is_blocked then wins over the score.
+    moderated_at = Column(DateTime, nullable=True)
+    parent_id = Column(Integer, ForeignKey("comments.id"), nullable=True, index=True)
+    # Zero-padded ancestor ids ("0000000001/0000000007/"), so a subtree is a range scan. Empty only
+    # between the INSERT and set_thread_path, which needs the new id. PATH_TRIGGERS refuse NULL.
+    path = Column(String((PATH_WIDTH + 1) * (MAX_THREAD_DEPTH + 1)), default="", index=True)
+    depth = Column(Integer, default=0, nullable=False)
+    created_at = Column(DateTime, default=lambda: datetime.datetime.now(datetime.UTC), nullable=False, index=True)
 
     post = relationship("Post", back_populates="comments")
     user = relationship("User", back_populates="comments")
+
+
+class CommentArchive(Base):
+    """One row per monthly archive table created by ``comments.archive``."""
+    __tablename__ = "comment_archives"
+
+    month = Column(String(6), primary_key=True)
+    table_name = Column(String(64), nullable=False)
+    row_count = Column(Integer, default=0, nullable=False)
+
+
+# NOT NULL on path, enforced by triggers: for SQLite to add the constraint to a table that
+# existed before threads, it would have to copy the whole table (alembic revision 8c4e1b5a92d7).
+PATH_TRIGGERS = {
+    "comments_path_not_null_insert": "BEFORE INSERT ON comments",
+    "comments_path_not_null_update": "BEFORE UPDATE OF path ON comments",
+}
+for _name, _event in PATH_TRIGGERS.items():
+    event.listen(Comment.__table__, "after_create", DDL(
+        f"CREATE TRIGGER {_name} {_event} WHEN NEW.path IS NULL "
+        "BEGIN SELECT RAISE(ABORT, 'NOT NULL constraint failed: comments.path'); END"
+    ).execute_if(dialect="sqlite"))
+
+
+@event.listens_for(Comment, "after_insert")
+def set_thread_path(mapper, connection, target):
+    path, depth = "", 0
+    if target.parent_id is not None:
+        parent = connection.execute(
+            select(Comment.id, Comment.path, Comment.depth).where(Comment.id == target.parent_id)
+        ).one()
+        path, depth = parent.path or thread_path(parent.id), parent.depth + 1
+    path += thread_path(target.id)
+
+    connection.execute(
+        update(Comment.__table__).where(Comment.__table__.c.id == target.id).values(path=path, depth=depth)
+    )
+    set_committed_value(target, "path", path)
+    set_committed_value(target, "depth", depth)
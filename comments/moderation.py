@@ -0,0 +1,172 @@
+"""Block or unblock every comment matching a filter, as a tracked background job.
+
+Comments are updated one id range at a time, each range in its own short
+transaction with a pause in between, so a large sweep never holds the
+write lock for long. Each chunk also updates trending scores, user stats
+and the change feed for the comments whose visible state it flipped. Archived comments are left as they are.
+"""
+import logging
+import os
+import time
+from datetime import datetime, UTC
+
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.orm import Session
+
+from changes.crud import change_row, snapshot
+from changes.models import Change
+from comments.crud import blocked_expression
+from comments.models import Comment
+from database.sharding import scatter
+from jobs import crud as jobs
+from jobs.models import Job
+from posts import trending
+from users import stats
+
+logger = logging.getLogger(__name__)
+
+MODERATION_CHUNK_SIZE = int(os.getenv("MODERATION_CHUNK_SIZE", 1000))
+MODERATION_PAUSE_MS = int(os.getenv("MODERATION_PAUSE_MS", 50))
+JOB_NAME = "comment-moderation"
+
+
+def _utc(value: str) -> datetime:
+    moment = datetime.fromisoformat(value)
+    # created_at is stored as naive UTC.
+    return moment.astimezone(UTC).replace(tzinfo=None) if moment.tzinfo else moment
+
+
+def criteria(params: dict):
+    """The filters of a moderation request, as SQL conditions on ``comments``."""
+    conditions = []
+    if params.get("user_id") is not None:
+        conditions.append(Comment.user_id == params["user_id"])
+    if params.get("post_id") is not None:
+        conditions.append(Comment.post_id == params["post_id"])
+    if params.get("created_from") is not None:
+        conditions.append(Comment.created_at >= _utc(params["created_from"]))
+    if params.get("created_to") is not None:
+        conditions.append(Comment.created_at < _utc(params["created_to"]))
+    if params.get("score_min") is not None:
+        conditions.append(Comment.toxicity_score >= params["score_min"])
+    if params.get("score_max") is not None:
+        conditions.append(Comment.toxicity_score <= params["score_max"])
+    return conditions
+
+
+def start_moderation(db: Session, params: dict) -> Job:
+    """Record the job with how many comments it covers; ``run_moderation`` does the work."""
+    conditions = criteria(params)
+    summaries = scatter(
+        db, lambda session: session.query(func.count(Comment.id), func.max(Comment.id)).filter(*conditions).one()
+    )
+    job = Job(
+        name=JOB_NAME,
+        status="pending",
+        cursor=0,
+        processed=0,
+        total=sum(count for count, _ in summaries),
+        # Comments added later are judged as they arrive, not by this sweep.
+        params={**params, "max_id": max((last or 0 for _, last in summaries), default=0)},
+    )
+    db.add(job)
+    db.commit()
+    return job
+
+
+def _moderate_range(session: Session, conditions, block: bool, start: int, end: int, moderated_at: datetime):
+    """Apply the decision to ids in ``(start, end]``.
+
+    Returns the updated rows as change payloads, and the comments that flipped.
+    """
+    in_range = (Comment.id > start, Comment.id <= end, *conditions)
+    rows = session.execute(
+        select(Comment.id, Comment.post_id, Comment.user_id, Comment.created_at, blocked_expression(Comment))
+        .where(*in_range)
+    ).all()
+    if not rows:
+        return [], []
+    session.execute(
+        update(Comment).where(*in_range).values(is_blocked=block, moderated_at=moderated_at),
+        execution_options={"synchronize_session": False},
+    )
+    table = Comment.__table__
+    updated = session.execute(select(table).where(table.c.id.in_([row[0] for row in rows]))).mappings()
+    return [snapshot(row) for row in updated], [row[1:4] for row in rows if bool(row[4]) != block]
+
+
+def _next_start(db: Session, conditions, cursor: int):
+    """Skip empty id ranges: the id just before the next matching comment, if any."""
+    found = [
+        first for first in scatter(
+            db, lambda session: session.query(func.min(Comment.id)).filter(Comment.id > cursor, *conditions).scalar()
+        ) if first is not None
+    ]
+    return min(found) - 1 if found else None
+
+
+def run_moderation(
+        db: Session,
+        job: Job,
+        chunk_size: int = MODERATION_CHUNK_SIZE,
+        pause_ms: int = MODERATION_PAUSE_MS,
+        sleep=time.sleep,
+):
+    params = job.params
+    conditions = criteria(params)
+    block = params["action"] == "block"
+    job.status = "running"
+    db.commit()
+    try:
+        while job.cursor < params["max_id"]:
+            start = _next_start(db, conditions, job.cursor)
+            if start is None or start >= params["max_id"]:
+                break
+            end = min(start + chunk_size, params["max_id"])
+            moderated_at = datetime.now(UTC)
+
+            updated, flipped = [], []
+            for chunk_updated, chunk_flipped in scatter(
+                db, lambda session: _moderate_range(session, conditions, block, start, end, moderated_at)
+            ):
+                updated += chunk_updated
+                flipped += chunk_flipped
+
+            trending.adjust_scores(db, [(post_id, created_at) for post_id, _, created_at in flipped], -1 if block else 1)
+            if updated:
+                db.execute(
+                    insert(Change.__table__), [change_row("comments", row["id"], "update", row) for row in updated]
+                )
+            for _, user_id, _ in flipped:
+                stats.mark_changed(db, user_id)
+            jobs.checkpoint(job, cursor=end, processed=len(updated))
+            db.commit()
+
+            logger.info("Moderation job %d: %d of %s comments", job.id, job.processed, job.total)
+            if job.cursor < params["max_id"]:
+                sleep(pause_ms / 1000)
+    except Exception as exc:
+        jobs.fail_job(db, job, exc)
+        raise
+
+    jobs.finish_job(db, job)
+    return job
+
+
+def run_in_background(make_session, job_id: int):
+    try:
+        with make_session() as db:
+            run_moderation(db, jobs.get_job(db, job_id))
+    except Exception:
+        logger.exception("Moderation job %s failed", job_id)
+
+
+def progress(job: Job):
+    return {
+        "id": job.id,
+        "status": job.status,
+        "action": job.params["action"],
+        "processed": job.processed,
+        "total": job.total,
+        "error": job.error,
+    }
@@ -0,0 +1,122 @@
+import os
+import threading
+from functools import cache
+
+from dotenv import load_dotenv
+
+from core.metrics import observe_external
+
+load_dotenv()
+
+TOXICITY_PROVIDER = os.environ.get("TOXICITY_PROVIDER", "perspective")
+REPLY_PROVIDER = os.environ.get("REPLY_PROVIDER", "cohere")
+
+
+class ToxicityProvider:
+    """Scores text from 0 to 1. The base class is the disabled provider."""
+
+    enabled = False
+    model = "none"
+
+    def score(self, text: str) -> float:
+        return 0.0
+
+
+class PerspectiveToxicityProvider(ToxicityProvider):
+    enabled = True
+    model = "perspective:TOXICITY"
+
+    def __init__(self):
+        self.api_key = os.environ.get("PERSPECTIVE_API_KEY")
+        self.discovery_url = os.environ.get(
+            "PERSPECTIVE_DISCOVERY_URL",
+            "https://commentanalyzer.googleapis.com/$discovery/rest?version=v1alpha1"
+        )
+        # httplib2 connections are not thread safe, so each worker thread builds its own client.
+        self._local = threading.local()
+
+    def _client(self):
+        client = getattr(self._local, "client", None)
+        if client is None:
+            from googleapiclient import discovery
+
+            client = discovery.build(
+                "commentanalyzer",
+                "v1alpha1",
+                developerKey=self.api_key,
+                discoveryServiceUrl=self.discovery_url,
+                static_discovery=False,
+            )
+            self._local.client = client
+        return client
+
+    def score(self, text):
+        analyze_request = {
+            'comment': {'text': text},
+            'requestedAttributes': {'TOXICITY': {}}
+        }
+        with observe_external("perspective"):
+            response = self._client().comments().analyze(body=analyze_request).execute()
+        return response["attributeScores"]["TOXICITY"]["spanScores"][0]["score"]["value"]
+
+
+class ReplyProvider:
+    """Generates a reply to a comment. The base class is the disabled provider."""
+
+    enabled = False
+
+    def generate(self, comment: str) -> str | None:
+        return None
+
+
+class CohereReplyProvider(ReplyProvider):
+    enabled = True
+    model = "command-r-plus"
+
+    def __init__(self):
+        self.api_key = os.environ.get("COHERE_API_KEY")
+        self.base_url = os.environ.get("COHERE_BASE_URL")
+        self._client = None
+        self._lock = threading.Lock()
+
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                import cohere
+
+                self._client = cohere.ClientV2(self.api_key, base_url=self.base_url)
+        return self._client
+
+    def generate(self, comment):
+        with observe_external("cohere"):
+            response = self.client().chat(
+                model=self.model,
+                messages=[
+                    {
+                        "role": "user",
+                        "content": f"Give a response for this comment: {comment}",
+                    }
+                ]
+            )
+        return list(list(dict(response)["message"])[3][1][0])[1][1]
+
+
+TOXICITY_PROVIDERS = {
+    "perspective": PerspectiveToxicityProvider,
+    "none": ToxicityProvider,
+}
+
+REPLY_PROVIDERS = {
+    "cohere": CohereReplyProvider,
+    "none": ReplyProvider,
+}
+
+
+@cache
+def get_toxicity_provider() -> ToxicityProvider:
+    return TOXICITY_PROVIDERS[TOXICITY_PROVIDER]()
+
+
+@cache
+def get_reply_provider() -> ReplyProvider:
+    return REPLY_PROVIDERS[REPLY_PROVIDER]()
@@ -1,13 +1,19 @@
 from typing import List
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, status
 from sqlalchemy.orm import Session
 
-from comments import schemas
-from comments.crud import delete_comment_from_db, update_comment_in_db, check_for_toxicity, comments_analysis, \
-    auto_replay_for_comments
+from comments import moderation, schemas
+from comments.crud import delete_comment_from_db, update_comment_in_db, score_toxicity, comments_analysis, \
+    auto_replay_for_comments, get_comment_rows_for_post, get_thread_rows, COMMENT_FIELDS
+from core.ratelimit import rate_limit
+from core.responses import rows_response
 from database.engine import get_db
-from comments.models import Comment
+from database.sharding import session_factory
+from idempotency.services import Idempotency, idempotency
+from jobs.crud import get_job
+from comments.models import Comment, MAX_THREAD_DEPTH
+from posts import trending
 from posts.models import Post
 from users import models, services
 
@@ -16,43 +22,83 @@ comments_router = APIRouter()
 
 @comments_router.get("/comments/{post_id}", response_model=list[schemas.Comment])
 def get_comments_for_post(post_id: int, db: Session = Depends(get_db)):
-    comments = db.query(Comment).filter(Comment.post_id == post_id).all()
+    comments = get_comment_rows_for_post(db, post_id)
     if not comments:
         raise HTTPException(status_code=404, detail="Comments not found")
-    return comments
+    return rows_response(COMMENT_FIELDS, comments)
 
 
-@comments_router.post("/posts/{post_id}/comments", response_model=schemas.Comment)
+@comments_router.get("/comments/{comment_id}/thread", response_model=schemas.CommentThread)
+def get_comment_thread(
+        comment_id: int,
+        cursor: str | None = None,
+        limit: int = Query(100, ge=1, le=500),
+        db: Session = Depends(get_db)
+):
+    rows, next_cursor = get_thread_rows(db, comment_id, cursor, limit)
+    if rows is None:
+        raise HTTPException(status_code=404, detail="Comment not found")
+    return {"comments": [dict(zip(COMMENT_FIELDS, row)) for row in rows], "next_cursor": next_cursor}
+
+
+@comments_router.post(
+    "/posts/{post_id}/comments",
+    response_model=schemas.Comment,
+    dependencies=[Depends(rate_limit("create_comment", "20/60", per="user"))]
+)
 def create_comment(
         post_id: int,
         comment: schemas.CommentCreate,
         user: models.User = Depends(services.get_current_user),
-        db: Session = Depends(get_db)
+        db: Session = Depends(get_db),
+        idempotency: Idempotency = Depends(idempotency)
 ):
 
-    post = db.query(Post).filter(Post.id == post_id).first()
+    post = db.query(Post).filter(Post.id == post_id, Post.deleted_at.is_(None)).first()
     if post is None:
         raise HTTPException(status_code=404, detail="Post not found")
 
-    toxicity = check_for_toxicity(comment.content)
+    if comment.parent_id is not None:
+        parent = db.query(Comment.post_id, Comment.depth).filter(Comment.id == comment.parent_id).first()
+        if parent is None or parent.post_id != post_id:
+            raise HTTPException(status_code=404, detail="Parent comment not found")
+        if parent.depth >= MAX_THREAD_DEPTH:
+            raise HTTPException(status_code=422, detail="Thread is too deep")
+
+    toxicity = score_toxicity(comment.content)
 
     db_comment = Comment(
         content=comment.content,
         post_id=post_id,
         user_id=user.id,
-        is_blocked=toxicity
+        parent_id=comment.parent_id,
+        **toxicity
     )
     db.add(db_comment)
-    db.commit()
+    if not db_comment.is_blocked:
+        score, epoch = trending.record_comment(db, post_id)
+    db.flush()
+    # Read back as stored, so the response matches what GET returns.
     db.refresh(db_comment)
+    # Committed together with the stored response.
+    response = idempotency.save(schemas.Comment.model_validate(db_comment, from_attributes=True))
+
+    if not response.is_blocked:
+        trending.top_posts.update(post_id, score, epoch)
 
     if post.auto_replay_enabled:
-        auto_replay_for_comments(db, comment.content, post_id, post.auto_replay_delay, post.user_id)
+        auto_replay_for_comments(
+            db, comment.content, post_id, post.auto_replay_delay, post.user_id, parent_id=response.id
+        )
 
-    return db_comment
+    return response
 
 
-@comments_router.put("/comments/{comment_id}", response_model=schemas.Comment)
+@comments_router.put(
+    "/comments/{comment_id}",
+    response_model=schemas.Comment,
+    dependencies=[Depends(rate_limit("update_comment", "20/60", per="user"))]
+)
 def update_comment(
         comment_id: int,
         comment_data: schemas.Comment,
@@ -65,9 +111,14 @@ def update_comment(
     if comment.user_id != user.id:
         raise HTTPException(status_code=403, detail="You are not allowed to edit this comment")
 
-    toxicity = check_for_toxicity(comment_data.content)
-    if toxicity:
-        comment.is_blocked = toxicity
+    # The new text is saved with its own score, or none when no scorer is configured.
+    toxicity = score_toxicity(comment_data.content)
+    comment.toxicity_score = toxicity.get("toxicity_score")
+    comment.toxicity_model = toxicity.get("toxicity_model")
+    comment.scored_at = toxicity.get("scored_at")
+    # A moderator's block outlasts edits; otherwise the new text's verdict replaces the old one.
+    if toxicity["is_blocked"] or (comment.moderated_at is None and "toxicity_score" in toxicity):
+        comment.is_blocked = toxicity["is_blocked"]
 
     return update_comment_in_db(db=db, comment_data=comment_data, comment=comment)
 
@@ -94,3 +145,31 @@ def get_comments_daily_breakdown(
     db: Session = Depends(get_db),
 ):
     return comments_analysis(db=db, date_from=date_from, date_to=date_to)
+
+
+@comments_router.post(
+    "/admin/comments/moderation",
+    response_model=schemas.ModerationJob,
+    status_code=status.HTTP_202_ACCEPTED
+)
+def moderate_comments(
+        request: schemas.ModerationRequest,
+        background_tasks: BackgroundTasks,
+        admin: models.User = Depends(services.get_current_admin),
+        db: Session = Depends(get_db)
+):
+    job = moderation.start_moderation(db, request.model_dump(mode="json", exclude_none=True))
+    background_tasks.add_task(moderation.run_in_background, session_factory(db), job.id)
+    return moderation.progress(job)
+
+
+@comments_router.get("/admin/comments/moderation/{job_id}", response_model=schemas.ModerationJob)
+def get_moderation_job(
+        job_id: int,
+        admin: models.User = Depends(services.get_current_admin),
+        db: Session = Depends(get_db)
+):
+    job = get_job(db, job_id)
+    if job is None or job.name != moderation.JOB_NAME:
+        raise HTTPException(status_code=404, detail="Moderation job not found")
+    return moderation.progress(job)
@@ -1,6 +1,7 @@
 from datetime import datetime
+from typing import Literal
 
-from pydantic import BaseModel
+from pydantic import BaseModel, model_validator
 
 
 class CommentBase(BaseModel):
@@ -9,6 +10,7 @@ class CommentBase(BaseModel):
 
 class CommentCreate(CommentBase):
     is_blocked: bool = False
+    parent_id: int | None = None
 
 
 class Comment(CommentBase):
@@ -17,3 +19,35 @@ class Comment(CommentBase):
     post_id: int
     is_blocked: bool
     created_at: datetime
+    parent_id: int | None = None
+    depth: int = 0
+
+
+class CommentThread(BaseModel):
+    comments: list[Comment]
+    next_cursor: str | None
+
+
+class ModerationRequest(BaseModel):
+    action: Literal["block", "unblock"]
+    user_id: int | None = None
+    post_id: int | None = None
+    created_from: datetime | None = None
+    created_to: datetime | None = None
+    score_min: float | None = None
+    score_max: float | None = None
+
+    @model_validator(mode="after")
+    def check_filtered(self):
+        if self.model_dump(exclude={"action"}, exclude_none=True) == {}:
+            raise ValueError("Pass at least one filter")
+        return self
+
+
+class ModerationJob(BaseModel):
+    id: int
+    status: str
+    action: str
+    processed: int
+    total: int | None
+    error: str | None = None
@@ -1,8 +1,16 @@
+import json
+import subprocess
+import sys
+
 import pytest
 from datetime import datetime, UTC
 from unittest.mock import Mock, patch
 from fastapi import HTTPException
-from sqlalchemy.orm import Session
+from fastapi.testclient import TestClient
+from pydantic import ValidationError
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import StaticPool
 
 from comments.crud import (
     check_for_toxicity,
@@ -11,16 +19,41 @@ from comments.crud import (
     create_comment,
     update_comment_in_db,
     delete_comment_from_db,
+    get_thread_rows,
+    get_comment_rows_for_post,
+    score_toxicity,
 )
+from changes.models import Change
+from comments import archive, moderation
+from comments.backfill import backfill_scores
 from comments.models import Comment
-from comments.schemas import CommentCreate
-from posts.models import Post
+from comments.providers import get_reply_provider, get_toxicity_provider
+from comments.schemas import CommentCreate, ModerationRequest
+from core.ratelimit import MemoryBackend
+from jobs.models import Job
+from database.engine import Base, get_db
+from idempotency.services import Idempotency
+from main import app
+from posts import trending
+from posts.models import Post, PostScore
 from users.models import User
+from users.services import create_access_token
+
+
+@pytest.fixture(autouse=True)
+def reset_providers():
+    get_toxicity_provider.cache_clear()
+    get_reply_provider.cache_clear()
+    yield
+    get_toxicity_provider.cache_clear()
+    get_reply_provider.cache_clear()
 
 
 @pytest.fixture
 def db_session():
-    return Mock(spec=Session)
+    session = Mock(spec=Session)
+    session.scalars.return_value = []  # no comment archives
+    return session
 
 
 @pytest.fixture
@@ -88,6 +121,7 @@ def test_update_comment_success(db_session, test_comment):
     db_session.commit.assert_called_once()
     db_session.refresh.assert_called_once()
     assert result == test_comment
+    assert result.content == "Updated content"
 
 
 def test_delete_comment_success(db_session, test_comment):
@@ -100,10 +134,10 @@ def test_delete_comment_success(db_session, test_comment):
 
 
 # Test Toxicity Check
-@patch('comments.crud.discovery')
-def test_check_for_toxicity(mock_discovery):
+@patch('googleapiclient.discovery.build')
+def test_check_for_toxicity(mock_build):
     mock_client = Mock()
-    mock_discovery.build.return_value = mock_client
+    mock_build.return_value = mock_client
 
     mock_response = {
         "attributeScores": {
@@ -119,6 +153,24 @@ def test_check_for_toxicity(mock_discovery):
     assert result is True
 
 
+def test_check_for_toxicity_disabled(monkeypatch):
+    monkeypatch.setattr('comments.providers.TOXICITY_PROVIDER', 'none')
+    assert check_for_toxicity("This is a toxic comment") is False
+
+
+@patch('comments.crud.threading.Timer')
+def test_auto_replay_disabled(mock_timer, monkeypatch, db_session):
+    monkeypatch.setattr('comments.providers.REPLY_PROVIDER', 'none')
+    auto_replay_for_comments(db=db_session, comment="Test comment", post_id=1, delay=0, author_id=1)
+    mock_timer.assert_not_called()
+
+
+def test_sdks_are_not_imported_with_the_app():
+    code = "import sys, main; print(sorted(m for m in ('cohere', 'googleapiclient') if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "[]"
+
+
 # Test Comments Analysis
 def test_comments_analysis(db_session):
     mock_results = [
@@ -150,7 +202,7 @@ def test_comments_analysis(db_session):
 
 
 # Test Auto Reply
-@patch('comments.crud.cohere.ClientV2')
+@patch('cohere.ClientV2')
 def test_auto_replay_for_comments(mock_cohere_client, db_session):
     mock_client = Mock()
     mock_cohere_client.return_value = mock_client
@@ -184,13 +236,26 @@ def test_auto_replay_for_comments(mock_cohere_client, db_session):
 
 # Test API Endpoints
 def test_get_comments_for_post_endpoint(db_session, test_comment):
-    db_session.query.return_value.filter.return_value.all.return_value = [test_comment]
+    row = (
+        test_comment.id,
+        test_comment.content,
+        test_comment.user_id,
+        test_comment.post_id,
+        test_comment.is_blocked,
+        test_comment.created_at,
+        None,
+        0,
+    )
+    db_session.query.return_value.filter.return_value.all.return_value = [row]
 
     from comments.routers import get_comments_for_post
 
     response = get_comments_for_post(post_id=1, db=db_session)
-    assert len(response) == 1
-    assert response[0] == test_comment
+    comments = json.loads(response.body)
+    assert len(comments) == 1
+    assert comments[0]["id"] == test_comment.id
+    assert comments[0]["content"] == test_comment.content
+    assert comments[0]["created_at"] == test_comment.created_at.isoformat()
 
 
 def test_get_comments_for_post_not_found(db_session):
@@ -205,20 +270,21 @@ def test_get_comments_for_post_not_found(db_session):
     assert exc_info.value.detail == "Comments not found"
 
 
-def test_create_comment_endpoint(db_session, test_user, test_post):
+def test_create_comment_endpoint(thread_db, test_user):
     comment_data = CommentCreate(content="New comment", is_blocked=False)
-    db_session.query.return_value.filter.return_value.first.return_value = test_post
 
     from comments.routers import create_comment as create_comment_endpoint
 
-    with patch('comments.crud.check_for_toxicity', return_value=False):
+    with patch('comments.routers.score_toxicity', return_value={"is_blocked": False}) as score:
         response = create_comment_endpoint(
             post_id=1,
             comment=comment_data,
             user=test_user,
-            db=db_session
+            db=thread_db,
+            idempotency=Idempotency(thread_db)
         )
 
+        score.assert_called_once_with("New comment")
         assert response.content == comment_data.content
         assert not response.is_blocked
 
@@ -268,3 +334,378 @@ def test_update_comment_unauthorized(db_session, test_user, test_comment):
 
     assert exc_info.value.status_code == 403
     assert exc_info.value.detail == "You are not allowed to edit this comment"
+
+
+def test_update_comment_replaces_content_and_score_together(db_session, test_user, test_comment, monkeypatch):
+    test_comment.toxicity_score, test_comment.toxicity_model = 0.97, "old-model"
+    db_session.query.return_value.filter.return_value.first.return_value = test_comment
+    from comments.routers import update_comment
+
+    scored = []
+    scored_at = datetime.now(UTC)
+
+    def score(content):
+        scored.append(content)
+        return {"is_blocked": False, "toxicity_score": 0.1, "toxicity_model": "new-model", "scored_at": scored_at}
+
+    monkeypatch.setattr("comments.routers.score_toxicity", score)
+    update_comment(comment_id=1, comment_data=CommentCreate(content="Kind words"), user=test_user, db=db_session)
+    assert scored == ["Kind words"]
+    assert test_comment.content == "Kind words"
+    assert (test_comment.toxicity_score, test_comment.toxicity_model, test_comment.scored_at) == (
+        0.1, "new-model", scored_at
+    )
+
+    monkeypatch.setattr("comments.routers.score_toxicity", lambda content: {"is_blocked": False})
+    update_comment(comment_id=1, comment_data=CommentCreate(content="Other words"), user=test_user, db=db_session)
+    assert test_comment.content == "Other words"
+    assert (test_comment.toxicity_score, test_comment.toxicity_model, test_comment.scored_at) == (None, None, None)
+
+
+# Threads
+@pytest.fixture
+def thread_db():
+    engine = create_engine("sqlite:///:memory:", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    session.add(User(id=1, username="testuser", email="test@example.com", password="testpassword"))
+    session.add(Post(id=1, title="Post", content="Content", user_id=1))
+    session.commit()
+    yield session
+    session.close()
+
+
+def add_comment(db, content, parent=None):
+    comment = Comment(content=content, post_id=1, user_id=1, parent_id=parent.id if parent else None)
+    db.add(comment)
+    db.commit()
+    return comment
+
+
+def test_replies_get_materialized_path(thread_db):
+    root = add_comment(thread_db, "root")
+    reply = add_comment(thread_db, "reply", root)
+    nested = add_comment(thread_db, "nested", reply)
+
+    assert root.path == "0000000001/"
+    assert nested.path == "0000000001/0000000002/0000000003/"
+    assert (root.depth, reply.depth, nested.depth) == (0, 1, 2)
+
+
+def test_thread_is_returned_in_order_and_paginated(thread_db):
+    root = add_comment(thread_db, "root")
+    first = add_comment(thread_db, "first", root)
+    add_comment(thread_db, "other root")
+    add_comment(thread_db, "second", root)
+    add_comment(thread_db, "first reply", first)
+
+    rows, cursor = get_thread_rows(thread_db, root.id, limit=3)
+    assert [content for _, content, *_ in rows] == ["root", "first", "first reply"]
+
+    rows, cursor = get_thread_rows(thread_db, root.id, cursor=cursor, limit=3)
+    assert [content for _, content, *_ in rows] == ["second"]
+    assert cursor is None
+
+
+def test_subtree_of_reply_excludes_siblings(thread_db):
+    root = add_comment(thread_db, "root")
+    first = add_comment(thread_db, "first", root)
+    add_comment(thread_db, "second", root)
+
+    rows, _ = get_thread_rows(thread_db, first.id)
+    assert [content for _, content, *_ in rows] == ["first"]
+
+
+def test_thread_of_missing_comment(thread_db):
+    assert get_thread_rows(thread_db, 999) == (None, None)
+
+
+def test_get_comment_thread_endpoint(thread_db):
+    from comments.routers import get_comment_thread
+
+    root = add_comment(thread_db, "root")
+    add_comment(thread_db, "reply", root)
+
+    thread = get_comment_thread(comment_id=root.id, cursor=None, limit=10, db=thread_db)
+    assert [(c["content"], c["parent_id"], c["depth"]) for c in thread["comments"]] == [
+        ("root", None, 0),
+        ("reply", root.id, 1),
+    ]
+    assert thread["next_cursor"] is None
+
+    with pytest.raises(HTTPException) as exc_info:
+        get_comment_thread(comment_id=999, cursor=None, limit=10, db=thread_db)
+    assert exc_info.value.status_code == 404
+
+
+@patch('comments.crud.threading.Timer')
+def test_auto_reply_attaches_to_comment(mock_timer, monkeypatch, thread_db):
+    provider = Mock(enabled=True)
+    provider.generate.return_value = "Thanks!"
+    monkeypatch.setattr('comments.crud.get_reply_provider', lambda: provider)
+    root = add_comment(thread_db, "root")
+
+    auto_replay_for_comments(thread_db, "root", post_id=1, delay=0, author_id=1, parent_id=root.id)
+    mock_timer.call_args.args[1]()
+
+    reply = thread_db.query(Comment).filter(Comment.parent_id == root.id).one()
+    assert reply.content == "Thanks!"
+    assert reply.depth == 1
+
+
+# Stored toxicity scores
+class FakeToxicityProvider:
+    enabled = True
+    model = "fake:v2"
+
+    def __init__(self, scores, fail_on=None):
+        self.scores = scores
+        self.fail_on = fail_on
+
+    def score(self, text):
+        if text == self.fail_on:
+            raise RuntimeError("API unavailable")
+        return self.scores[text]
+
+
+@pytest.fixture
+def fake_provider(monkeypatch):
+    def install(scores, fail_on=None):
+        provider = FakeToxicityProvider(scores, fail_on)
+        monkeypatch.setattr("comments.crud.get_toxicity_provider", lambda: provider)
+        monkeypatch.setattr("comments.backfill.get_toxicity_provider", lambda: provider)
+        return provider
+    return install
+
+
+def test_toxicity_verdicts_are_cached_per_model(fake_provider):
+    provider = fake_provider({"Great post!": 0.05})
+    assert score_toxicity("Great post!")["toxicity_score"] == 0.05
+
+    provider.fail_on = "Great post!"
+    assert score_toxicity("Great post!")["toxicity_score"] == 0.05
+    provider.model = "fake:v3"
+    with pytest.raises(RuntimeError):
+        score_toxicity("Great post!")
+
+
+def test_threshold_is_applied_when_reading(monkeypatch, thread_db):
+    thread_db.add(Comment(content="borderline", post_id=1, user_id=1, is_blocked=False, toxicity_score=0.5))
+    thread_db.add(Comment(content="legacy", post_id=1, user_id=1, is_blocked=True))
+    thread_db.commit()
+
+    blocked = lambda: [row.is_blocked for row in get_comment_rows_for_post(thread_db, 1)]
+    assert blocked() == [False, True]
+    monkeypatch.setattr("comments.crud.TOXICITY_THRESHOLD", 0.4)
+    assert blocked() == [True, True]
+
+
+def test_backfill_stores_scores_at_configured_rate(fake_provider, thread_db):
+    fake_provider({"a": 0.1, "b": 0.9, "c": 0.2})
+    for content in "abc":
+        add_comment(thread_db, content)
+
+    now = [0.0]
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+
+    job = backfill_scores(
+        thread_db, qps=2, chunk_size=2, limiter=MemoryBackend(shards=1, clock=lambda: now[0]), sleep=sleep
+    )
+
+    assert (job.status, job.processed) == ("done", 3)
+    assert sum(sleeps) == pytest.approx(1.0)
+    scored = thread_db.query(Comment.content, Comment.toxicity_score, Comment.toxicity_model).order_by(Comment.id)
+    assert scored.all() == [("a", 0.1, "fake:v2"), ("b", 0.9, "fake:v2"), ("c", 0.2, "fake:v2")]
+
+
+def test_backfill_resumes_from_checkpoint(fake_provider, thread_db):
+    provider = fake_provider({"a": 0.1, "b": 0.2, "c": 0.3}, fail_on="c")
+    for content in "abc":
+        add_comment(thread_db, content)
+
+    with pytest.raises(RuntimeError):
+        backfill_scores(thread_db, qps=1000, chunk_size=2)
+    job = thread_db.query(Job).one()
+    assert (job.status, job.cursor, job.processed) == ("failed", 2, 2)
+
+    provider.fail_on = None
+    provider.score = Mock(side_effect=provider.score)
+    job = backfill_scores(thread_db, qps=1000, chunk_size=2)
+
+    provider.score.assert_called_once_with("c")
+    assert (job.status, job.processed) == ("done", 3)
+    assert thread_db.query(Job).count() == 1
+
+
+# Archive
+@pytest.fixture
+def old_comments(thread_db):
+    thread_db.query(Post).update({"created_at": datetime(2024, 1, 1)})
+    for day in (datetime(2024, 1, 15), datetime(2024, 1, 20), datetime(2024, 2, 10)):
+        thread_db.add(Comment(content=f"old {day:%m-%d}", post_id=1, user_id=1, created_at=day))
+    thread_db.add(Comment(content="new", post_id=1, user_id=1))
+    thread_db.commit()
+
+
+def test_archive_moves_old_comments_into_monthly_tables(thread_db, old_comments):
+    sleeps = []
+    moved = archive.archive_comments(thread_db, before=datetime(2024, 6, 1, tzinfo=UTC), chunk_size=2, sleep=sleeps.append)
+
+    assert moved == 3
+    assert len(sleeps) == 1
+    assert [c.content for c in thread_db.query(Comment)] == ["new"]
+    tables = {t.name: t for t in archive.tables_between(thread_db, datetime(2024, 1, 1), datetime(2024, 12, 1))}
+    assert list(tables) == ["comments_archive_202401", "comments_archive_202402"]
+    assert thread_db.execute(select(tables["comments_archive_202401"].c.content)).scalars().all() == [
+        "old 01-15", "old 01-20"
+    ]
+
+
+def test_reads_fall_back_to_archive(thread_db, old_comments):
+    archive.archive_comments(thread_db, before=datetime(2024, 6, 1, tzinfo=UTC))
+
+    rows = get_comment_rows_for_post(thread_db, 1)
+    assert [content for _, content, *_ in rows] == ["old 01-15", "old 01-20", "old 02-10", "new"]
+
+    analysis = comments_analysis(thread_db, date_from="2024-01-01", date_to="2024-02-28")
+    assert [(day["day"], day["total_comments"]) for day in analysis] == [
+        ("2024-01-15", 1), ("2024-01-20", 1), ("2024-02-10", 1)
+    ]
+
+
+def test_new_posts_skip_archive(thread_db, old_comments):
+    archive.archive_comments(thread_db, before=datetime(2024, 6, 1, tzinfo=UTC))
+    thread_db.add(Post(id=2, title="New", content="Content", user_id=1))
+    thread_db.commit()
+
+    assert archive.tables_for_post(thread_db, 2) == []
+
+
+# Bulk moderation
+def test_moderation_blocks_matching_comments_in_chunks(thread_db):
+    thread_db.add(User(id=2, username="other", email="other@example.com", password="testpassword"))
+    for content, user_id in (("a", 1), ("b", 2), ("c", 1), ("d", 1)):
+        thread_db.add(Comment(content=content, post_id=1, user_id=user_id))
+    thread_db.commit()
+    trending.rebuild_scores(thread_db)
+    score_before = thread_db.get(PostScore, 1).score
+
+    job = moderation.start_moderation(thread_db, {"action": "block", "user_id": 1})
+    assert (job.status, job.total) == ("pending", 3)
+
+    sleeps = []
+    job = moderation.run_moderation(thread_db, job, chunk_size=1, sleep=sleeps.append)
+
+    assert moderation.progress(job) == {
+        "id": job.id, "status": "done", "action": "block", "processed": 3, "total": 3, "error": None
+    }
+    assert len(sleeps) == 2
+    rows = thread_db.query(Comment.content, Comment.is_blocked, Comment.moderated_at.isnot(None)).order_by(Comment.id)
+    assert rows.all() == [("a", True, True), ("b", False, False), ("c", True, True), ("d", True, True)]
+    updates = thread_db.query(Change).filter(Change.entity == "comments", Change.op == "update").order_by(Change.id)
+    assert [(change.payload["content"], change.payload["is_blocked"]) for change in updates] == [
+        ("a", True), ("c", True), ("d", True)
+    ]
+    thread_db.expire_all()
+    assert thread_db.get(PostScore, 1).score == pytest.approx(score_before / 4)
+
+
+def test_moderator_decision_overrides_toxicity_score(thread_db):
+    thread_db.add(Comment(content="flagged", post_id=1, user_id=1, toxicity_score=0.99))
+    thread_db.commit()
+    assert [row.is_blocked for row in get_comment_rows_for_post(thread_db, 1)] == [True]
+
+    moderation.run_moderation(thread_db, moderation.start_moderation(thread_db, {"action": "unblock", "post_id": 1}))
+
+    assert [row.is_blocked for row in get_comment_rows_for_post(thread_db, 1)] == [False]
+
+
+def test_backfill_skips_moderated_comments(fake_provider, thread_db):
+    provider = fake_provider({"a": 0.1})
+    thread_db.add(Comment(content="a", post_id=1, user_id=1))
+    thread_db.add(Comment(content="decided", post_id=1, user_id=1, moderated_at=datetime(2024, 1, 1)))
+    thread_db.commit()
+    provider.score = Mock(side_effect=provider.score)
+
+    backfill_scores(thread_db, qps=1000, chunk_size=10)
+
+    provider.score.assert_called_once_with("a")
+
+
+def test_moderation_request_needs_a_filter():
+    with pytest.raises(ValidationError):
+        ModerationRequest(action="block")
+    assert ModerationRequest(action="unblock", score_min=0.9).score_min == 0.9
+
+
+client = TestClient(app)
+
+
+def bearer(username):
+    return {"Authorization": f"Bearer {create_access_token({'sub': username})}"}
+
+
+@pytest.fixture
+def moderation_api(thread_db):
+    thread_db.add(User(id=2, username="admin", email="admin@example.com", password="x", is_admin=True))
+    thread_db.add_all([Comment(content=content, post_id=1, user_id=1) for content in ("a", "b")])
+    thread_db.commit()
+    make_session = sessionmaker(bind=thread_db.get_bind())
+
+    def override_get_db():
+        with make_session() as db:
+            yield db
+
+    app.dependency_overrides[get_db] = override_get_db
+    yield thread_db
+    app.dependency_overrides.pop(get_db, None)
+
+
+def test_moderation_endpoint_runs_the_job_in_the_background(moderation_api):
+    response = client.post("/admin/comments/moderation", json={"action": "block", "post_id": 1}, headers=bearer("admin"))
+    assert response.status_code == 202
+    job = response.json()
+    assert (job["status"], job["action"], job["processed"], job["total"]) == ("pending", "block", 0, 2)
+
+    # The test client runs background tasks before returning the response.
+    response = client.get(f"/admin/comments/moderation/{job['id']}", headers=bearer("admin"))
+    assert response.status_code == 200
+    assert (response.json()["status"], response.json()["processed"]) == ("done", 2)
+    assert moderation_api.scalars(select(Comment.is_blocked).order_by(Comment.id)).all() == [True, True]
+
+
+def test_moderation_endpoints_are_admin_only(moderation_api):
+    response = client.post("/admin/comments/moderation", json={"action": "block", "post_id": 1}, headers=bearer("testuser"))
+    assert response.status_code == 403
+    assert moderation_api.query(Job).count() == 0
+
+    job = moderation.start_moderation(moderation_api, {"action": "block", "post_id": 1})
+    assert client.get(f"/admin/comments/moderation/{job.id}", headers=bearer("testuser")).status_code == 403
+
+
+def test_moderation_job_lookup_only_finds_moderation_jobs(moderation_api):
+    other = Job(name="toxicity-backfill:fake:v2", status="done")
+    moderation_api.add(other)
+    moderation_api.commit()
+
+    response = client.get(f"/admin/comments/moderation/{other.id}", headers=bearer("admin"))
+    assert response.status_code == 404
+    assert response.json() == {"detail": "Moderation job not found"}
+    assert client.get("/admin/comments/moderation/999", headers=bearer("admin")).status_code == 404
+
+
+def test_edited_comment_is_listed_with_its_new_text_and_verdict(moderation_api, fake_provider):
+    fake_provider({"you idiot": 0.95, "hello": 0.05})
+    created = client.post("/posts/1/comments", json={"content": "you idiot"}, headers=bearer("testuser")).json()
+    assert created["is_blocked"] is True
+
+    edit = dict(created, content="hello")
+    response = client.put(f"/comments/{created['id']}", json=edit, headers=bearer("testuser"))
+    assert (response.json()["content"], response.json()["is_blocked"]) == ("hello", False)
+
+    listed = {row["id"]: row for row in client.get("/comments/1").json()}[created["id"]]
+    assert (listed["content"], listed["is_blocked"]) == ("hello", False)
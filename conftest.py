@@ -0,0 +1,17 @@
+import pytest
+
+from core import cache
+from core.cache import LocalBackend
+from database.instrumentation import assert_max_queries
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache(monkeypatch):
+    """Tests rebuild their databases, so cached principals and verdicts must not outlive one."""
+    monkeypatch.setattr(cache, "backend", LocalBackend())
+
+
+@pytest.fixture
+def max_queries():
+    """Usage: ``with max_queries(engine, 2): client.get(...)``."""
+    return assert_max_queries
@@ -0,0 +1,221 @@
+"""Cache backends shared by every worker, plus cross-worker invalidation.
+
+``local`` keeps values in this process and suits a single worker. ``redis``
+uses a Redis server, so all workers see the same values and receive each
+other's invalidation messages.
+"""
+import logging
+import os
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+import orjson
+import redis
+
+logger = logging.getLogger(__name__)
+
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "local")
+CACHE_URL = os.getenv("CACHE_URL", "redis://localhost:6379/0")
+CACHE_LOCAL_MAX_ENTRIES = int(os.getenv("CACHE_LOCAL_MAX_ENTRIES", 10000))
+CACHE_TIMEOUT = float(os.getenv("CACHE_TIMEOUT", 0.5))
+INVALIDATION_CHANNEL = "cache-invalidation"
+
+# Lets a worker ignore its own invalidation messages; it already updated its state.
+ORIGIN = uuid.uuid4().hex
+
+
+class CacheBackend(ABC):
+    """Bytes in, bytes out. Failures degrade to misses; a cache must never fail a request."""
+
+    # Whether every worker reads the same values.
+    shared = False
+
+    @abstractmethod
+    def get(self, key: str) -> bytes | None:
+        pass
+
+    @abstractmethod
+    def set(self, key: str, value: bytes, ttl: float | None = None):
+        pass
+
+    @abstractmethod
+    def delete(self, *keys: str):
+        pass
+
+    @abstractmethod
+    def publish(self, channel: str, message: bytes):
+        pass
+
+    @abstractmethod
+    def subscribe(self, channel: str, callback):
+        """Call ``callback(message)`` for every message published on ``channel``."""
+
+    def close(self):
+        pass
+
+
+class LocalBackend(CacheBackend):
+    def __init__(self, max_entries: int = CACHE_LOCAL_MAX_ENTRIES, clock=time.monotonic):
+        self.max_entries = max_entries
+        self._clock = clock
+        self._entries: OrderedDict[str, tuple[bytes, float | None]] = OrderedDict()
+        self._subscribers: dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= self._clock():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._entries[key] = (value, None if ttl is None else self._clock() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def publish(self, channel, message):
+        for callback in list(self._subscribers.get(channel, ())):
+            callback(message)
+
+    def subscribe(self, channel, callback):
+        self._subscribers.setdefault(channel, []).append(callback)
+
+
+class RedisBackend(CacheBackend):
+    """Shared values through redis-py, plus one pub/sub connection read by a background thread."""
+
+    shared = True
+
+    def __init__(self, url: str = CACHE_URL, timeout: float = CACHE_TIMEOUT, client: redis.Redis | None = None):
+        self.timeout = timeout
+        self._client = client or redis.Redis.from_url(url, socket_timeout=timeout, socket_connect_timeout=timeout)
+        self._pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+        self._handlers = {}
+        self._listener: threading.Thread | None = None
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+
+    def _safe(self, name, command, *args, **kwargs):
+        try:
+            return command(*args, **kwargs)
+        except redis.RedisError as exc:
+            logger.warning("Cache command %s failed: %s", name, exc)
+            return None
+
+    def get(self, key):
+        return self._safe("GET", self._client.get, key)
+
+    def set(self, key, value, ttl=None):
+        self._safe("SET", self._client.set, key, value, px=None if ttl is None else int(ttl * 1000))
+
+    def delete(self, *keys):
+        if keys:
+            self._safe("DEL", self._client.delete, *keys)
+
+    def publish(self, channel, message):
+        self._safe("PUBLISH", self._client.publish, channel, message)
+
+    def subscribe(self, channel, callback):
+        def handle(message):
+            try:
+                callback(message["data"])
+            except Exception:
+                logger.exception("Cache invalidation handler failed")
+
+        with self._lock:
+            self._handlers[channel] = handle
+            try:
+                self._pubsub.subscribe(**{channel: handle})
+            except redis.RedisError as exc:
+                logger.warning("Cache subscription to %s failed (%s); retrying in the background", channel, exc)
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen, name="cache-invalidation", daemon=True)
+                self._listener.start()
+
+    def _listen(self):
+        # redis-py reconnects the one pub/sub connection and resubscribes it on the next read.
+        delay = 0.1
+        while not self._stopped.is_set():
+            try:
+                with self._lock:
+                    missing = {
+                        channel: handle for channel, handle in self._handlers.items()
+                        if channel.encode() not in self._pubsub.channels
+                    }
+                    if missing:
+                        self._pubsub.subscribe(**missing)
+                self._pubsub.get_message(timeout=self.timeout)
+                delay = 0.1
+            except redis.RedisError as exc:
+                if self._stopped.is_set():
+                    return
+                logger.warning("Cache subscription lost (%s); reconnecting in %.1fs", exc, delay)
+                self._stopped.wait(delay)
+                delay = min(delay * 2, 5.0)
+
+    def close(self):
+        self._stopped.set()
+        if self._listener is not None:
+            self._listener.join(self.timeout + 1)
+        self._pubsub.close()
+        self._client.close()
+
+
+BACKENDS = {
+    "local": LocalBackend,
+    "redis": RedisBackend,
+}
+
+backend: CacheBackend = BACKENDS[CACHE_BACKEND]()
+_handlers: dict[str, list] = {}
+_listening = False
+
+
+def set_backend(new_backend: CacheBackend):
+    global backend, _listening
+    backend.close()
+    backend = new_backend
+    _listening = False
+
+
+def on_invalidate(namespace: str, handler):
+    """Register ``handler(key, fields)`` for invalidations broadcast by other workers."""
+    _handlers.setdefault(namespace, []).append(handler)
+
+
+def broadcast(namespace: str, key, **fields):
+    """Tell the other workers that ``key`` in ``namespace`` changed."""
+    backend.publish(INVALIDATION_CHANNEL, orjson.dumps({
+        "origin": ORIGIN, "namespace": namespace, "key": str(key), "fields": fields,
+    }))
+
+
+def dispatch(message: bytes):
+    data = orjson.loads(message)
+    if data["origin"] == ORIGIN:
+        return
+    for handler in _handlers.get(data["namespace"], ()):
+        handler(data["key"], data["fields"])
+
+
+def start_listener():
+    global _listening
+    if not _listening:
+        backend.subscribe(INVALIDATION_CHANNEL, dispatch)
+        _listening = True
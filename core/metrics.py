@@ -0,0 +1,73 @@
+import time
+from contextlib import contextmanager
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, generate_latest
+from starlette.requests import Request
+from starlette.responses import Response
+
+from database.instrumentation import track_queries
+
+REQUESTS = Counter(
+    "http_requests_total", "HTTP requests by route and status", ["method", "route", "status"]
+)
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ["method", "route"]
+)
+DB_QUERIES = Histogram(
+    "db_queries_per_request", "SQL statements executed per request", ["route"],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100),
+)
+DB_TIME = Histogram(
+    "db_query_seconds_per_request", "Time spent in SQL per request", ["route"]
+)
+EXTERNAL_LATENCY = Histogram(
+    "external_call_duration_seconds", "Outbound API call latency", ["service", "outcome"]
+)
+
+
+@contextmanager
+def observe_external(service: str):
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        EXTERNAL_LATENCY.labels(service, outcome).observe(time.perf_counter() - start)
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        with track_queries() as stats:
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                elapsed = time.perf_counter() - start
+                route = scope.get("route")
+                path = route.path if route is not None else "unmatched"
+                method = scope["method"]
+                stats.label = f"{method} {path}"
+                REQUESTS.labels(method, path, str(status_code)).inc()
+                REQUEST_LATENCY.labels(method, path).observe(elapsed)
+                DB_QUERIES.labels(path).observe(stats.count)
+                DB_TIME.labels(path).observe(stats.duration)
+
+
+def metrics_endpoint(request: Request):
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,179 @@
+import asyncio
+import functools
+import hmac
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from pathlib import Path
+
+from fastapi.concurrency import run_in_threadpool
+from fastapi.routing import APIRoute
+
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", 50))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", 5))
+
+_IDLE_MODULES = ("threading.py", "queue.py", "selectors.py")
+
+# The profiler of the request being handled; the threadpool copies it along with the context.
+_profiler: ContextVar["SamplingProfiler | None"] = ContextVar("profiler", default=None)
+
+
+def _is_idle(frame):
+    return frame.f_code.co_filename.endswith(_IDLE_MODULES)
+
+
+def _stack(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{Path(code.co_filename).stem}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class SamplingProfiler:
+    """Samples the stacks of the threads running the request's handler, in the threadpool or not.
+
+    An ``async def`` handler shares the event loop thread, so whatever else runs on the loop
+    while it awaits is sampled too.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.samples = Counter()
+        self.threads = set()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for ident in list(self.threads):
+                frame = frames.get(ident)
+                if frame is not None and not _is_idle(frame):
+                    self.samples[_stack(frame)] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.samples
+
+
+def _on_handler_thread(call):
+    def enter():
+        profiler = _profiler.get()
+        if profiler is not None:
+            profiler.threads.add(threading.get_ident())
+        return profiler
+
+    def leave(profiler):
+        if profiler is not None:
+            profiler.threads.discard(threading.get_ident())
+
+    if asyncio.iscoroutinefunction(call):
+        @functools.wraps(call)
+        async def handler(*args, **kwargs):
+            profiler = enter()
+            try:
+                return await call(*args, **kwargs)
+            finally:
+                leave(profiler)
+    else:
+        @functools.wraps(call)
+        def handler(*args, **kwargs):
+            profiler = enter()
+            try:
+                return call(*args, **kwargs)
+            finally:
+                leave(profiler)
+    return handler
+
+
+def track_handler_threads(app):
+    """Let a request's profiler find the thread its handler runs on; call once the routes are added."""
+    for route in app.routes:
+        if isinstance(route, APIRoute):
+            route.dependant.call = _on_handler_thread(route.dependant.call)
+
+
+def write_profile(path: Path, samples: Counter):
+    path.write_text("".join(f"{stack} {count}\n" for stack, count in samples.most_common()))
+
+
+def rotate_profiles(directory: Path, keep: int):
+    profiles = sorted(directory.glob("*.folded"), key=lambda p: p.stat().st_mtime)
+    for path in profiles[:max(len(profiles) - keep, 0)]:
+        path.unlink(missing_ok=True)
+
+
+class ProfilingMiddleware:
+    def __init__(
+            self,
+            app,
+            token: str | None = PROFILE_TOKEN,
+            sample_rate: float = PROFILE_SAMPLE_RATE,
+            directory: str = PROFILE_DIR,
+            keep: int = PROFILE_KEEP,
+            interval_ms: float = PROFILE_INTERVAL_MS,
+    ):
+        self.app = app
+        self.token = token.encode() if token else None
+        self.sample_rate = sample_rate
+        self.directory = Path(directory)
+        self.keep = keep
+        self.interval = interval_ms / 1000
+        self._busy = threading.Lock()
+
+    def _wanted(self, scope):
+        """Return ``(profile, requested)``; only a caller with the token learns where the profile went."""
+        if self.token is not None:
+            for name, value in scope["headers"]:
+                if name == b"x-profile":
+                    requested = hmac.compare_digest(value, self.token)
+                    return requested, requested
+        return self.sample_rate > 0 and random.random() < self.sample_rate, False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        profile, requested = self._wanted(scope)
+        if not profile or not self._busy.acquire(blocking=False):
+            await self.app(scope, receive, send)
+            return
+
+        await run_in_threadpool(self.directory.mkdir, parents=True, exist_ok=True)
+        slug = scope["path"].strip("/").replace("/", "_") or "root"
+        path = self.directory / f"{time.strftime('%Y%m%d-%H%M%S')}-{time.perf_counter_ns()}-{scope['method']}-{slug}.folded"
+
+        async def send_wrapper(message):
+            if requested and message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-profile-path", str(path).encode())]
+            await send(message)
+
+        profiler = SamplingProfiler(self.interval)
+        profiler.start()
+        token = _profiler.set(profiler)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _profiler.reset(token)
+            try:
+                await run_in_threadpool(self._save, path, profiler)
+            finally:
+                self._busy.release()
+
+    def _save(self, path, profiler):
+        write_profile(path, profiler.stop())
+        rotate_profiles(self.directory, self.keep)
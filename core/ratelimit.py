@@ -0,0 +1,111 @@
+import itertools
+import math
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+
+from fastapi import Depends, HTTPException, Request, status
+
+from users import models, services
+
+
+class RateLimitBackend(ABC):
+    """Token bucket storage. Implementations must make ``consume`` atomic per key."""
+
+    @abstractmethod
+    def consume(self, key: str, rate: float, capacity: float, cost: float = 1.0) -> float:
+        """Take ``cost`` tokens from the bucket and return 0, or the seconds to wait."""
+
+    @abstractmethod
+    def reset(self):
+        pass
+
+
+class MemoryBackend(RateLimitBackend):
+    def __init__(self, shards: int = 16, max_keys_per_shard: int = 10000, clock=time.monotonic):
+        self._shards = [(threading.Lock(), {}) for _ in range(shards)]
+        self._max_keys = max_keys_per_shard
+        self._clock = clock
+
+    def consume(self, key, rate, capacity, cost=1.0):
+        lock, buckets = self._shards[hash(key) % len(self._shards)]
+        now = self._clock()
+        with lock:
+            # Popped and re-added, so the dict stays in least recently used order.
+            bucket = buckets.pop(key, None)
+            if bucket is None:
+                tokens = capacity
+            else:
+                tokens = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+
+            if tokens >= cost:
+                buckets[key] = (tokens - cost, now, rate, capacity)
+                wait = 0.0
+            else:
+                buckets[key] = (tokens, now, rate, capacity)
+                wait = (cost - tokens) / rate
+
+            if len(buckets) > self._max_keys:
+                self._evict(buckets, now)
+        return wait
+
+    def _evict(self, buckets, now):
+        # A refilled bucket is indistinguishable from a missing one.
+        for key, (tokens, updated, rate, capacity) in list(buckets.items()):
+            if tokens + (now - updated) * rate >= capacity:
+                del buckets[key]
+        # Then the least recently used, leaving room for a tenth more keys before the next scan.
+        target = self._max_keys - max(1, self._max_keys // 10)
+        for key in list(itertools.islice(buckets, max(0, len(buckets) - target))):
+            del buckets[key]
+
+    def reset(self):
+        for lock, buckets in self._shards:
+            with lock:
+                buckets.clear()
+
+
+backend: RateLimitBackend = MemoryBackend()
+
+
+def set_backend(new_backend: RateLimitBackend):
+    global backend
+    backend = new_backend
+
+
+def parse_limit(value: str):
+    """Parse ``"<requests>/<seconds>"`` into ``(rate per second, capacity)``."""
+    requests, seconds = value.split("/")
+    capacity = float(requests)
+    return capacity / float(seconds), capacity
+
+
+def client_ip(request: Request):
+    return request.client.host if request.client else "unknown"
+
+
+def _enforce(key: str, rate: float, capacity: float):
+    wait = backend.consume(key, rate, capacity)
+    if wait > 0:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many requests",
+            headers={"Retry-After": str(math.ceil(wait))},
+        )
+
+
+def rate_limit(name: str, default: str, per: str = "ip"):
+    """Build a route dependency limited by ``RATE_LIMIT_<NAME>`` (falls back to ``default``)."""
+    rate, capacity = parse_limit(os.getenv(f"RATE_LIMIT_{name.upper()}", default))
+
+    if per == "user":
+        def limit_by_user(user: models.User = Depends(services.get_current_user)):
+            _enforce(f"{name}:user:{user.id}", rate, capacity)
+
+        return limit_by_user
+
+    def limit_by_ip(request: Request):
+        _enforce(f"{name}:ip:{client_ip(request)}", rate, capacity)
+
+    return limit_by_ip
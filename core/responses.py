@@ -0,0 +1,17 @@
+import orjson
+from fastapi.responses import Response
+
+
+def rows_response(fields: tuple[str, ...], rows, status_code: int = 200) -> Response:
+    """Serialize selected column tuples straight to JSON.
+
+    This skips ORM hydration, ``response_model`` validation and ``jsonable_encoder``,
+    so the rows must already match the documented schema.
+    """
+    content = orjson.dumps([dict(zip(fields, row)) for row in rows])
+    return Response(content, status_code=status_code, media_type="application/json")
+
+
+def row_response(fields: tuple[str, ...], row, status_code: int = 200) -> Response:
+    content = orjson.dumps(dict(zip(fields, row)))
+    return Response(content, status_code=status_code, media_type="application/json")
@@ -0,0 +1,58 @@
+import os
+import threading
+
+SINGLE_FLIGHT_TIMEOUT = float(os.getenv("SINGLE_FLIGHT_TIMEOUT", 5))
+
+
+class SingleFlightTimeout(TimeoutError):
+    pass
+
+
+class _Call:
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Runs one loader per key at a time; concurrent callers wait for its result.
+
+    Results are shared between threads, so loaders must return plain data or
+    detached objects rather than instances bound to the caller's session.
+    """
+
+    def __init__(self, timeout: float = SINGLE_FLIGHT_TIMEOUT):
+        self.timeout = timeout
+        self._calls: dict = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, loader, timeout: float | None = None):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if leader:
+            try:
+                call.result = loader()
+            except Exception as exc:
+                call.error = exc
+                raise
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.event.set()
+            return call.result
+
+        if not call.event.wait(self.timeout if timeout is None else timeout):
+            raise SingleFlightTimeout(f"Timed out waiting for {key!r}")
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+
+single_flight = SingleFlight()
@@ -0,0 +1,472 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import fakeredis
+import orjson
+import pytest
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import StaticPool
+
+from core import cache, ratelimit
+from core.cache import LocalBackend, RedisBackend
+from core.metrics import MetricsMiddleware, metrics_endpoint, observe_external
+from core.profiling import ProfilingMiddleware, rotate_profiles, track_handler_threads
+from core.ratelimit import MemoryBackend, parse_limit, rate_limit
+from core.singleflight import SingleFlight, SingleFlightTimeout
+from database import instrumentation
+from database.instrumentation import instrument, normalize_sql, track_queries
+
+engine = create_engine(
+    "sqlite:///:memory:",
+    connect_args={"check_same_thread": False},
+    poolclass=StaticPool,
+)
+instrument(engine)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def limiter(clock):
+    backend = MemoryBackend(shards=4, clock=clock)
+    ratelimit.set_backend(backend)
+    yield backend
+    ratelimit.set_backend(MemoryBackend())
+
+
+# Rate limiting
+def test_parse_limit():
+    assert parse_limit("10/60") == (10 / 60, 10)
+
+
+def test_bucket_allows_burst_then_denies(clock, limiter):
+    for _ in range(3):
+        assert limiter.consume("key", rate=1, capacity=3) == 0
+    assert limiter.consume("key", rate=1, capacity=3) == pytest.approx(1)
+
+
+def test_bucket_refills_over_time(clock, limiter):
+    for _ in range(3):
+        limiter.consume("key", rate=1, capacity=3)
+    clock.now += 2
+    assert limiter.consume("key", rate=1, capacity=3) == 0
+    assert limiter.consume("key", rate=1, capacity=3) == 0
+    assert limiter.consume("key", rate=1, capacity=3) > 0
+
+
+def test_buckets_are_independent_per_key(clock, limiter):
+    assert limiter.consume("a", rate=1, capacity=1) == 0
+    assert limiter.consume("b", rate=1, capacity=1) == 0
+    assert limiter.consume("a", rate=1, capacity=1) > 0
+
+
+def test_full_buckets_are_evicted(clock):
+    backend = MemoryBackend(shards=1, max_keys_per_shard=2, clock=clock)
+    backend.consume("a", rate=1, capacity=1)
+    backend.consume("b", rate=1, capacity=1)
+    clock.now += 5
+    backend.consume("c", rate=1, capacity=1)
+    assert len(backend._shards[0][1]) == 1
+
+
+def test_eviction_refills_each_bucket_at_its_own_rate(clock):
+    backend = MemoryBackend(shards=1, max_keys_per_shard=3, clock=clock)
+    backend.consume("slow", rate=0.01, capacity=1)
+    backend.consume("b", rate=1, capacity=1)
+    backend.consume("c", rate=1, capacity=1)
+    clock.now += 5
+    backend.consume("d", rate=1, capacity=1)
+    assert list(backend._shards[0][1]) == ["slow", "d"]
+
+
+def test_least_recently_used_buckets_go_when_none_are_full(clock):
+    backend = MemoryBackend(shards=1, max_keys_per_shard=20, clock=clock)
+    for i in range(21):
+        backend.consume(f"key{i}", rate=1, capacity=1)
+    buckets = backend._shards[0][1]
+    assert list(buckets) == [f"key{i}" for i in range(3, 21)]
+
+    # The headroom spares the next inserts a scan.
+    backend.consume("key21", rate=1, capacity=1)
+    assert len(buckets) == 19
+
+
+def test_dependency_returns_retry_after(limiter):
+    app = FastAPI()
+
+    @app.get("/limited", dependencies=[Depends(rate_limit("test", "2/10"))])
+    def limited():
+        return {"ok": True}
+
+    client = TestClient(app)
+    assert client.get("/limited").status_code == 200
+    assert client.get("/limited").status_code == 200
+
+    response = client.get("/limited")
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "5"
+
+
+def test_limit_is_configurable_by_env(monkeypatch, limiter):
+    monkeypatch.setenv("RATE_LIMIT_CONFIGURED", "1/60")
+    app = FastAPI()
+
+    @app.get("/limited", dependencies=[Depends(rate_limit("configured", "100/1"))])
+    def limited():
+        return {"ok": True}
+
+    client = TestClient(app)
+    assert client.get("/limited").status_code == 200
+    assert client.get("/limited").status_code == 429
+
+
+# Metrics
+@pytest.fixture
+def metrics_client():
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware)
+    app.add_route("/metrics", metrics_endpoint)
+
+    @app.get("/items/{item_id}")
+    def get_item(item_id: int):
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+            conn.execute(text("SELECT 2"))
+        return {"id": item_id}
+
+    return TestClient(app)
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_normalize_sql():
+    statement = "SELECT * FROM posts WHERE id = 12 AND title = 'it''s'  AND user_id IN (?, ?, ?)"
+    assert normalize_sql(statement) == "SELECT * FROM posts WHERE id = ? AND title = ? AND user_id IN (?)"
+
+
+def test_slow_queries_are_logged(monkeypatch, caplog):
+    monkeypatch.setattr(instrumentation, "SLOW_QUERY_MS", 0)
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 42"))
+    assert "Slow query" in caplog.text
+    assert "SELECT ?" in caplog.text
+
+
+def test_repeated_statements_are_flagged(caplog):
+    with track_queries("GET /items") as stats:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+            conn.execute(text("SELECT 2"))
+            conn.execute(text("SELECT 'other'"))
+    assert stats.repeated(3) == [("SELECT ?", 3)]
+    assert "Repeated query x3 in GET /items: SELECT ?" in caplog.text
+
+
+def test_max_queries_fixture(max_queries):
+    with max_queries(engine, 1):
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+
+    with pytest.raises(AssertionError, match="at most 1 queries, got 2"):
+        with max_queries(engine, 1):
+            with engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+                conn.execute(text("SELECT 2"))
+
+
+def test_track_queries_counts_statements():
+    with track_queries() as stats:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+    assert stats.count == 1
+    assert stats.duration > 0
+
+
+def test_queries_outside_request_are_not_tracked():
+    with track_queries() as stats:
+        pass
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+    assert stats.count == 0
+
+
+def test_middleware_records_route_template(metrics_client):
+    labels = {"method": "GET", "route": "/items/{item_id}"}
+    requests_before = sample("http_requests_total", status="200", **labels)
+    latency_before = sample("http_request_duration_seconds_count", **labels)
+    queries_before = sample("db_queries_per_request_sum", route="/items/{item_id}")
+
+    metrics_client.get("/items/1")
+    metrics_client.get("/items/2")
+
+    assert sample("http_requests_total", status="200", **labels) == requests_before + 2
+    assert sample("http_request_duration_seconds_count", **labels) == latency_before + 2
+    assert sample("db_queries_per_request_sum", route="/items/{item_id}") == queries_before + 4
+
+
+def test_middleware_groups_unmatched_paths(metrics_client):
+    before = sample("http_requests_total", method="GET", route="unmatched", status="404")
+    metrics_client.get("/missing/1")
+    assert sample("http_requests_total", method="GET", route="unmatched", status="404") == before + 1
+
+
+def test_observe_external_records_outcome():
+    before = sample("external_call_duration_seconds_count", service="test", outcome="error")
+    with pytest.raises(ValueError):
+        with observe_external("test"):
+            raise ValueError
+    assert sample("external_call_duration_seconds_count", service="test", outcome="error") == before + 1
+
+
+def test_metrics_endpoint_serves_prometheus_text(metrics_client):
+    metrics_client.get("/items/1")
+    response = metrics_client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'http_request_duration_seconds_bucket{le="0.005",method="GET",route="/items/{item_id}"}' in response.text
+
+
+# Profiling
+def profiled_client(**options):
+    app = FastAPI()
+    app.add_middleware(ProfilingMiddleware, interval_ms=1, **options)
+
+    @app.get("/slow")
+    def slow():
+        time.sleep(0.05)
+        return {"ok": True}
+
+    @app.get("/other")
+    def other():
+        time.sleep(0.2)
+        return {"ok": True}
+
+    track_handler_threads(app)
+    return TestClient(app)
+
+
+def test_profile_requested_by_header(tmp_path):
+    client = profiled_client(token="secret", directory=str(tmp_path))
+    response = client.get("/slow", headers={"X-Profile": "secret"})
+
+    path = Path(response.headers["X-Profile-Path"])
+    assert path.parent == tmp_path
+    assert "tests:slow" in path.read_text()
+
+
+def test_profile_only_samples_the_profiled_request(tmp_path):
+    client = profiled_client(token="secret", directory=str(tmp_path))
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        other = pool.submit(client.get, "/other")
+        time.sleep(0.02)
+        response = client.get("/slow", headers={"X-Profile": "secret"})
+        assert other.result().status_code == 200
+
+    profile = Path(response.headers["X-Profile-Path"]).read_text()
+    assert "tests:slow" in profile
+    assert "tests:other" not in profile
+
+
+def test_profile_not_taken_with_wrong_token(tmp_path):
+    client = profiled_client(token="secret", directory=str(tmp_path))
+    response = client.get("/slow", headers={"X-Profile": "guess"})
+
+    assert "X-Profile-Path" not in response.headers
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_profile_taken_by_sampling(tmp_path):
+    client = profiled_client(token=None, sample_rate=1.0, directory=str(tmp_path))
+    response = client.get("/slow")
+
+    assert response.status_code == 200
+    # The caller did not ask for the profile, so it is not told where it went.
+    assert "X-Profile-Path" not in response.headers
+    assert len(list(tmp_path.glob("*.folded"))) == 1
+
+
+def test_rotate_profiles_keeps_newest(tmp_path):
+    for i in range(5):
+        path = tmp_path / f"{i}.folded"
+        path.write_text("")
+        os.utime(path, (i, i))
+
+    rotate_profiles(tmp_path, keep=2)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["3.folded", "4.folded"]
+
+
+# Single flight
+def test_single_flight_coalesces_concurrent_loads():
+    flight = SingleFlight()
+    calls = []
+    release = threading.Event()
+
+    def loader():
+        calls.append(1)
+        release.wait(1)
+        return "value"
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        futures = [pool.submit(flight.do, "key", loader) for _ in range(8)]
+        time.sleep(0.05)
+        release.set()
+        results = [future.result() for future in futures]
+
+    assert results == ["value"] * 8
+    assert len(calls) == 1
+
+
+def test_single_flight_propagates_errors_to_waiters():
+    flight = SingleFlight()
+    started = threading.Event()
+
+    def loader():
+        started.set()
+        time.sleep(0.05)
+        raise ValueError("boom")
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        leader = pool.submit(flight.do, "key", loader)
+        started.wait(1)
+        follower = pool.submit(flight.do, "key", lambda: "unused")
+        for future in (leader, follower):
+            with pytest.raises(ValueError, match="boom"):
+                future.result()
+
+
+def test_single_flight_waiter_times_out():
+    flight = SingleFlight(timeout=0.01)
+    started = threading.Event()
+    release = threading.Event()
+
+    def loader():
+        started.set()
+        release.wait(1)
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        leader = pool.submit(flight.do, "key", loader)
+        started.wait(1)
+        with pytest.raises(SingleFlightTimeout):
+            flight.do("key", lambda: "unused")
+        release.set()
+        leader.result()
+
+
+def test_single_flight_reloads_after_completion():
+    flight = SingleFlight()
+    assert flight.do("key", lambda: 1) == 1
+    assert flight.do("key", lambda: 2) == 2
+
+
+# Shared cache
+@pytest.fixture
+def redis_server():
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+def redis_backend(redis_server):
+    backend = RedisBackend(client=fakeredis.FakeRedis(server=redis_server))
+    yield backend
+    backend.close()
+
+
+def other_worker(redis_server):
+    return RedisBackend(client=fakeredis.FakeRedis(server=redis_server))
+
+
+def test_local_backend_evicts_least_recently_used(clock):
+    backend = LocalBackend(max_entries=2, clock=clock)
+    backend.set("a", b"1")
+    backend.set("b", b"2")
+    backend.get("a")
+    backend.set("c", b"3")
+    assert (backend.get("a"), backend.get("b"), backend.get("c")) == (b"1", None, b"3")
+
+
+def test_local_backend_expires_entries(clock):
+    backend = LocalBackend(clock=clock)
+    backend.set("a", b"1", ttl=10)
+    clock.now += 11
+    assert backend.get("a") is None
+
+
+def test_redis_backend_round_trip(redis_backend, redis_server):
+    redis_backend.set("key", b"value")
+    redis_backend.set("short", b"lived", ttl=60)
+    assert redis_backend.get("key") == b"value"
+    assert other_worker(redis_server).get("short") == b"lived"
+    assert redis_backend.get("missing") is None
+
+    redis_backend.delete("key", "short")
+    assert redis_backend.get("key") is None
+    assert fakeredis.FakeRedis(server=redis_server).keys() == []
+
+
+def test_redis_backend_degrades_to_misses(caplog):
+    backend = RedisBackend("redis://127.0.0.1:1/0", timeout=0.1)
+    backend.set("key", b"value")
+    assert backend.get("key") is None
+    assert "Cache command GET failed" in caplog.text
+
+
+def test_redis_backend_pub_sub(redis_backend, redis_server):
+    received = []
+    delivered = threading.Event()
+    redis_backend.subscribe("channel", lambda message: (received.append(message), delivered.set()))
+
+    other_worker(redis_server).publish("channel", b"hello")
+    assert delivered.wait(1)
+    assert received == [b"hello"]
+
+
+def test_redis_subscription_survives_a_lost_connection(redis_backend, redis_server, caplog):
+    received = []
+    delivered = threading.Event()
+    redis_backend.subscribe("channel", lambda message: (received.append(message), delivered.set()))
+
+    redis_server.connected = False
+    time.sleep(0.3)
+    redis_server.connected = True
+    assert "Cache subscription lost" in caplog.text
+    for _ in range(50):
+        other_worker(redis_server).publish("channel", b"again")
+        if delivered.wait(0.1):
+            break
+    assert received[0] == b"again"
+
+
+def test_invalidations_from_other_workers_reach_handlers(redis_backend, redis_server, monkeypatch):
+    monkeypatch.setattr(cache, "_handlers", {})
+    monkeypatch.setattr(cache, "backend", redis_backend)
+    monkeypatch.setattr(cache, "_listening", False)
+    received = []
+    delivered = threading.Event()
+    cache.on_invalidate("post", lambda key, fields: (received.append((key, fields)), delivered.set()))
+    cache.start_listener()
+
+    cache.broadcast("post", 1)
+    message = {"origin": "other-worker", "namespace": "post", "key": "2", "fields": {"title": "changed"}}
+    other_worker(redis_server).publish(cache.INVALIDATION_CHANNEL, orjson.dumps(message))
+
+    assert delivered.wait(1)
+    assert received == [("2", {"title": "changed"})]
@@ -1,13 +1,26 @@
+import os
+
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
 
+from database.sharding import Shards
+
 SQLALCHEMY_DATABASE_URL = "sqlite:///./posts_users.db"
+# Comma separated URLs for the post shards; empty keeps everything in one database.
+DB_SHARDS = [url.strip() for url in os.getenv("DB_SHARDS", "").split(",") if url.strip()]
+
+
+def create_db_engine(url: str):
+    return create_engine(url, connect_args={"check_same_thread": False})
+
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
+engine = create_db_engine(SQLALCHEMY_DATABASE_URL)
+shards = Shards(engine, [create_db_engine(url) for url in DB_SHARDS]) if DB_SHARDS else None
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+if shards:
+    SessionLocal = shards.sessionmaker
+else:
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
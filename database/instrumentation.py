@@ -0,0 +1,109 @@
+import logging
+import os
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+from database.engine import engine, shards
+
+logger = logging.getLogger("database.queries")
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", 200))
+REPEATED_QUERY_THRESHOLD = int(os.getenv("REPEATED_QUERY_THRESHOLD", 2))
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_sql(statement: str):
+    statement = _LITERALS.sub("?", statement)
+    statement = _IN_LISTS.sub("(?)", statement)
+    return _SPACES.sub(" ", statement).strip()
+
+
+class QueryStats:
+    __slots__ = ("count", "duration", "statements", "label")
+
+    def __init__(self, label=None):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+        self.label = label
+
+    def repeated(self, threshold: int):
+        shapes = Counter()
+        for statement, count in self.statements.items():
+            shapes[normalize_sql(statement)] += count
+        return [(shape, count) for shape, count in shapes.items() if count >= threshold]
+
+
+_current_stats: ContextVar[QueryStats | None] = ContextVar("query_stats", default=None)
+
+
+@contextmanager
+def track_queries(label=None):
+    stats = QueryStats(label)
+    token = _current_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_stats.reset(token)
+        if REPEATED_QUERY_THRESHOLD:
+            for shape, count in stats.repeated(REPEATED_QUERY_THRESHOLD):
+                logger.warning("Repeated query x%d in %s: %s", count, stats.label, shape)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.count += 1
+        stats.duration += elapsed
+        stats.statements[statement] += 1
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        logger.warning("Slow query (%.1f ms): %s", elapsed * 1000, normalize_sql(statement))
+
+
+def instrument(target_engine):
+    if not event.contains(target_engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(target_engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(target_engine, "after_cursor_execute", _after_cursor_execute)
+
+
+@contextmanager
+def count_queries(target_engine):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(target_engine, "after_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(target_engine, "after_cursor_execute", record)
+
+
+@contextmanager
+def assert_max_queries(target_engine, limit: int):
+    with count_queries(target_engine) as statements:
+        yield statements
+    if len(statements) > limit:
+        raise AssertionError(
+            f"Expected at most {limit} queries, got {len(statements)}:\n" + "\n".join(statements)
+        )
+
+
+instrument(engine)
+if shards:
+    for shard_engine in shards.engines.values():
+        instrument(shard_engine)
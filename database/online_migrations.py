@@ -0,0 +1,187 @@
+"""Rewrite existing rows in small key-ordered chunks while the app keeps serving.
+
+    python -m database.online_migrations comment-thread-paths
+    python -m database.online_migrations --status
+
+A schema change that needs old rows filled in ships in three steps: an
+Alembic revision adds the columns (cheap in SQLite), an online migration
+registered here backfills them, and the revision that relies on the data
+calls ``require``, so it refuses to run until the backfill has finished.
+
+Each migration walks its table by primary key, one id range per short
+transaction with a pause in between, and checkpoints its cursor in
+``jobs``, so an interrupted run carries on where it stopped.
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+from sqlalchemy import bindparam, func, inspect, select, update
+from sqlalchemy.orm import Session
+
+from comments.models import Comment, thread_path
+from database.engine import SessionLocal
+from database.sharding import scatter
+from jobs import crud as jobs
+from jobs.models import Job
+
+logger = logging.getLogger(__name__)
+
+ONLINE_MIGRATION_CHUNK_SIZE = int(os.getenv("ONLINE_MIGRATION_CHUNK_SIZE", 1000))
+ONLINE_MIGRATION_PAUSE_MS = int(os.getenv("ONLINE_MIGRATION_PAUSE_MS", 50))
+
+
+class PendingMigration(RuntimeError):
+    pass
+
+
+class OnlineMigration:
+    """Rows of ``table`` matching ``pending`` still need ``apply(session, start, end)``.
+
+    ``apply`` migrates the pending rows with ids in ``(start, end]`` and
+    returns how many it touched.
+    """
+
+    def __init__(self, name: str, table, pending, apply):
+        self.name = name
+        self.table = table
+        self.pending = pending
+        self.apply = apply
+
+    @property
+    def job_name(self):
+        return f"migration:{self.name}"
+
+
+MIGRATIONS: dict[str, OnlineMigration] = {}
+
+
+def register(name: str, table, pending):
+    def decorator(apply):
+        MIGRATIONS[name] = OnlineMigration(name, table, pending, apply)
+        return apply
+    return decorator
+
+
+def _next_start(db: Session, migration: OnlineMigration, cursor: int):
+    """Skip ranges with nothing to do: the id just before the next pending row, if any."""
+    key = migration.table.c.id
+    found = [
+        first for first in scatter(
+            db, lambda session: session.scalar(select(func.min(key)).where(key > cursor, migration.pending))
+        ) if first is not None
+    ]
+    return min(found) - 1 if found else None
+
+
+def run_migration(
+        db: Session,
+        migration: OnlineMigration,
+        chunk_size: int = ONLINE_MIGRATION_CHUNK_SIZE,
+        pause_ms: int = ONLINE_MIGRATION_PAUSE_MS,
+        sleep=time.sleep,
+) -> Job:
+    job = jobs.start_job(db, migration.job_name)
+    if job.params is None:
+        key = migration.table.c.id
+        summaries = scatter(
+            db, lambda session: session.execute(select(func.count(), func.max(key)).where(migration.pending)).one()
+        )
+        job.total = sum(count for count, _ in summaries)
+        # Rows written after this point come from code that already fills the data in.
+        job.params = {"max_id": max((last or 0 for _, last in summaries), default=0)}
+        db.commit()
+
+    max_id = job.params["max_id"]
+    try:
+        while job.cursor < max_id:
+            start = _next_start(db, migration, job.cursor)
+            if start is None or start >= max_id:
+                break
+            end = min(start + chunk_size, max_id)
+            processed = sum(scatter(db, lambda session: migration.apply(session, start, end)))
+            jobs.checkpoint(job, cursor=end, processed=processed)
+            db.commit()
+
+            logger.info("Online migration %s: %d of %s rows", migration.name, job.processed, job.total)
+            if job.cursor < max_id:
+                sleep(pause_ms / 1000)
+    except Exception as exc:
+        jobs.fail_job(db, job, exc)
+        raise
+
+    jobs.finish_job(db, job)
+    return job
+
+
+def progress(db: Session, migration: OnlineMigration):
+    job = db.query(Job).filter(Job.name == migration.job_name).order_by(Job.id.desc()).first()
+    if job is None:
+        return {"name": migration.name, "status": "not started", "processed": 0, "total": None}
+    return {"name": migration.name, "status": job.status, "processed": job.processed, "total": job.total}
+
+
+def require(connection, name: str):
+    """For Alembic revisions that rely on a backfill: fail unless no rows are left to migrate.
+
+    env.py runs revisions on every shard too, so each one is checked on its own rows.
+    """
+    migration = MIGRATIONS[name]
+    if not inspect(connection).has_table(migration.table.name):
+        return
+    left = connection.execute(select(func.count()).select_from(migration.table).where(migration.pending)).scalar()
+    if left:
+        raise PendingMigration(
+            f"{left} rows still need the {name!r} online migration; "
+            f"run `python -m database.online_migrations {name}` first"
+        )
+
+
+@register("comment-thread-paths", Comment.__table__, Comment.path.is_(None))
+def fill_thread_paths(session: Session, start: int, end: int) -> int:
+    """Comments written before threaded replies have no materialized path."""
+    rows = session.execute(
+        select(Comment.id, Comment.parent_id)
+        .where(Comment.id > start, Comment.id <= end, Comment.path.is_(None))
+        .order_by(Comment.id)
+    ).all()
+    parent_ids = {row.parent_id for row in rows if row.parent_id is not None}
+    paths = dict(session.execute(select(Comment.id, Comment.path).where(Comment.id.in_(parent_ids))).all())
+
+    # Parents have smaller ids, so one met in this chunk already has its new path.
+    for comment_id, parent_id in rows:
+        prefix = "" if parent_id is None else paths.get(parent_id) or thread_path(parent_id)
+        paths[comment_id] = prefix + thread_path(comment_id)
+    if rows:
+        table = Comment.__table__
+        session.execute(
+            update(table).where(table.c.id == bindparam("comment_id")).values(path=bindparam("new_path")),
+            [{"comment_id": comment_id, "new_path": paths[comment_id]} for comment_id, _ in rows],
+        )
+    return len(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("names", nargs="*", help=f"Migrations to run, of {', '.join(MIGRATIONS)}; all by default")
+    parser.add_argument("--status", action="store_true", help="Only report progress")
+    parser.add_argument("--chunk-size", type=int, default=ONLINE_MIGRATION_CHUNK_SIZE)
+    parser.add_argument("--pause-ms", type=int, default=ONLINE_MIGRATION_PAUSE_MS)
+    args = parser.parse_args(argv)
+    unknown = set(args.names) - set(MIGRATIONS)
+    if unknown:
+        parser.error(f"unknown migrations: {', '.join(sorted(unknown))}")
+
+    logging.basicConfig(level=logging.INFO)
+    with SessionLocal() as db:
+        for name in args.names or MIGRATIONS:
+            if not args.status:
+                run_migration(db, MIGRATIONS[name], chunk_size=args.chunk_size, pause_ms=args.pause_ms)
+            state = progress(db, MIGRATIONS[name])
+            print(f"{name}: {state['status']}, {state['processed']} of {state['total']} rows")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,141 @@
+"""Move posts, with their comments and scores, onto a new set of shards.
+
+    python -m database.reshard --to sqlite:///./shard0.db,sqlite:///./shard1.db,sqlite:///./shard2.db
+
+Posts are walked in id order, a chunk at a time. Each chunk is copied to its
+new shard before it is deleted from the old one, and progress is
+checkpointed in the main database, so an interrupted run can simply be
+started again. Without ``--from`` the current ``DB_SHARDS``, or the main
+database, is read.
+
+The run is recorded in the main database before anything moves, and from
+then on the app answers 503 for posts and comments, so nothing is read from
+or written to a shard a post is leaving. Restart it with ``DB_SHARDS``
+pointing at the new shards once the run finishes.
+
+If the run fails before any post has left its old shard, the app serves
+posts again from the old shards. Otherwise the posts are split between old
+and new shards and the 503s continue: run the same command again to finish
+the move. A resumed run must be given the same ``--from`` and ``--to``.
+"""
+import argparse
+import os
+import sys
+import time
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.orm import Session
+
+from database.engine import DB_SHARDS, SQLALCHEMY_DATABASE_URL, Base, create_db_engine, engine
+from database.sharding import RESHARD_CHECK_SECONDS, SHARD_KEYS, sharded_tables, url_of
+from jobs import crud as jobs
+
+RESHARD_CHUNK_SIZE = int(os.getenv("DB_RESHARD_CHUNK_SIZE", 500))
+RESHARD_PAUSE_MS = int(os.getenv("DB_RESHARD_PAUSE_MS", 50))
+
+
+def _next_posts(sources, cursor: int, chunk_size: int):
+    """The next ``chunk_size`` post ids after ``cursor``, with the source each one lives on."""
+    posts = Base.metadata.tables["posts"]
+    found = []
+    for index, source in enumerate(sources):
+        with source.connect() as conn:
+            ids = conn.execute(
+                select(posts.c.id).where(posts.c.id > cursor).order_by(posts.c.id).limit(chunk_size)
+            ).scalars()
+            found.extend((post_id, index) for post_id in ids)
+    return sorted(found)[:chunk_size]
+
+
+def _move(source, target, post_ids: list[int]):
+    tables = sharded_tables(Base.metadata)
+    with source.connect() as conn:
+        rows = {
+            table: conn.execute(
+                select(table).where(table.c[SHARD_KEYS[table.name]].in_(post_ids)).order_by(*table.primary_key)
+            ).mappings().all()
+            for table in tables
+        }
+    # Copy first, so a crash in between leaves a duplicate to overwrite rather than a lost post.
+    with target.begin() as conn:
+        for table in tables:
+            if rows[table]:
+                conn.execute(insert(table).prefix_with("OR REPLACE"), [dict(row) for row in rows[table]])
+    with source.begin() as conn:
+        for table in reversed(tables):
+            conn.execute(delete(table).where(table.c[SHARD_KEYS[table.name]].in_(post_ids)))
+
+
+def reshard(
+        db: Session,
+        sources: list,
+        targets: list,
+        chunk_size: int = RESHARD_CHUNK_SIZE,
+        pause_ms: int = RESHARD_PAUSE_MS,
+        sleep=time.sleep,
+):
+    """Move every post to ``shard{post_id % len(targets)}`` and return how many moved."""
+    for target in targets:
+        Base.metadata.create_all(target, tables=sharded_tables(Base.metadata))
+
+    params = {"sources": [url_of(source) for source in sources], "targets": [url_of(target) for target in targets]}
+    job = jobs.start_job(db, f"reshard:{len(targets)}")
+    if job.params is not None and job.params != params:
+        # Posts already moved are where the first run's targets put them.
+        jobs.fail_job(db, job, ValueError("resumed with other shards"))
+        raise ValueError(
+            f"An unfinished reshard moves posts to {job.params.get('targets')}; run it again with the same shards"
+        )
+    job.params = params
+    db.commit()
+    # Every worker notices within RESHARD_CHECK_SECONDS; the rest lets requests already past the check finish.
+    sleep(2 * RESHARD_CHECK_SECONDS)
+
+    moved = 0
+    try:
+        while True:
+            chunk = _next_posts(sources, job.cursor or 0, chunk_size)
+            if not chunk:
+                break
+
+            batches = {}
+            for post_id, index in chunk:
+                source, target = sources[index], targets[post_id % len(targets)]
+                if source.url != target.url:
+                    batches.setdefault((index, post_id % len(targets)), []).append(post_id)
+            for (source_index, target_index), post_ids in batches.items():
+                _move(sources[source_index], targets[target_index], post_ids)
+                # Counted once they left their old shard: from then on a failed run keeps the app out.
+                jobs.checkpoint(job, job.cursor, len(post_ids))
+                db.commit()
+                moved += len(post_ids)
+
+            jobs.checkpoint(job, chunk[-1][0], 0)
+            db.commit()
+            if len(chunk) < chunk_size:
+                break
+            sleep(pause_ms / 1000)
+    except Exception as exc:
+        jobs.fail_job(db, job, exc)
+        raise
+    jobs.finish_job(db, job)
+    return moved
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--to", required=True, help="Comma separated URLs of the new shards")
+    parser.add_argument("--from", dest="sources", default=",".join(DB_SHARDS) or SQLALCHEMY_DATABASE_URL)
+    parser.add_argument("--chunk-size", type=int, default=RESHARD_CHUNK_SIZE)
+    parser.add_argument("--pause-ms", type=int, default=RESHARD_PAUSE_MS)
+    args = parser.parse_args(argv)
+
+    sources = [create_db_engine(url.strip()) for url in args.sources.split(",") if url.strip()]
+    targets = [create_db_engine(url.strip()) for url in args.to.split(",") if url.strip()]
+    with Session(bind=engine) as db:
+        moved = reshard(db, sources, targets, chunk_size=args.chunk_size, pause_ms=args.pause_ms)
+    print(f"Moved {moved} posts onto {len(targets)} shards; restart the app with DB_SHARDS={args.to}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
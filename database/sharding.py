@@ -0,0 +1,367 @@
+"""Place each post, with its comments and score, on one of several databases.
+
+Set ``DB_SHARDS`` to a comma separated list of database URLs to turn this on.
+Users, tokens, jobs and the other global tables stay in the main database,
+which every SQLite shard attaches so joins against ``users`` keep working.
+Post and comment ids are handed out from the main database so they stay
+unique across shards; a post lives on ``shard{post_id % len(shards)}``.
+
+While ``database.reshard`` moves posts to other shards, every process still
+routing to the old ones refuses to read or write posts, comments and scores
+(``Resharding``), until it is restarted with the new ``DB_SHARDS``. A reshard
+that failed before moving any post lifts the freeze again.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+
+from sqlalchemy import JSON, Column, Integer, MetaData, String, Table, column, event, func, insert, select, update
+from sqlalchemy import table as table_
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.ext.horizontal_shard import ShardedSession
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.sql import operators, visitors
+from sqlalchemy.sql.elements import BinaryExpression, BindParameter, ColumnClause
+from sqlalchemy.sql.dml import Insert
+
+ID_BLOCK_SIZE = int(os.getenv("DB_SHARD_ID_BLOCK_SIZE", 100))
+# How often a process looks for a running reshard; the reshard waits this long before moving anything.
+RESHARD_CHECK_SECONDS = float(os.getenv("DB_RESHARD_CHECK_SECONDS", 2))
+
+GLOBAL = "global"
+# Sharded tables and the column holding their post id.
+SHARD_KEYS = {"posts": "id", "comments": "post_id", "post_scores": "post_id"}
+# Sharded tables whose ids must be unique across shards.
+GLOBAL_IDS = ("posts", "comments")
+
+# The sequence table is created on demand, so it lives outside Base.metadata.
+id_metadata = MetaData()
+id_sequences = Table(
+    "id_sequences",
+    id_metadata,
+    Column("name", String(50), primary_key=True),
+    Column("next_id", Integer, nullable=False),
+)
+
+
+# Read here without importing jobs.models, which needs database.engine.
+reshard_jobs = table_(
+    "jobs",
+    column("id", Integer),
+    column("name", String),
+    column("status", String),
+    column("processed", Integer),
+    column("params", JSON),
+)
+
+
+class Resharding(RuntimeError):
+    pass
+
+
+def shard_name(post_id: int, count: int) -> str:
+    return f"shard{post_id % count}"
+
+
+def _table_name(col: ColumnClause):
+    return getattr(col.table, "name", None)
+
+
+def url_of(bind) -> str:
+    return bind.engine.url.render_as_string(hide_password=False)
+
+
+def touches_shards(statement) -> bool:
+    for node in visitors.iterate(statement):
+        if isinstance(node, Table) and node.name in SHARD_KEYS:
+            return True
+        if isinstance(node, ColumnClause) and _table_name(node) in SHARD_KEYS:
+            return True
+    return False
+
+
+_reshard_targets: dict[str, tuple[float, list[str] | None]] = {}
+
+
+def reshard_targets(global_db) -> list[str] | None:
+    """Shard URLs the latest reshard recorded in the main database (an engine or connection), if any."""
+    key = url_of(global_db)
+    now = time.monotonic()
+    checked = _reshard_targets.get(key)
+    if checked is not None and now - checked[0] < RESHARD_CHECK_SECONDS:
+        return checked[1]
+    query = (
+        select(reshard_jobs.c.params, reshard_jobs.c.status, reshard_jobs.c.processed)
+        .where(reshard_jobs.c.name.like("reshard:%"))
+        .order_by(reshard_jobs.c.id.desc())
+        .limit(1)
+    )
+    try:
+        if isinstance(global_db, Connection):
+            latest = global_db.execute(query).first()
+        else:
+            with global_db.connect() as conn:
+                latest = conn.execute(query).first()
+    except OperationalError:
+        latest = None  # no jobs table yet
+    targets = None
+    # A run that failed before moving any post left every post where it was.
+    if latest is not None and not (latest.status == "failed" and not latest.processed):
+        targets = (latest.params or {}).get("targets")
+    _reshard_targets[key] = (now, targets)
+    return targets
+
+
+def check_not_resharding(global_db, routed_engines):
+    targets = reshard_targets(global_db)
+    if targets is not None and targets != [url_of(engine) for engine in routed_engines]:
+        raise Resharding("Posts are being moved to other shards")
+
+
+def holds_table(role: str | None, table_name: str) -> bool:
+    """Whether a database Alembic migrates as ``role`` has the table: None when unsharded, else "global" or "shard"."""
+    return role is None or (table_name in SHARD_KEYS) == (role == "shard")
+
+
+def sharded_tables(metadata: MetaData) -> list[Table]:
+    return [metadata.tables[name] for name in SHARD_KEYS]
+
+
+def global_tables(metadata: MetaData) -> list[Table]:
+    return [table for name, table in metadata.tables.items() if name not in SHARD_KEYS]
+
+
+class IdAllocator:
+    """Hands out ids for one table from blocks reserved in the main database."""
+
+    def __init__(self, engine, name: str, seed, block_size: int = ID_BLOCK_SIZE):
+        self.engine = engine
+        self.name = name
+        self.seed = seed
+        self.block_size = block_size
+        self.next_id = self.end = 0
+        self._lock = threading.Lock()
+
+    def __call__(self) -> int:
+        with self._lock:
+            if self.next_id >= self.end:
+                self.next_id, self.end = self._reserve()
+            self.next_id += 1
+            return self.next_id - 1
+
+    def _reserve(self):
+        while True:
+            try:
+                with self.engine.begin() as conn:
+                    id_sequences.create(conn, checkfirst=True)
+                    end = conn.execute(
+                        update(id_sequences)
+                        .where(id_sequences.c.name == self.name)
+                        .values(next_id=id_sequences.c.next_id + self.block_size)
+                        .returning(id_sequences.c.next_id)
+                    ).scalar()
+                    if end is None:
+                        end = self.seed() + self.block_size
+                        conn.execute(insert(id_sequences).values(name=self.name, next_id=end))
+                return end - self.block_size, end
+            except IntegrityError:
+                continue  # Another worker created the sequence first.
+
+
+class RoutedSession(ShardedSession):
+    """Lets Core statements and ``session.connection()`` be routed like ORM ones."""
+
+    def get_bind(self, mapper=None, *, shard_id=None, instance=None, clause=None, **kw):
+        if shard_id is None and mapper is None and instance is None:
+            shard_id = self.shard_chooser(None, None, clause=clause)
+        return super().get_bind(mapper, shard_id=shard_id, instance=instance, clause=clause, **kw)
+
+
+class Shards:
+    def __init__(self, global_engine, shard_engines, id_block_size: int = ID_BLOCK_SIZE):
+        self.names = [f"shard{index}" for index in range(len(shard_engines))]
+        self.engines = {GLOBAL: global_engine, **dict(zip(self.names, shard_engines))}
+        self.ids = {
+            table: IdAllocator(global_engine, table, lambda table=table: self._max_id(table) + 1, id_block_size)
+            for table in GLOBAL_IDS
+        }
+        self.pool = ThreadPoolExecutor(max_workers=len(shard_engines), thread_name_prefix="shard")
+        self.sessionmaker = sessionmaker(
+            class_=RoutedSession,
+            autoflush=False,
+            shards=self.engines,
+            shard_chooser=self.choose_shard,
+            identity_chooser=self.choose_identity,
+            execute_chooser=self.choose_execute,
+            info={"shards": self},
+        )
+
+        database = global_engine.url.database
+        if global_engine.dialect.name == "sqlite" and database and database != ":memory:":
+            for shard_engine in shard_engines:
+                event.listen(shard_engine, "connect", self._attach(database))
+
+    @staticmethod
+    def _attach(database: str):
+        def attach(dbapi_connection, connection_record):
+            dbapi_connection.execute("ATTACH DATABASE ? AS global_db", (database,))
+
+        return attach
+
+    def _max_id(self, table: str) -> int:
+        highest = 0
+        for name in self.names:
+            with self.engines[name].connect() as conn:
+                found = conn.execute(select(func.max(column("id"))).select_from(table_(table))).scalar()
+                highest = max(highest, found or 0)
+        return highest
+
+    def for_post(self, post_id: int) -> str:
+        return shard_name(post_id, len(self.names))
+
+    def create_all(self, metadata: MetaData):
+        metadata.create_all(self.engines[GLOBAL], tables=global_tables(metadata))
+        for name in self.names:
+            metadata.create_all(self.engines[name], tables=sharded_tables(metadata))
+
+    def _shards_for(self, statement) -> list[str]:
+        """Shards a statement has to run on, judged by the post ids it pins down."""
+        sharded, post_ids = False, set()
+        if isinstance(statement, Insert):
+            table = statement.table
+            if table.name in SHARD_KEYS:
+                params = statement.compile().params
+                key = SHARD_KEYS[table.name]
+                if params.get(key) is None:
+                    return list(self.names)
+                return [self.for_post(params[key])]
+        for node in visitors.iterate(statement):
+            if isinstance(node, Table) and node.name in SHARD_KEYS:
+                sharded = True
+            elif isinstance(node, ColumnClause) and _table_name(node) in SHARD_KEYS:
+                sharded = True
+            elif isinstance(node, BinaryExpression) and node.operator in (operators.eq, operators.in_op):
+                key, value = node.left, node.right
+                if isinstance(key, BindParameter):
+                    key, value = value, key
+                if (
+                    isinstance(value, BindParameter)
+                    and isinstance(key, ColumnClause)
+                    and SHARD_KEYS.get(_table_name(key)) == key.name
+                ):
+                    sharded = True
+                    values = value.effective_value
+                    post_ids.update(values if node.operator is operators.in_op else [values])
+        if not sharded:
+            return [GLOBAL]
+        if not post_ids or None in post_ids:
+            return list(self.names)
+        return sorted({self.for_post(post_id) for post_id in post_ids})
+
+    def choose_shard(self, mapper, instance, clause=None):
+        if instance is None:
+            if clause is None:
+                return GLOBAL
+            shards = self._shards_for(clause)
+            if len(shards) > 1:
+                raise ValueError("Statement spans several shards; run it through the ORM or per shard")
+            return shards[0]
+
+        table = mapper.local_table.name
+        if table not in SHARD_KEYS:
+            return GLOBAL
+        if table in GLOBAL_IDS and instance.id is None:
+            instance.id = self.ids[table]()
+        post_id = getattr(instance, SHARD_KEYS[table])
+        if post_id is None and getattr(instance, "post", None) is not None:
+            post_id = instance.post.id
+        return self.for_post(post_id)
+
+    def choose_identity(self, mapper, primary_key, *, lazy_loaded_from, **kw):
+        table = mapper.local_table.name
+        if table not in SHARD_KEYS:
+            return [GLOBAL]
+        if lazy_loaded_from is not None and lazy_loaded_from.identity_token in self.names:
+            return [lazy_loaded_from.identity_token]
+        if SHARD_KEYS[table] in mapper.local_table.primary_key.columns:
+            return [self.for_post(primary_key[0])]
+        return list(self.names)
+
+    def choose_execute(self, orm_context):
+        # lazy_loaded_from only exists for SELECTs; ORM inserts, updates and deletes are routed by their criteria.
+        if orm_context.is_select:
+            state = orm_context.lazy_loaded_from
+            if state is not None and state.identity_token in self.names:
+                return [state.identity_token]
+        return self._shards_for(orm_context.statement)
+
+    def check_not_resharding(self):
+        check_not_resharding(self.engines[GLOBAL], [self.engines[name] for name in self.names])
+
+    def run(self, name: str, fn):
+        if name != GLOBAL:
+            self.check_not_resharding()
+        with Session(bind=self.engines[name], expire_on_commit=False, info={"shard": name}) as session:
+            result = fn(session)
+            session.commit()
+            return result
+
+
+def _check_session(session: Session):
+    if isinstance(session, ShardedSession):
+        session.info["shards"].check_not_resharding()
+    elif session.bind is not None and "shard" not in session.info:  # run() already checked
+        # On the session's own connection, so the check joins its transaction.
+        check_not_resharding(session.connection(), [session.bind])
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _refuse_statements_while_resharding(orm_context):
+    if touches_shards(orm_context.statement):
+        _check_session(orm_context.session)
+
+
+@event.listens_for(Session, "before_flush")
+def _refuse_flushes_while_resharding(session, flush_context, instances):
+    if any(
+        getattr(obj, "__tablename__", None) in SHARD_KEYS
+        for obj in chain(session.new, session.dirty, session.deleted)
+    ):
+        _check_session(session)
+
+
+def session_factory(db: Session):
+    """Make sessions on the same database(s) as ``db``, for work that outlives it."""
+    if isinstance(db, ShardedSession):
+        return db.info["shards"].sessionmaker
+    return sessionmaker(autoflush=False, bind=db.get_bind())
+
+
+def scatter(db: Session, fn) -> list:
+    """Run ``fn(session)`` on every shard in parallel; a plain session counts as one shard.
+
+    Each shard's work is committed when ``fn`` returns; with a plain session the caller commits.
+    """
+    if not isinstance(db, ShardedSession):
+        return [fn(db)]
+    shards = db.info["shards"]
+    return list(shards.pool.map(lambda name: shards.run(name, fn), shards.names))
+
+
+def on_global(db: Session, fn):
+    """Run ``fn(session)`` once on the main database, e.g. over the comment archive every shard attaches."""
+    if not isinstance(db, ShardedSession):
+        return fn(db)
+    return db.info["shards"].run(GLOBAL, fn)
+
+
+def gather(db: Session, fn, key=None) -> list:
+    """``scatter`` and concatenate the rows, sorted by ``key`` when they came from several shards."""
+    parts = scatter(db, fn)
+    if len(parts) == 1:
+        return parts[0]
+    rows = chain.from_iterable(parts)
+    return sorted(rows, key=key) if key else list(rows)
@@ -0,0 +1,387 @@
+from datetime import datetime, UTC
+from pathlib import Path
+from unittest.mock import Mock
+
+import pytest
+from alembic import command
+from alembic.autogenerate import compare_metadata
+from alembic.config import Config
+from alembic.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from sqlalchemy import create_engine, insert, inspect, select, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+import main  # noqa: F401  registers every model on Base.metadata
+from changes.models import Change
+from comments import archive
+from comments.backfill import backfill_scores
+from comments.crud import comments_analysis
+from comments.models import Comment
+from database.engine import Base
+from database.instrumentation import count_queries
+from database import online_migrations
+from database.reshard import reshard
+from database.sharding import IdAllocator, Resharding, Shards
+from jobs.models import Job
+from posts import crud as posts_crud
+from posts import purge, trending
+from posts.models import Post, PostScore
+from posts.schemas import PostCreate
+from users import services, stats
+from users.models import User
+
+
+def sqlite_engine(path):
+    return create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+
+
+@pytest.fixture
+def shards(tmp_path):
+    shards = Shards(sqlite_engine(tmp_path / "main.db"), [sqlite_engine(tmp_path / f"shard{i}.db") for i in range(2)])
+    shards.create_all(Base.metadata)
+    yield shards
+    shards.pool.shutdown()
+    for shard_engine in shards.engines.values():
+        shard_engine.dispose()
+
+
+@pytest.fixture
+def sharded_db(shards):
+    db = shards.sessionmaker()
+    user = User(username="author", email="author@example.com", password="x")
+    db.add(user)
+    db.commit()
+    for i in range(4):
+        post = posts_crud.create_post(
+            db, PostCreate(title=f"Post {i}", content="...", auto_replay_enabled=False, auto_replay_delay=0), user.id
+        )
+        for j in range(i + 1):
+            db.add(Comment(content=f"Comment {j}", post_id=post.id, user_id=user.id, created_at=datetime(2024, 3, j + 1)))
+    db.commit()
+    yield db
+    db.close()
+
+
+def count_rows(shard_engine, table):
+    with shard_engine.connect() as conn:
+        return conn.execute(text(f"SELECT count(*) FROM main.{table}")).scalar()
+
+
+def test_posts_and_comments_live_on_their_posts_shard(shards, sharded_db):
+    for name in shards.names:
+        with shards.engines[name].connect() as conn:
+            post_ids = conn.execute(select(Post.id)).scalars().all()
+            comment_posts = set(conn.execute(select(Comment.post_id)).scalars())
+        assert post_ids and all(shards.for_post(post_id) == name for post_id in post_ids)
+        assert comment_posts == set(post_ids)
+        assert "users" not in inspect(shards.engines[name]).get_table_names()
+
+    comment_ids = sharded_db.query(Comment.id).all()
+    assert len(comment_ids) == len(set(comment_ids)) == 10
+    assert count_rows(shards.engines["global"], "users") == 1
+
+
+def test_single_post_reads_touch_one_shard(shards, sharded_db):
+    post_id = sharded_db.query(Post.id).filter(Post.title == "Post 2").scalar()
+    other = shards.engines[shards.for_post(post_id + 1)]
+
+    with count_queries(other) as statements:
+        detail = posts_crud.get_post_detail(sharded_db, post_id, {"author", "comments"})
+    assert statements == []
+    assert detail["author"]["username"] == "author"
+    assert len(detail["comments"]) == 3
+
+
+def test_listing_and_analysis_gather_every_shard(sharded_db):
+    rows = posts_crud.get_all_post_rows(sharded_db)
+    assert [row.title for row in rows] == ["Post 0", "Post 1", "Post 2", "Post 3"]
+
+    days = comments_analysis(sharded_db, "2024-03-01", "2024-03-05")
+    assert [(day["day"], day["total_comments"]) for day in days] == [
+        ("2024-03-01", 4), ("2024-03-02", 3), ("2024-03-03", 2), ("2024-03-04", 1)
+    ]
+
+
+def test_writes_are_routed_through_the_sharded_session(shards, sharded_db):
+    post_id = sharded_db.query(Post.id).filter(Post.title == "Post 2").scalar()
+    home = shards.engines[shards.for_post(post_id)]
+
+    score, _ = trending.record_comment(sharded_db, post_id)
+    sharded_db.commit()
+    with home.connect() as conn:
+        assert conn.execute(select(PostScore.score).where(PostScore.post_id == post_id)).scalar() == score
+
+    comment_created = sharded_db.query(Comment.created_at).filter(Comment.post_id == post_id).first()[0]
+    trending.adjust_scores(sharded_db, [(post_id, comment_created)], -1)
+    sharded_db.commit()
+
+    user_id = sharded_db.query(User.id).scalar()
+    token = services.issue_refresh_token(sharded_db, user_id)
+    sharded_db.commit()
+    username, rotated = services.rotate_refresh_token(sharded_db, token)
+    assert username == "author" and rotated != token
+
+    post = sharded_db.get(Post, post_id)
+    sharded_db.expire(post, ["content"])
+    post.title = "Renamed"
+    sharded_db.commit()
+    change = sharded_db.query(Change).filter(Change.entity == "posts", Change.op == "update").one()
+    assert (change.payload["title"], change.payload["content"]) == ("Renamed", "...")
+
+    posts_crud.delete_post_from_db(sharded_db, post_id)
+    with home.connect() as conn:
+        assert conn.execute(select(Post.deleted_at).where(Post.id == post_id)).scalar() is not None
+        assert conn.execute(select(PostScore).where(PostScore.post_id == post_id)).first() is None
+
+    assert purge.purge_post(sharded_db, post_id, sleep=lambda seconds: None) == 3
+    with home.connect() as conn:
+        assert conn.execute(select(Comment.id).where(Comment.post_id == post_id)).first() is None
+        assert conn.execute(select(Post.id).where(Post.id == post_id)).first() is None
+
+
+def test_archive_is_counted_once_across_shards(shards, sharded_db):
+    post_id, user_id = sharded_db.query(Post.id, Post.user_id).filter(Post.title == "Post 0").one()
+    with Session(bind=shards.engines["global"]) as db:
+        table = archive._ensure_archive(db, "202402")
+        db.execute(insert(table).values(
+            id=1000, content="Archived", post_id=post_id, user_id=user_id, is_blocked=False, depth=0,
+            created_at=datetime(2024, 2, 10),
+        ))
+        db.commit()
+
+    days = comments_analysis(sharded_db, "2024-02-01", "2024-02-28")
+    assert [(day["day"], day["total_comments"]) for day in days] == [("2024-02-10", 1)]
+    assert stats.get_user_stats(sharded_db, [user_id])[0]["comments"] == 11
+
+
+def test_backfill_scores_every_shard(shards, sharded_db, monkeypatch):
+    provider = Mock(enabled=True, model="fake:v2", score=Mock(return_value=0.1))
+    monkeypatch.setattr("comments.crud.get_toxicity_provider", lambda: provider)
+    monkeypatch.setattr("comments.backfill.get_toxicity_provider", lambda: provider)
+
+    job = backfill_scores(sharded_db, qps=1000, chunk_size=3)
+
+    assert (job.status, job.processed) == ("done", 10)
+    for name in shards.names:
+        with shards.engines[name].connect() as conn:
+            assert set(conn.execute(select(Comment.toxicity_model)).scalars()) == {"fake:v2"}
+
+
+def test_archive_refuses_to_run_on_shards(sharded_db):
+    with pytest.raises(ValueError):
+        archive.archive_comments(sharded_db, before=datetime(2025, 1, 1, tzinfo=UTC))
+    assert len(sharded_db.query(Comment.id).all()) == 10
+
+
+def test_id_blocks_do_not_overlap(shards):
+    first = IdAllocator(shards.engines["global"], "widgets", seed=lambda: 1, block_size=2)
+    second = IdAllocator(shards.engines["global"], "widgets", seed=lambda: 1, block_size=2)
+    ids = [first(), second(), first(), first(), second()]
+    assert sorted(ids) == [1, 2, 3, 4, 5]
+
+
+def test_reshard_moves_posts_in_chunks(tmp_path, monkeypatch, shards, sharded_db):
+    monkeypatch.setattr("database.sharding.RESHARD_CHECK_SECONDS", 0)
+    sources = [shards.engines[name] for name in shards.names]
+    targets = [*sources, sqlite_engine(tmp_path / "shard2.db")]
+    sleeps = []
+
+    moved = reshard(sharded_db, sources, targets, chunk_size=2, sleep=sleeps.append)
+
+    assert moved == 3  # only post 1 is already where it belongs
+    assert len(sleeps) == 3  # one grace period, then a pause between chunks
+    for index, target in enumerate(targets):
+        with target.connect() as conn:
+            post_ids = conn.execute(select(Post.id)).scalars().all()
+            comment_posts = set(conn.execute(select(Comment.post_id)).scalars())
+        assert all(post_id % 3 == index for post_id in post_ids)
+        assert comment_posts == set(post_ids)
+    assert sum(count_rows(target, "comments") for target in targets) == 10
+    assert sharded_db.query(Job).one().status == "done"
+    assert reshard(sharded_db, sources, targets, sleep=sleeps.append) == 0
+
+    # Processes still routing by the old shards stay out until they are restarted on the new ones.
+    with pytest.raises(Resharding):
+        sharded_db.query(Post).all()
+    with pytest.raises(Resharding):
+        posts_crud.get_all_post_rows(sharded_db)
+    moved = Shards(shards.engines["global"], targets)
+    try:
+        with moved.sessionmaker() as db:
+            assert len(posts_crud.get_all_post_rows(db)) == 4
+    finally:
+        moved.pool.shutdown()
+
+
+def test_failed_reshard_lifts_the_freeze_until_posts_have_moved(tmp_path, monkeypatch, shards, sharded_db):
+    monkeypatch.setattr("database.sharding.RESHARD_CHECK_SECONDS", 0)
+    sources = [shards.engines[name] for name in shards.names]
+    targets = [*sources, sqlite_engine(tmp_path / "shard2.db")]
+    moves = []
+
+    def move(source, target, post_ids):
+        if len(moves) == 1:
+            raise OSError("disk full")
+        moves.append(post_ids)
+
+    with monkeypatch.context() as patched:
+        patched.setattr("database.reshard._move", Mock(side_effect=OSError("disk full")))
+        with pytest.raises(OSError):
+            reshard(sharded_db, sources, targets, sleep=lambda seconds: None)
+    assert len(posts_crud.get_all_post_rows(sharded_db)) == 4
+
+    with pytest.raises(ValueError):
+        reshard(sharded_db, sources, targets[:2] + [sqlite_engine(tmp_path / "other.db")], sleep=lambda seconds: None)
+
+    with monkeypatch.context() as patched:
+        patched.setattr("database.reshard._move", move)
+        with pytest.raises(OSError):
+            reshard(sharded_db, sources, targets, chunk_size=1, sleep=lambda seconds: None)
+    # One post has left its old shard, so the old routing stays refused.
+    with pytest.raises(Resharding):
+        posts_crud.get_all_post_rows(sharded_db)
+
+
+def alembic_config(url):
+    config = Config()
+    config.set_main_option("script_location", str(Path(__file__).parent.parent / "alembic"))
+    config.set_main_option("sqlalchemy.url", str(url))
+    return config
+
+
+@pytest.fixture
+def legacy_comments(tmp_path):
+    engine = sqlite_engine(tmp_path / "legacy.db")
+    # The schema as it was before comments.path became NOT NULL.
+    command.upgrade(alembic_config(engine.url), "3f2a9c1d7b10")
+    with engine.begin() as conn:
+        conn.execute(insert(User).values(id=1, username="author", email="author@example.com", password="x"))
+        conn.execute(insert(Post).values(id=1, title="Post", content="...", user_id=1, created_at=datetime(2024, 1, 1)))
+        # Written before threaded replies, so the path hook never ran.
+        conn.execute(insert(Comment), [
+            {
+                "id": i, "content": f"Comment {i}", "post_id": 1, "user_id": 1, "path": None,
+                "created_at": datetime(2024, 1, 2),
+            }
+            for i in range(1, 6)
+        ])
+        conn.execute(Comment.__table__.update().where(Comment.id == 4).values(parent_id=2, depth=1))
+    yield engine
+    engine.dispose()
+
+
+def test_online_migration_backfills_in_chunks_and_resumes(legacy_comments):
+    migration = online_migrations.MIGRATIONS["comment-thread-paths"]
+    failed = []
+
+    def flaky(session, start, end):
+        if start >= 2 and not failed:
+            failed.append(start)
+            raise RuntimeError("database is locked")
+        return online_migrations.fill_thread_paths(session, start, end)
+
+    with Session(bind=legacy_comments) as db:
+        with pytest.raises(RuntimeError):
+            online_migrations.run_migration(
+                db, online_migrations.OnlineMigration(migration.name, migration.table, migration.pending, flaky),
+                chunk_size=2, sleep=lambda seconds: None,
+            )
+        assert online_migrations.progress(db, migration) == {
+            "name": "comment-thread-paths", "status": "failed", "processed": 2, "total": 5
+        }
+        with legacy_comments.connect() as conn, pytest.raises(online_migrations.PendingMigration):
+            online_migrations.require(conn, "comment-thread-paths")
+
+        sleeps = []
+        job = online_migrations.run_migration(db, migration, chunk_size=2, sleep=sleeps.append)
+
+        assert (job.status, job.processed, job.total) == ("done", 5, 5)
+        assert len(sleeps) == 1
+        assert db.query(Job).count() == 1
+        assert db.execute(select(Comment.path).order_by(Comment.id)).scalars().all() == [
+            "0000000001/", "0000000002/", "0000000003/", "0000000002/0000000004/", "0000000005/"
+        ]
+    with legacy_comments.connect() as conn:
+        online_migrations.require(conn, "comment-thread-paths")
+
+
+def triggers(engine):
+    with engine.connect() as conn:
+        return set(conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'trigger'")).scalars())
+
+
+def test_migrations_build_the_models_schema(tmp_path):
+    engine = sqlite_engine(tmp_path / "fresh.db")
+    command.upgrade(alembic_config(engine.url), "head")
+    models = sqlite_engine(tmp_path / "models.db")
+    Base.metadata.create_all(models)
+
+    with engine.connect() as conn:
+        assert compare_metadata(MigrationContext.configure(conn), Base.metadata) == []
+    assert triggers(engine) == triggers(models) == {"comments_path_not_null_insert", "comments_path_not_null_update"}
+    engine.dispose()
+    models.dispose()
+
+
+def test_migrations_upgrade_the_baseline_step_by_step(tmp_path):
+    engine = sqlite_engine(tmp_path / "baseline.db")
+    config = alembic_config(engine.url)
+    command.upgrade(config, "1b7e0c5d3a90")
+    assert set(inspect(engine).get_table_names()) == {"alembic_version", "users", "posts", "comments"}
+
+    revisions = [script.revision for script in ScriptDirectory.from_config(config).walk_revisions()][::-1]
+    for revision in revisions[1:]:
+        command.upgrade(config, revision)
+    command.downgrade(config, "base")
+    assert set(inspect(engine).get_table_names()) == {"alembic_version"}
+    engine.dispose()
+
+
+def test_alembic_waits_for_online_migrations(tmp_path, legacy_comments):
+    config = alembic_config(legacy_comments.url)
+
+    with pytest.raises(online_migrations.PendingMigration):
+        command.upgrade(config, "head")
+    with Session(bind=legacy_comments) as db:
+        online_migrations.run_migration(db, online_migrations.MIGRATIONS["comment-thread-paths"])
+    command.upgrade(config, "head")
+
+    with legacy_comments.connect() as conn:
+        assert conn.execute(text("SELECT version_num FROM alembic_version")).scalar() == "8c4e1b5a92d7"
+        assert compare_metadata(MigrationContext.configure(conn), Base.metadata) == []
+    with legacy_comments.begin() as conn, pytest.raises(IntegrityError, match="comments.path"):
+        conn.execute(insert(Comment).values(content="New", post_id=1, user_id=1, path=None, created_at=datetime.now()))
+
+
+def test_alembic_migrates_and_checks_every_shard(tmp_path, monkeypatch):
+    main_db = sqlite_engine(tmp_path / "main.db")
+    shard_dbs = [sqlite_engine(tmp_path / f"shard{i}.db") for i in range(2)]
+    monkeypatch.setattr("database.engine.DB_SHARDS", [str(shard_db.url) for shard_db in shard_dbs])
+    config = alembic_config(main_db.url)
+
+    command.upgrade(config, "3f2a9c1d7b10")
+    assert {"users", "jobs"} <= set(inspect(main_db).get_table_names())
+    assert "comments" not in inspect(main_db).get_table_names()
+    for shard_db in shard_dbs:
+        assert set(inspect(shard_db).get_table_names()) == {"alembic_version", "posts", "comments", "post_scores"}
+        assert "moderated_at" in {column["name"] for column in inspect(shard_db).get_columns("comments")}
+    with shard_dbs[1].begin() as conn:
+        conn.execute(insert(Post).values(id=1, title="Post", content="...", user_id=1, created_at=datetime(2024, 1, 1)))
+        conn.execute(insert(Comment).values(
+            id=1, content="Legacy", post_id=1, user_id=1, path=None, created_at=datetime(2024, 1, 2)
+        ))
+
+    with pytest.raises(online_migrations.PendingMigration):
+        command.upgrade(config, "head")
+    shards = Shards(sqlite_engine(tmp_path / "main.db"), [sqlite_engine(tmp_path / f"shard{i}.db") for i in range(2)])
+    with shards.sessionmaker() as db:
+        online_migrations.run_migration(db, online_migrations.MIGRATIONS["comment-thread-paths"])
+    shards.pool.shutdown()
+    command.upgrade(config, "head")
+
+    for shard_db in shard_dbs:
+        with shard_db.begin() as conn, pytest.raises(IntegrityError, match="comments.path"):
+            conn.execute(insert(Comment).values(
+                id=2, content="New", post_id=1, user_id=1, path=None, created_at=datetime(2024, 1, 3)
+            ))
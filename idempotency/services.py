@@ -0,0 +1,146 @@
+import hashlib
+import os
+import random
+from datetime import datetime, timedelta, UTC
+
+import orjson
+from fastapi import Depends, Header, HTTPException, Request, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from database.engine import get_db
+from idempotency.models import IdempotencyKey
+from users import models, services
+
+IDEMPOTENCY_TTL_HOURS = int(os.getenv("IDEMPOTENCY_TTL_HOURS", 24))
+IDEMPOTENCY_LOCK_SECONDS = int(os.getenv("IDEMPOTENCY_LOCK_SECONDS", 60))
+
+
+class IdempotentReplay(Exception):
+    def __init__(self, status_code: int, body: str):
+        self.status_code = status_code
+        self.body = body
+
+
+async def replay_response(request: Request, exc: IdempotentReplay):
+    return Response(
+        exc.body,
+        status_code=exc.status_code,
+        media_type="application/json",
+        headers={"Idempotent-Replayed": "true"},
+    )
+
+
+class Idempotency:
+    def __init__(self, db: Session, record: IdempotencyKey | None = None):
+        self.db = db
+        self.record = record
+        self.saved = False
+
+    def save(self, response, status_code: int = status.HTTP_200_OK):
+        """Commit the request's flushed changes together with the response for replays.
+
+        Returns the response unchanged. Without a key this is a plain commit.
+        """
+        if self.record is not None:
+            self.record.status_code = status_code
+            self.record.response_body = orjson.dumps(jsonable_encoder(response)).decode()
+            self.saved = True
+        self.db.commit()
+        return response
+
+    def release(self):
+        if self.record is not None and not self.saved:
+            self.db.rollback()
+            self.db.query(IdempotencyKey).filter(IdempotencyKey.id == self.record.id).delete()
+            self.db.commit()
+
+
+def _now():
+    return datetime.now(UTC).replace(tzinfo=None)
+
+
+def purge_expired_keys(db: Session):
+    deleted = db.query(IdempotencyKey).filter(IdempotencyKey.expires_at <= _now()).delete()
+    db.commit()
+    return deleted
+
+
+def begin(db: Session, user_id: int, key: str, fingerprint: str):
+    now = _now()
+    in_progress = HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail="A request with this Idempotency-Key is already in progress",
+        headers={"Retry-After": "1"},
+    )
+
+    record = db.query(IdempotencyKey).filter(
+        IdempotencyKey.user_id == user_id, IdempotencyKey.key == key
+    ).first()
+    if record is not None and record.expires_at <= now:
+        db.delete(record)
+        db.commit()
+        record = None
+
+    if record is None:
+        if random.random() < 0.01:
+            purge_expired_keys(db)
+        record = IdempotencyKey(
+            user_id=user_id,
+            key=key,
+            fingerprint=fingerprint,
+            locked_until=now + timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS),
+            expires_at=now + timedelta(hours=IDEMPOTENCY_TTL_HOURS),
+        )
+        db.add(record)
+        try:
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            raise in_progress
+        return Idempotency(db, record)
+
+    if record.fingerprint != fingerprint:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="Idempotency-Key was already used for a different request",
+        )
+    if record.status_code is not None:
+        raise IdempotentReplay(record.status_code, record.response_body)
+    if record.locked_until > now:
+        raise in_progress
+
+    # The previous attempt died before saving a response; take it over.
+    taken = db.query(IdempotencyKey).filter(
+        IdempotencyKey.id == record.id, IdempotencyKey.locked_until == record.locked_until
+    ).update({"locked_until": now + timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS)})
+    db.commit()
+    if not taken:
+        raise in_progress
+    return Idempotency(db, record)
+
+
+async def idempotency(
+        request: Request,
+        idempotency_key: str | None = Header(None, max_length=255),
+        user: models.User = Depends(services.get_current_user),
+        db: Session = Depends(get_db)
+):
+    if idempotency_key is None:
+        yield Idempotency(db)
+        return
+
+    body = await request.body()
+    fingerprint = hashlib.sha256(
+        request.method.encode() + b" " + request.url.path.encode() + b"\n" + body
+    ).hexdigest()
+    guard = await run_in_threadpool(begin, db, user.id, idempotency_key, fingerprint)
+    try:
+        yield guard
+    except Exception:
+        # Failed requests may be retried with the same key.
+        await run_in_threadpool(guard.release)
+        raise
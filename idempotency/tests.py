@@ -0,0 +1,160 @@
+from datetime import datetime, timedelta, UTC
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from comments.models import Comment
+from core import ratelimit
+from core.ratelimit import MemoryBackend
+from database.engine import Base, get_db
+from idempotency.models import IdempotencyKey
+from main import app
+from posts.models import Post
+from users.models import User
+from users.services import create_access_token
+
+# Setup test database
+SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL,
+    connect_args={"check_same_thread": False},
+    poolclass=StaticPool,
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+Base.metadata.create_all(bind=engine)
+
+
+def override_get_db():
+    db = TestingSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+client = TestClient(app)
+
+POST = {"title": "Title", "content": "Content", "auto_replay_enabled": False, "auto_replay_delay": 0}
+
+
+@pytest.fixture(autouse=True)
+def db_session():
+    app.dependency_overrides[get_db] = override_get_db
+    ratelimit.set_backend(MemoryBackend())
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    session = TestingSessionLocal()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def headers(db_session):
+    user = User(username="testuser", email="test@example.com", password="testpassword")
+    db_session.add(user)
+    db_session.commit()
+    token = create_access_token({"sub": "testuser"})
+    return {"Authorization": f"Bearer {token}"}
+
+
+def test_retry_replays_stored_response(db_session, headers):
+    headers = {**headers, "Idempotency-Key": "abc"}
+    first = client.post("/posts/", json=POST, headers=headers)
+    second = client.post("/posts/", json=POST, headers=headers)
+
+    assert first.status_code == second.status_code == 200
+    assert second.json() == first.json()
+    assert second.headers["Idempotent-Replayed"] == "true"
+    assert db_session.query(Post).count() == 1
+
+
+def test_requests_without_key_are_not_deduplicated(db_session, headers):
+    client.post("/posts/", json=POST, headers=headers)
+    client.post("/posts/", json=POST, headers=headers)
+    assert db_session.query(Post).count() == 2
+
+
+def test_key_reused_with_different_body_is_rejected(headers):
+    headers = {**headers, "Idempotency-Key": "abc"}
+    client.post("/posts/", json=POST, headers=headers)
+    response = client.post("/posts/", json={**POST, "title": "Other"}, headers=headers)
+    assert response.status_code == 422
+
+
+def test_in_progress_key_is_rejected(db_session, headers):
+    headers = {**headers, "Idempotency-Key": "abc"}
+    client.post("/posts/", json=POST, headers=headers)
+    db_session.query(IdempotencyKey).update({
+        "status_code": None,
+        "locked_until": datetime.now(UTC).replace(tzinfo=None) + timedelta(minutes=1),
+    })
+    db_session.commit()
+
+    response = client.post("/posts/", json=POST, headers=headers)
+    assert response.status_code == 409
+    assert db_session.query(Post).count() == 1
+
+
+def test_stale_lock_is_taken_over(db_session, headers):
+    headers = {**headers, "Idempotency-Key": "abc"}
+    client.post("/posts/", json=POST, headers=headers)
+    db_session.query(IdempotencyKey).update({"status_code": None, "locked_until": datetime(2000, 1, 1)})
+    db_session.commit()
+
+    response = client.post("/posts/", json=POST, headers=headers)
+    assert response.status_code == 200
+    assert "Idempotent-Replayed" not in response.headers
+
+
+def test_failed_request_releases_key(db_session, monkeypatch, headers):
+    monkeypatch.setattr("comments.routers.score_toxicity", lambda content: {"is_blocked": False})
+    headers = {**headers, "Idempotency-Key": "abc"}
+
+    response = client.post("/posts/1/comments", json={"content": "Hi"}, headers=headers)
+    assert response.status_code == 404
+    assert db_session.query(IdempotencyKey).count() == 0
+
+    client.post("/posts/", json=POST, headers={"Authorization": headers["Authorization"]})
+    first = client.post("/posts/1/comments", json={"content": "Hi"}, headers=headers)
+    second = client.post("/posts/1/comments", json={"content": "Hi"}, headers=headers)
+    assert first.status_code == 200
+    assert second.json() == first.json()
+    assert db_session.query(Comment).count() == 1
+
+
+def test_post_and_stored_response_commit_together(db_session, monkeypatch, headers):
+    def unserializable(response):
+        raise TypeError("cannot encode")
+
+    monkeypatch.setattr("idempotency.services.jsonable_encoder", unserializable)
+    with pytest.raises(TypeError):
+        client.post("/posts/", json=POST, headers={**headers, "Idempotency-Key": "abc"})
+
+    assert db_session.query(Post).count() == 0
+    assert db_session.query(IdempotencyKey).count() == 0
+
+
+def test_created_rows_are_returned_as_they_are_read_back(db_session, monkeypatch, headers):
+    monkeypatch.setattr("comments.routers.score_toxicity", lambda content: {"is_blocked": False})
+    post = client.post("/posts/", json=POST, headers={**headers, "Idempotency-Key": "post"}).json()
+    comment = client.post(
+        f"/posts/{post['id']}/comments", json={"content": "Hi"}, headers={**headers, "Idempotency-Key": "comment"}
+    ).json()
+
+    assert client.get(f"/posts/{post['id']}").json() == post
+    assert client.get(f"/comments/{post['id']}").json() == [comment]
+    assert not comment["created_at"].endswith("Z")
+
+
+def test_expired_key_is_executed_again(db_session, headers):
+    headers = {**headers, "Idempotency-Key": "abc"}
+    client.post("/posts/", json=POST, headers=headers)
+    db_session.query(IdempotencyKey).update({"expires_at": datetime(2000, 1, 1)})
+    db_session.commit()
+
+    client.post("/posts/", json=POST, headers=headers)
+    assert db_session.query(Post).count() == 2
@@ -0,0 +1,44 @@
+from sqlalchemy.orm import Session
+
+from jobs.models import Job
+
+
+def start_job(db: Session, name: str, resume: bool = True):
+    """Resume the latest unfinished job with this name, or start a new one."""
+    job = None
+    if resume:
+        job = (
+            db.query(Job)
+            .filter(Job.name == name, Job.status != "done")
+            .order_by(Job.id.desc())
+            .first()
+        )
+    if job is None:
+        job = Job(name=name)
+        db.add(job)
+    job.status = "running"
+    job.error = None
+    db.commit()
+    return job
+
+
+def checkpoint(job: Job, cursor: int, processed: int):
+    """Advance the job; commit it together with the chunk it covers."""
+    job.cursor = cursor
+    job.processed += processed
+
+
+def finish_job(db: Session, job: Job):
+    job.status = "done"
+    db.commit()
+
+
+def fail_job(db: Session, job: Job, error: Exception):
+    db.rollback()
+    job.status = "failed"
+    job.error = str(error)[:500]
+    db.commit()
+
+
+def get_job(db: Session, job_id: int):
+    return db.query(Job).filter(Job.id == job_id).first()
@@ -0,0 +1,25 @@
+import datetime
+
+from sqlalchemy import Column, Integer, JSON, String, DateTime
+
+from database.engine import Base
+
+
+def utcnow():
+    return datetime.datetime.now(datetime.UTC)
+
+
+class Job(Base):
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String(100), nullable=False, index=True)
+    status = Column(String(20), default="running", nullable=False)
+    cursor = Column(Integer, default=0, nullable=False)
+    processed = Column(Integer, default=0, nullable=False)
+    # Known up front for jobs that can report progress.
+    total = Column(Integer, nullable=True)
+    params = Column(JSON, nullable=True)
+    error = Column(String(500), nullable=True)
+    created_at = Column(DateTime, default=utcnow, nullable=False)
+    updated_at = Column(DateTime, default=utcnow, onupdate=utcnow, nullable=False)
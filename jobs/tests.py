@@ -0,0 +1,49 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from database.engine import Base
+from jobs import crud
+
+engine = create_engine(
+    "sqlite:///:memory:",
+    connect_args={"check_same_thread": False},
+    poolclass=StaticPool,
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+@pytest.fixture
+def db_session():
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    session = TestingSessionLocal()
+    yield session
+    session.close()
+
+
+def test_failed_job_is_resumed_from_checkpoint(db_session):
+    job = crud.start_job(db_session, "backfill")
+    crud.checkpoint(job, cursor=10, processed=10)
+    db_session.commit()
+    crud.fail_job(db_session, job, RuntimeError("boom"))
+
+    resumed = crud.start_job(db_session, "backfill")
+    assert resumed.id == job.id
+    assert (resumed.status, resumed.cursor, resumed.processed, resumed.error) == ("running", 10, 10, None)
+
+
+def test_finished_job_is_not_resumed(db_session):
+    job = crud.start_job(db_session, "backfill")
+    crud.finish_job(db_session, job)
+
+    assert crud.start_job(db_session, "backfill").id != job.id
+
+
+def test_uncommitted_checkpoint_is_lost_on_failure(db_session):
+    job = crud.start_job(db_session, "backfill")
+    crud.checkpoint(job, cursor=10, processed=10)
+    crud.fail_job(db_session, job, RuntimeError("boom"))
+
+    assert (job.cursor, job.processed, job.status) == (0, 0, "failed")
@@ -1,10 +1,57 @@
-from fastapi import FastAPI
+import threading
+from contextlib import asynccontextmanager
 
+from fastapi import FastAPI, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse
+
+from changes.routers import changes_router
 from comments.routers import comments_router
+from core import cache
+from core.metrics import MetricsMiddleware, metrics_endpoint
+from core.profiling import ProfilingMiddleware, track_handler_threads
+from core.singleflight import SingleFlightTimeout
+from database.sharding import Resharding
+from idempotency.services import IdempotentReplay, replay_response
+from posts import purge
 from posts.routers import posts_router
+from users import availability
 from users.routers import users_router
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await run_in_threadpool(availability.warm_up)
+    await run_in_threadpool(cache.start_listener)
+    threading.Thread(target=purge.sweep, name="post-purge", daemon=True).start()
+    yield
+    cache.backend.close()
+
+
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
+app.add_middleware(ProfilingMiddleware)
+app.add_middleware(MetricsMiddleware)
+
+
+@app.exception_handler(SingleFlightTimeout)
+async def single_flight_timeout_handler(request: Request, exc: SingleFlightTimeout):
+    return ORJSONResponse(
+        status_code=503,
+        content={"detail": "Service temporarily unavailable"},
+        headers={"Retry-After": "1"},
+    )
+
+
+@app.exception_handler(Resharding)
+async def resharding_handler(request: Request, exc: Resharding):
+    return ORJSONResponse(
+        status_code=503,
+        content={"detail": "Posts are being moved between databases; try again later"},
+        headers={"Retry-After": "60"},
+    )
+
+
+app.add_exception_handler(IdempotentReplay, replay_response)
 
 
 @app.get("/")
@@ -15,3 +62,6 @@ async def root():
 app.include_router(posts_router)
 app.include_router(users_router)
 app.include_router(comments_router)
+app.include_router(changes_router)
+app.add_route("/metrics", metrics_endpoint, include_in_schema=False)
+track_handler_threads(app)
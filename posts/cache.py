@@ -0,0 +1,125 @@
+import os
+import threading
+from collections import OrderedDict
+
+from core import cache
+
+POST_CACHE_ENABLED = os.getenv("POST_CACHE_ENABLED", "false").lower() == "true"
+POST_CACHE_MAX_BYTES = int(os.getenv("POST_CACHE_MAX_BYTES", 16 * 2 ** 20))
+
+# Rough per-record overhead of the object, its slots and the dict entry.
+RECORD_OVERHEAD = 200
+
+
+class PostSummary:
+    __slots__ = (
+        "id", "title", "content", "user_id", "auto_replay_enabled", "auto_replay_delay", "created_at", "size"
+    )
+
+    def __init__(self, id, title, content, user_id, auto_replay_enabled, auto_replay_delay, created_at):
+        self.id = id
+        self.title = title
+        self.content = content
+        self.user_id = user_id
+        self.auto_replay_enabled = auto_replay_enabled
+        self.auto_replay_delay = auto_replay_delay
+        self.created_at = created_at
+        self.size = RECORD_OVERHEAD + len(title or "") + len(content or "")
+
+    def as_row(self):
+        return (
+            self.id, self.title, self.content, self.user_id,
+            self.auto_replay_enabled, self.auto_replay_delay, self.created_at,
+        )
+
+
+class PostCache:
+    """LRU of post summaries, capped by an estimate of their size in bytes.
+
+    Readers take ``generation`` before querying and pass it back when filling;
+    a fill is dropped if any write happened in between, so stale rows never
+    overwrite fresher ones. ``complete`` means every post is cached and
+    listings can be served without the database.
+    """
+
+    def __init__(self, max_bytes: int, enabled: bool = True):
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.generation = 0
+        self.complete = False
+        self._entries: OrderedDict[int, PostSummary] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, post_id: int):
+        with self._lock:
+            summary = self._entries.get(post_id)
+            if summary is not None:
+                self._entries.move_to_end(post_id)
+            return summary
+
+    def listing(self):
+        with self._lock:
+            if not self.complete:
+                return None
+            return [self._entries[post_id].as_row() for post_id in sorted(self._entries)]
+
+    def _store(self, summary: PostSummary):
+        previous = self._entries.pop(summary.id, None)
+        if previous is not None:
+            self._bytes -= previous.size
+        self._entries[summary.id] = summary
+        self._bytes += summary.size
+        while self._bytes > self.max_bytes and self._entries:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.size
+            self.complete = False
+
+    def fill(self, row, generation: int):
+        with self._lock:
+            if generation == self.generation:
+                self._store(PostSummary(*row))
+
+    def fill_all(self, rows, generation: int):
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries.clear()
+            self._bytes = 0
+            self.complete = True
+            for row in rows:
+                self._store(PostSummary(*row))
+
+    def added(self, row):
+        with self._lock:
+            self.generation += 1
+            self._store(PostSummary(*row))
+
+    def invalidate(self, post_id: int):
+        with self._lock:
+            self.generation += 1
+            summary = self._entries.pop(post_id, None)
+            if summary is not None:
+                self._bytes -= summary.size
+            self.complete = False
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._bytes = 0
+            self.complete = False
+
+
+post_cache = PostCache(POST_CACHE_MAX_BYTES, enabled=POST_CACHE_ENABLED)
+
+
+def _invalidated_elsewhere(key, fields):
+    if post_cache.enabled:
+        post_cache.invalidate(int(key))
+
+
+cache.on_invalidate("post", _invalidated_elsewhere)
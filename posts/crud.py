@@ -1,22 +1,122 @@
-from datetime import datetime
+from datetime import datetime, UTC
 
-from sqlalchemy.orm import Session
+from sqlalchemy import select, union_all, update
+from sqlalchemy.orm import Session, joinedload, with_parent
 
+from changes.crud import record_change
+from comments import archive
+from comments.crud import COMMENT_COLUMNS, COMMENT_FIELDS, blocked, cancel_pending_replies, comment_columns
+from comments.models import Comment
+from core import cache
+from core.singleflight import single_flight
+from database.sharding import gather
 from posts import models, schemas
+from posts.cache import post_cache
+from posts.trending import forget_post
+from users import stats
+
+POST_COLUMNS = (
+    models.Post.id,
+    models.Post.title,
+    models.Post.content,
+    models.Post.user_id,
+    models.Post.auto_replay_enabled,
+    models.Post.auto_replay_delay,
+    models.Post.created_at,
+)
+POST_FIELDS = tuple(column.key for column in POST_COLUMNS)
+POST_INCLUDES = {"author", "comments"}
+visible = models.Post.deleted_at.is_(None)
 
 
 def get_all_posts(db: Session):
-    posts = db.query(models.Post).all()
+    posts = db.query(models.Post).filter(visible).all()
     if posts:
         return posts
     return []
 
 
+def get_all_post_rows(db: Session):
+    def load():
+        return gather(db, lambda session: session.query(*POST_COLUMNS).filter(visible).all(), key=lambda row: row.id)
+
+    if not post_cache.enabled:
+        return single_flight.do(("posts",), load)
+
+    rows = post_cache.listing()
+    if rows is None:
+        generation = post_cache.generation
+        rows = single_flight.do(("posts",), load)
+        post_cache.fill_all(rows, generation)
+    return rows
+
+
 def get_post_by_id(db: Session, id: int):
-    return db.query(models.Post).filter(models.Post.id == id).first()
+    return db.query(models.Post).filter(models.Post.id == id, visible).first()
 
 
-def create_post(db: Session, post: schemas.PostCreate, user_id: int):
+def get_post_row(db: Session, id: int):
+    def load():
+        return db.query(*POST_COLUMNS).filter(models.Post.id == id, visible).first()
+
+    if not post_cache.enabled:
+        return single_flight.do(("post", id), load)
+
+    summary = post_cache.get(id)
+    if summary is not None:
+        return summary.as_row()
+
+    generation = post_cache.generation
+    row = single_flight.do(("post", id), load)
+    if row is not None:
+        post_cache.fill(row, generation)
+    return row
+
+
+def get_post_detail(db: Session, id: int, include: set[str], comments_limit: int = 20):
+    """The post plus the requested embeds, in a fixed number of queries whatever the comment count.
+
+    That is two queries, plus the archive lookup when the live comments do not fill the page.
+    Filling the rest of the page from the archive takes one more query.
+    """
+    query = db.query(models.Post).filter(models.Post.id == id, visible)
+    if "author" in include:
+        query = query.options(joinedload(models.Post.user))
+    post = query.first()
+    if post is None:
+        return None
+
+    detail = dict(zip(POST_FIELDS, as_row(post)))
+    if "author" in include:
+        detail["author"] = {"id": post.user.id, "username": post.user.username} if post.user else None
+    if "comments" in include:
+        # Newest first; archived comments are older than every live one, so they only fill the rest of the page.
+        rows = (
+            db.query(*COMMENT_COLUMNS)
+            .filter(with_parent(post, models.Post.comments), blocked == False)
+            .order_by(Comment.id.desc())
+            .limit(comments_limit)
+            .all()
+        )
+        tables = archive.tables_for_post(db, post.id) if len(rows) < comments_limit else []
+        if tables:
+            archived = union_all(*(select(*comment_columns(t.c)).where(t.c.post_id == post.id) for t in tables)).subquery()
+            rows += db.execute(
+                select(archived)
+                .where(archived.c.is_blocked == False)
+                .order_by(archived.c.id.desc())
+                .limit(comments_limit - len(rows))
+            ).all()
+        detail["comments"] = [dict(zip(COMMENT_FIELDS, row)) for row in rows]
+    return detail
+
+
+def as_row(post: models.Post):
+    return tuple(getattr(post, field) for field in POST_FIELDS)
+
+
+def add_post(db: Session, post: schemas.PostCreate, user_id: int):
+    """Flush a new post without committing; call ``post_added`` once it is committed."""
     db_post = models.Post(
         title=post.title,
         content=post.content,
@@ -26,8 +126,23 @@ def create_post(db: Session, post: schemas.PostCreate, user_id: int):
         created_at=datetime.now()
     )
     db.add(db_post)
+    db.flush()
+    # Read back as stored, so the response matches what GET returns.
+    db.refresh(db_post)
+    return db_post
+
+
+def post_added(db_post: models.Post):
+    if post_cache.enabled:
+        post_cache.added(as_row(db_post))
+    cache.broadcast("post", db_post.id)
+
+
+def create_post(db: Session, post: schemas.PostCreate, user_id: int):
+    db_post = add_post(db, post, user_id)
     db.commit()
     db.refresh(db_post)
+    post_added(db_post)
     return db_post
 
 
@@ -39,10 +154,27 @@ def update_post_in_db(db: Session, post_data, post):
 
     db.commit()
     db.refresh(post)
+    if post_cache.enabled:
+        post_cache.invalidate(post.id)
+    cache.broadcast("post", post.id)
 
     return post
 
 
 def delete_post_from_db(db: Session, post_id: int):
-    db.delete(get_post_by_id(db, post_id))
+    """Hide the post at once; ``posts.purge`` removes it and its comments later, in small chunks."""
+    author_id = db.execute(
+        update(models.Post)
+        .where(models.Post.id == post_id, visible)
+        .values(deleted_at=datetime.now(UTC))
+        .returning(models.Post.user_id),
+        execution_options={"synchronize_session": False},
+    ).scalar()
+    stats.mark_changed(db, author_id)
+    record_change(db, "posts", post_id, "delete")
+    forget_post(db, post_id)
     db.commit()
+    cancel_pending_replies(post_id)
+    if post_cache.enabled:
+        post_cache.invalidate(post_id)
+    cache.broadcast("post", post_id)
@@ -5,7 +5,7 @@ from sqlalchemy import (
     Integer,
     String,
     ForeignKey,
-    Boolean, DateTime
+    Boolean, DateTime, Float
 )
 from sqlalchemy.orm import relationship
 
@@ -23,6 +23,22 @@ class Post(Base):
     auto_replay_enabled = Column(Boolean, default=False)
     auto_replay_delay = Column(Integer, default=0)
     created_at = Column(DateTime, default=lambda: datetime.datetime.now(datetime.UTC), nullable=False)
+    # Set on delete; the post and its comments are purged in the background.
+    deleted_at = Column(DateTime, nullable=True, index=True)
     comments = relationship("Comment", back_populates="post")
 
     user = relationship("User", back_populates="posts")
+
+
+class PostScore(Base):
+    __tablename__ = "post_scores"
+
+    post_id = Column(Integer, ForeignKey("posts.id"), primary_key=True)
+    score = Column(Float, nullable=False, default=0.0, index=True)
+
+
+class TrendingEpoch(Base):
+    __tablename__ = "trending_epoch"
+
+    id = Column(Integer, primary_key=True)
+    epoch = Column(Float, nullable=False)
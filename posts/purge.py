@@ -0,0 +1,118 @@
+"""Remove deleted posts and their comments, in the background.
+
+    python -m posts.purge
+
+Deleting a post only marks it deleted. Its comments, live and archived,
+are then deleted in small id-ordered chunks, each in its own short
+transaction with a pause in between, so other writers get the database
+lock back. The post row goes last, so an interrupted purge is picked up
+again by the next run.
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.orm import Session
+
+from changes.crud import change_row
+from changes.models import Change
+from comments import archive
+from comments.models import Comment, CommentArchive
+from database.engine import SessionLocal
+from posts.models import Post
+from users import stats
+
+logger = logging.getLogger(__name__)
+
+POST_PURGE_CHUNK_SIZE = int(os.getenv("POST_PURGE_CHUNK_SIZE", 500))
+POST_PURGE_PAUSE_MS = int(os.getenv("POST_PURGE_PAUSE_MS", 50))
+
+
+def _purge_table(db: Session, table, post_id: int, chunk_size: int, pause_ms: int, sleep) -> int:
+    removed = 0
+    while True:
+        rows = db.execute(
+            select(table.c.id, table.c.user_id).where(table.c.post_id == post_id).order_by(table.c.id).limit(chunk_size)
+        ).all()
+        if not rows:
+            return removed
+
+        ids = [row.id for row in rows]
+        db.execute(delete(table).where(table.c.post_id == post_id, table.c.id.in_(ids)))
+        if table is Comment.__table__:
+            db.execute(insert(Change.__table__), [change_row("comments", comment_id, "delete") for comment_id in ids])
+        else:
+            db.execute(
+                update(CommentArchive)
+                .where(CommentArchive.table_name == table.name)
+                .values(row_count=CommentArchive.row_count - len(ids))
+            )
+        for user_id in {row.user_id for row in rows}:
+            stats.mark_changed(db, user_id)
+        db.commit()
+
+        removed += len(ids)
+        if len(ids) < chunk_size:
+            return removed
+        sleep(pause_ms / 1000)
+
+
+def purge_post(
+        db: Session,
+        post_id: int,
+        chunk_size: int = POST_PURGE_CHUNK_SIZE,
+        pause_ms: int = POST_PURGE_PAUSE_MS,
+        sleep=time.sleep,
+) -> int:
+    """Delete a deleted post's comments and then the post; returns how many comments went."""
+    post = db.query(Post.deleted_at).filter(Post.id == post_id).first()
+    if post is None or post.deleted_at is None:
+        return 0
+
+    removed = 0
+    # Archive lookups need the post row, so the live table is emptied before the post goes.
+    for table in (*archive.tables_for_post(db, post_id), Comment.__table__):
+        removed += _purge_table(db, table, post_id, chunk_size, pause_ms, sleep)
+    db.execute(delete(Post).where(Post.id == post_id, Post.deleted_at.isnot(None)))
+    db.commit()
+    return removed
+
+
+def purge_in_background(make_session, post_id: int):
+    try:
+        with make_session() as db:
+            purge_post(db, post_id)
+    except Exception:
+        logger.exception("Purging post %s failed; the next sweep will retry", post_id)
+
+
+def purge_deleted_posts(db: Session, **options) -> int:
+    """Finish every purge that was interrupted, e.g. by a restart."""
+    post_ids = db.scalars(select(Post.id).where(Post.deleted_at.isnot(None)).order_by(Post.id)).all()
+    return sum(purge_post(db, post_id, **options) for post_id in post_ids)
+
+
+def sweep():
+    try:
+        with SessionLocal() as db:
+            purge_deleted_posts(db)
+    except Exception:
+        logger.exception("Could not purge deleted posts")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunk-size", type=int, default=POST_PURGE_CHUNK_SIZE)
+    parser.add_argument("--pause-ms", type=int, default=POST_PURGE_PAUSE_MS)
+    args = parser.parse_args(argv)
+
+    with SessionLocal() as db:
+        removed = purge_deleted_posts(db, chunk_size=args.chunk_size, pause_ms=args.pause_ms)
+    print(f"Removed {removed} comments of deleted posts")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
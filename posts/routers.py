@@ -1,10 +1,14 @@
 from typing import List
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
 
+from core.ratelimit import rate_limit
+from core.responses import row_response, rows_response
 from database.engine import get_db
-from posts import schemas, crud
+from database.sharding import session_factory
+from idempotency.services import Idempotency, idempotency
+from posts import schemas, crud, purge, trending
 from posts.crud import delete_post_from_db, update_post_in_db
 from posts.schemas import Post
 from users import services, models
@@ -14,23 +18,50 @@ posts_router = APIRouter()
 
 @posts_router.get("/posts/", response_model=List[schemas.Post])
 def get_posts(db: Session = Depends(get_db)):
-    return crud.get_all_posts(db)
+    return rows_response(crud.POST_FIELDS, crud.get_all_post_rows(db))
 
 
-@posts_router.get("/posts/{post_id}", response_model=schemas.Post)
-def get_post(post_id: int, db: Session = Depends(get_db)):
-    db_post = crud.get_post_by_id(db, post_id)
-    if db_post is None:
+@posts_router.get("/posts/trending", response_model=List[schemas.TrendingPost])
+def get_trending_posts(limit: int = Query(20, ge=1, le=trending.TRENDING_SIZE), db: Session = Depends(get_db)):
+    return trending.get_trending(db, limit)
+
+
+@posts_router.get("/posts/{post_id}", response_model=schemas.PostDetail, response_model_exclude_unset=True)
+def get_post(
+        post_id: int,
+        include: str | None = Query(None, description="Comma separated: author, comments"),
+        comments_limit: int = Query(20, ge=1, le=100),
+        db: Session = Depends(get_db)
+):
+    if include:
+        embeds = {name.strip() for name in include.split(",")}
+        if not embeds <= crud.POST_INCLUDES:
+            raise HTTPException(status_code=422, detail=f"include must be a subset of {sorted(crud.POST_INCLUDES)}")
+        detail = crud.get_post_detail(db, post_id, embeds, comments_limit)
+        if detail is None:
+            raise HTTPException(status_code=404, detail="Post not found")
+        return detail
+
+    row = crud.get_post_row(db, post_id)
+    if row is None:
         raise HTTPException(status_code=404, detail="Post not found")
-    return db_post
+    return row_response(crud.POST_FIELDS, row)
 
 
-@posts_router.post("/posts/", response_model=schemas.Post)
+@posts_router.post(
+    "/posts/",
+    response_model=schemas.Post,
+    dependencies=[Depends(rate_limit("create_post", "30/60", per="user"))]
+)
 def create_post(
         post: schemas.PostCreate,
         user: models.User = Depends(services.get_current_user),
-        db: Session = Depends(get_db)):
-    return crud.create_post(db=db, post=post, user_id=user.id)
+        db: Session = Depends(get_db),
+        idempotency: Idempotency = Depends(idempotency)):
+    db_post = crud.add_post(db=db, post=post, user_id=user.id)
+    response = idempotency.save(schemas.Post.model_validate(db_post))
+    crud.post_added(db_post)
+    return response
 
 
 @posts_router.put("/posts/{post_id}", response_model=schemas.Post)
@@ -51,6 +82,7 @@ def update_post(
 @posts_router.delete("/posts/{post_id}", response_model=schemas.Post)
 def delete_post(
         post_id: int,
+        background_tasks: BackgroundTasks,
         user: models.User = Depends(services.get_current_user),
         db: Session = Depends(get_db)
 ):
@@ -60,3 +92,4 @@ def delete_post(
     if post.user_id != user.id:
         raise HTTPException(status_code=403, detail="You do not have permission to delete this post")
     delete_post_from_db(db=db, post_id=post_id)
+    background_tasks.add_task(purge.purge_in_background, session_factory(db), post_id)
@@ -2,6 +2,8 @@ from datetime import datetime
 
 from pydantic import BaseModel
 
+from comments.schemas import Comment
+
 
 class PostBase(BaseModel):
     title: str
@@ -21,3 +23,18 @@ class Post(PostBase):
 
     class Config:
         from_attributes = True
+
+
+class Author(BaseModel):
+    id: int
+    username: str
+
+
+class PostDetail(Post):
+    author: Author | None = None
+    comments: list[Comment] | None = None
+
+
+class TrendingPost(BaseModel):
+    post_id: int
+    score: float
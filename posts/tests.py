@@ -1,3 +1,6 @@
+import time
+from unittest.mock import Mock
+
 import pytest
 from datetime import datetime, UTC
 from fastapi.testclient import TestClient
@@ -7,7 +10,11 @@ from sqlalchemy.pool import StaticPool
 
 from database.engine import Base, get_db
 from main import app
-from posts import crud
+from comments import archive
+from comments.crud import _pending_replies, auto_replay_for_comments, get_comment_rows_for_post
+from comments.models import Comment
+from posts import crud, purge, trending
+from posts.cache import PostCache, RECORD_OVERHEAD, post_cache
 from posts.models import Post
 from users.models import User
 
@@ -147,6 +154,48 @@ def test_delete_post(db_session, test_post):
     assert deleted_post is None
 
 
+def test_deleted_post_is_hidden_until_purged(db_session, test_post):
+    post_id = test_post.id
+    for i in range(3):
+        db_session.add(Comment(content=f"Comment {i}", post_id=post_id, user_id=test_post.user_id))
+    db_session.commit()
+
+    crud.delete_post_from_db(db_session, post_id)
+    assert crud.get_all_post_rows(db_session) == []
+    assert crud.get_post_detail(db_session, post_id, {"comments"}) is None
+    assert get_comment_rows_for_post(db_session, post_id) == []
+    assert db_session.query(Comment).filter(Comment.post_id == post_id).count() == 3
+
+    sleeps = []
+    assert purge.purge_post(db_session, post_id, chunk_size=2, sleep=sleeps.append) == 3
+    assert len(sleeps) == 1
+    assert db_session.query(Comment).filter(Comment.post_id == post_id).count() == 0
+    assert db_session.query(Post).filter(Post.id == post_id).count() == 0
+
+
+def test_purge_skips_live_posts(db_session, test_post):
+    db_session.add(Comment(content="Comment", post_id=test_post.id, user_id=test_post.user_id))
+    db_session.commit()
+
+    assert purge.purge_deleted_posts(db_session) == 0
+    assert purge.purge_post(db_session, test_post.id) == 0
+    assert db_session.query(Comment).count() == 1
+
+
+def test_delete_post_cancels_pending_auto_replies(db_session, test_post, monkeypatch):
+    provider = Mock(enabled=True)
+    monkeypatch.setattr("comments.crud.get_reply_provider", lambda: provider)
+    auto_replay_for_comments(db_session, "Hello", post_id=test_post.id, delay=60, author_id=test_post.user_id)
+    timer, = _pending_replies[test_post.id]
+
+    crud.delete_post_from_db(db_session, test_post.id)
+
+    timer.join(1)
+    assert not timer.is_alive()
+    assert test_post.id not in _pending_replies
+    provider.generate.assert_not_called()
+
+
 # API Endpoint Tests
 def test_get_posts_endpoint(test_post):
     response = client.get("/posts/")
@@ -167,3 +216,244 @@ def test_get_post_endpoint_not_found():
     response = client.get("/posts/999")
     assert response.status_code == 404
     assert response.json()["detail"] == "Post not found"
+
+
+# Query budgets
+def test_get_post_endpoint_query_count(test_post, max_queries):
+    with max_queries(engine, 1):
+        response = client.get(f"/posts/{test_post.id}")
+        assert response.status_code == 200
+        assert response.json()["id"] == test_post.id
+
+
+def test_get_posts_endpoint_query_count(test_post, max_queries):
+    with max_queries(engine, 1):
+        response = client.get("/posts/")
+        assert response.status_code == 200
+        assert [post["id"] for post in response.json()] == [test_post.id]
+
+
+def test_get_posts_endpoint_matches_schema(test_post):
+    from posts.schemas import Post as PostSchema
+
+    response = client.get("/posts/")
+    assert response.headers["content-type"] == "application/json"
+    post = response.json()[0]
+    assert PostSchema.model_validate(post).model_dump(mode="json") == post
+
+
+def add_comments(db_session, post, count, **fields):
+    for i in range(count):
+        db_session.add(Comment(content=f"Comment {i}", post_id=post.id, user_id=post.user_id, **fields))
+    db_session.commit()
+
+
+def test_get_post_endpoint_embeds_author_and_comments(db_session, test_post):
+    add_comments(db_session, test_post, 3)
+    add_comments(db_session, test_post, 1, is_blocked=True)
+
+    response = client.get(f"/posts/{test_post.id}", params={"include": "author,comments", "comments_limit": 2})
+    assert response.status_code == 200
+    data = response.json()
+    assert data["title"] == "Test Post"
+    assert data["author"] == {"id": test_post.user_id, "username": "testuser"}
+    assert [comment["content"] for comment in data["comments"]] == ["Comment 2", "Comment 1"]
+
+
+def test_get_post_endpoint_embeds_only_requested(test_post):
+    data = client.get(f"/posts/{test_post.id}", params={"include": "author"}).json()
+    assert "author" in data
+    assert "comments" not in data
+
+    assert client.get(f"/posts/{test_post.id}", params={"include": "likes"}).status_code == 422
+    assert client.get("/posts/999", params={"include": "author"}).status_code == 404
+
+
+@pytest.mark.parametrize("comments", [1, 50])
+def test_get_post_detail_query_count_is_constant(db_session, test_post, max_queries, comments):
+    add_comments(db_session, test_post, comments)
+    post_id = test_post.id
+    # The post with its author, the live comments and, as they do not fill the page, the archive lookup.
+    with max_queries(engine, 3):
+        detail = crud.get_post_detail(db_session, post_id, {"author", "comments"}, comments_limit=100)
+    assert len(detail["comments"]) == comments
+
+
+def test_get_post_detail_fills_the_page_from_the_archive(db_session, test_post):
+    test_post.created_at = datetime(2024, 1, 1)
+    add_comments(db_session, test_post, 3, created_at=datetime(2024, 1, 2))
+    add_comments(db_session, test_post, 1, is_blocked=True, created_at=datetime(2024, 1, 3))
+    archive.archive_comments(db_session, before=datetime(2024, 6, 1, tzinfo=UTC))
+    db_session.add(Comment(content="Live", post_id=test_post.id, user_id=test_post.user_id))
+    db_session.commit()
+
+    detail = crud.get_post_detail(db_session, test_post.id, {"comments"}, comments_limit=3)
+    assert [comment["content"] for comment in detail["comments"]] == ["Live", "Comment 2", "Comment 1"]
+
+
+# Post cache
+@pytest.fixture
+def enabled_post_cache():
+    post_cache.clear()
+    post_cache.enabled = True
+    yield post_cache
+    post_cache.enabled = False
+    post_cache.clear()
+
+
+def post_row(id, title="Title", content="Content"):
+    return (id, title, content, 1, False, 0, datetime(2024, 1, 1))
+
+
+def test_post_cache_evicts_least_recently_used():
+    cache = PostCache(max_bytes=2 * (RECORD_OVERHEAD + len("Title") + len("Content")))
+    cache.fill_all([post_row(1), post_row(2)], cache.generation)
+    assert cache.complete
+
+    cache.get(1)
+    cache.added(post_row(3))
+
+    assert cache.get(2) is None
+    assert cache.get(1) is not None
+    assert cache.listing() is None
+
+
+def test_post_cache_drops_fill_after_write():
+    cache = PostCache(max_bytes=2 ** 20)
+    generation = cache.generation
+    cache.invalidate(1)
+    cache.fill(post_row(1, title="Stale"), generation)
+    assert cache.get(1) is None
+
+
+def test_get_post_endpoint_served_from_cache(test_post, enabled_post_cache, max_queries):
+    client.get(f"/posts/{test_post.id}")
+    with max_queries(engine, 0):
+        response = client.get(f"/posts/{test_post.id}")
+    assert response.json()["title"] == "Test Post"
+
+
+def test_get_posts_endpoint_served_from_cache(test_post, enabled_post_cache, max_queries):
+    client.get("/posts/")
+    with max_queries(engine, 0):
+        response = client.get("/posts/")
+    assert [post["title"] for post in response.json()] == ["Test Post"]
+
+
+def test_create_post_keeps_cached_listing_complete(db_session, test_post, enabled_post_cache, max_queries):
+    from posts.schemas import PostCreate
+
+    crud.get_all_post_rows(db_session)
+    crud.create_post(db_session, PostCreate(
+        title="New Post", content="New Content", auto_replay_enabled=False, auto_replay_delay=0
+    ), test_post.user_id)
+
+    with max_queries(engine, 0):
+        rows = crud.get_all_post_rows(db_session)
+    assert [row[1] for row in rows] == ["Test Post", "New Post"]
+
+
+def test_update_post_invalidates_cache(db_session, test_post, enabled_post_cache):
+    from posts.schemas import Post as PostSchema
+
+    crud.get_post_row(db_session, test_post.id)
+    update_data = PostSchema(
+        id=test_post.id,
+        title="Updated Title",
+        content="Updated Content",
+        user_id=test_post.user_id,
+        auto_replay_enabled=False,
+        auto_replay_delay=0,
+        created_at=test_post.created_at
+    )
+    crud.update_post_in_db(db_session, update_data, test_post)
+
+    assert crud.get_post_row(db_session, test_post.id)[1] == "Updated Title"
+
+
+def test_delete_post_invalidates_cache(db_session, test_post, enabled_post_cache):
+    crud.get_post_row(db_session, test_post.id)
+    crud.delete_post_from_db(db_session, test_post.id)
+
+    assert crud.get_post_row(db_session, test_post.id) is None
+
+
+# Trending
+@pytest.fixture
+def top_posts(monkeypatch):
+    top = trending.TopK(2)
+    monkeypatch.setattr(trending, "top_posts", top)
+    return top
+
+
+def test_top_k_keeps_best_scores(top_posts):
+    top_posts.replace([], epoch=0.0)
+    top_posts.update(1, 1.0, epoch=0.0)
+    top_posts.update(2, 2.0, epoch=0.0)
+    top_posts.update(3, 3.0, epoch=0.0)
+    top_posts.update(1, 0.5, epoch=0.0)
+    top_posts.update(2, 5.0, epoch=0.0)
+
+    assert top_posts.top(10) == ([(2, 5.0), (3, 3.0)], 0.0)
+
+
+def test_top_k_goes_stale_on_epoch_change_and_removal(top_posts):
+    top_posts.replace([(1, 1.0)], epoch=0.0)
+    top_posts.update(2, 1.0, epoch=10.0)
+    assert top_posts.stale
+
+    top_posts.replace([(1, 1.0)], epoch=0.0)
+    top_posts.remove(1)
+    assert top_posts.stale
+
+
+def test_record_comment_accumulates_decayed_weight(db_session, test_post):
+    now = time.time()
+    half_life = trending.TRENDING_HALF_LIFE_HOURS * 3600
+
+    trending.record_comment(db_session, test_post.id, now=now)
+    score, epoch = trending.record_comment(db_session, test_post.id, now=now + half_life)
+
+    assert epoch == now
+    assert score == pytest.approx(3.0)
+
+
+def test_record_comment_renormalizes_scores(db_session, test_post):
+    now = time.time()
+    trending.record_comment(db_session, test_post.id, now=now)
+    later = now + (trending.MAX_EXPONENT + 1) / trending.DECAY
+    score, epoch = trending.record_comment(db_session, test_post.id, now=later)
+
+    assert epoch == later
+    assert score == pytest.approx(1.0)
+
+
+def test_get_trending_endpoint(db_session, test_user, top_posts):
+    now = time.time()
+    posts = []
+    for title, comments in (("Quiet", 1), ("Busy", 3), ("Medium", 2)):
+        post = Post(title=title, content="Content", user_id=test_user.id, created_at=datetime.now(UTC))
+        db_session.add(post)
+        db_session.flush()
+        for _ in range(comments):
+            trending.record_comment(db_session, post.id, now=now)
+        posts.append(post.id)
+    db_session.commit()
+
+    response = client.get("/posts/trending", params={"limit": 2})
+    assert response.status_code == 200
+    ranked = response.json()
+    assert [entry["post_id"] for entry in ranked] == [posts[1], posts[2]]
+    assert ranked[0]["score"] == pytest.approx(3.0, rel=1e-3)
+
+
+def test_rebuild_scores_from_comments(db_session, test_post, top_posts):
+    db_session.add_all([
+        Comment(content="Fresh", post_id=test_post.id, user_id=test_post.user_id, created_at=datetime.now(UTC)),
+        Comment(content="Blocked", post_id=test_post.id, user_id=test_post.user_id, is_blocked=True),
+    ])
+    db_session.commit()
+
+    trending.rebuild_scores(db_session)
+
+    assert trending.get_trending(db_session, 10) == [{"post_id": test_post.id, "score": pytest.approx(1.0, rel=1e-3)}]
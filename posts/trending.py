@@ -0,0 +1,202 @@
+import heapq
+import math
+import os
+import threading
+import time
+from datetime import datetime, UTC
+
+from sqlalchemy import update
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from comments.crud import blocked
+from comments.models import Comment
+from database.sharding import gather, scatter
+from posts.models import PostScore, TrendingEpoch
+
+TRENDING_HALF_LIFE_HOURS = float(os.getenv("TRENDING_HALF_LIFE_HOURS", 6))
+TRENDING_SIZE = int(os.getenv("TRENDING_SIZE", 50))
+TRENDING_REBUILD_SECONDS = int(os.getenv("TRENDING_REBUILD_SECONDS", 300))
+
+DECAY = math.log(2) / (TRENDING_HALF_LIFE_HOURS * 3600)
+# Scores are stored as sum(exp(DECAY * (t - epoch))) so they never need decaying to
+# stay comparable; once new increments reach e**MAX_EXPONENT everything is rescaled.
+MAX_EXPONENT = 30
+MIN_SCORE = 1e-9
+
+
+class TopK:
+    """The K highest stored scores, as a lazily pruned min-heap plus a score map."""
+
+    def __init__(self, k: int):
+        self.k = k
+        self.epoch = None
+        self.built_at = 0.0
+        self.stale = True
+        self._scores: dict[int, float] = {}
+        self._heap: list[tuple[float, int]] = []
+        self._lock = threading.Lock()
+
+    def _prune(self):
+        while self._heap and self._scores.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+
+    def _compact(self):
+        if len(self._heap) > 2 * self.k:
+            self._heap = [(score, post_id) for post_id, score in self._scores.items()]
+            heapq.heapify(self._heap)
+
+    def update(self, post_id: int, score: float, epoch: float):
+        with self._lock:
+            if epoch != self.epoch:
+                self.stale = True
+                return
+            if post_id in self._scores or len(self._scores) < self.k:
+                self._scores[post_id] = score
+                heapq.heappush(self._heap, (score, post_id))
+                self._compact()
+                return
+            self._prune()
+            lowest_score, lowest_id = self._heap[0]
+            if score > lowest_score:
+                del self._scores[lowest_id]
+                self._scores[post_id] = score
+                heapq.heapreplace(self._heap, (score, post_id))
+
+    def remove(self, post_id: int):
+        with self._lock:
+            if self._scores.pop(post_id, None) is not None:
+                # The next best post is unknown until the heap is rebuilt.
+                self.stale = True
+
+    def replace(self, entries, epoch: float):
+        with self._lock:
+            self._scores = dict(entries)
+            self._heap = [(score, post_id) for post_id, score in self._scores.items()]
+            heapq.heapify(self._heap)
+            self.epoch = epoch
+            self.built_at = time.monotonic()
+            self.stale = False
+
+    def top(self, limit: int):
+        with self._lock:
+            return heapq.nlargest(limit, self._scores.items(), key=lambda item: item[1]), self.epoch
+
+
+top_posts = TopK(TRENDING_SIZE)
+
+
+def current_epoch(db: Session, now: float):
+    row = db.get(TrendingEpoch, 1)
+    if row is None:
+        row = TrendingEpoch(id=1, epoch=now)
+        db.add(row)
+        db.flush()
+    return row
+
+
+def renormalize(db: Session, now: float):
+    row = current_epoch(db, now)
+    factor = math.exp(-DECAY * (now - row.epoch))
+    db.execute(update(PostScore).values(score=PostScore.score * factor))
+    db.query(PostScore).filter(PostScore.score < MIN_SCORE).delete(synchronize_session=False)
+    row.epoch = now
+    db.flush()
+    return now
+
+
+def record_comment(db: Session, post_id: int, now: float | None = None):
+    """Add one comment's weight to the post's score; returns ``(stored score, epoch)``.
+
+    Runs inside the caller's transaction, so the score commits with the comment.
+    """
+    now = time.time() if now is None else now
+    epoch = current_epoch(db, now).epoch
+    if DECAY * (now - epoch) > MAX_EXPONENT:
+        epoch = renormalize(db, now)
+
+    increment = math.exp(DECAY * (now - epoch))
+    statement = (
+        insert(PostScore)
+        .values(post_id=post_id, score=increment)
+        .on_conflict_do_update(index_elements=[PostScore.post_id], set_={"score": PostScore.score + increment})
+        .returning(PostScore.score)
+    )
+    return db.execute(statement).scalar_one(), epoch
+
+
+def forget_post(db: Session, post_id: int):
+    db.query(PostScore).filter(PostScore.post_id == post_id).delete(synchronize_session=False)
+    top_posts.remove(post_id)
+
+
+def adjust_scores(db: Session, comments, sign: int):
+    """Add (``sign=1``) or take away (``sign=-1``) the weight of ``(post_id, created_at)`` comments.
+
+    For comments whose blocked state changed after they were posted, e.g. by moderation.
+    """
+    epoch = current_epoch(db, time.time()).epoch
+    weights: dict[int, float] = {}
+    for post_id, created_at in comments:
+        # created_at is stored as naive UTC.
+        age = created_at.replace(tzinfo=UTC).timestamp() - epoch
+        weights[post_id] = weights.get(post_id, 0.0) + math.exp(min(DECAY * age, MAX_EXPONENT))
+    if not weights:
+        return
+
+    for post_id, weight in weights.items():
+        db.execute(
+            insert(PostScore)
+            .values(post_id=post_id, score=max(sign * weight, 0.0))
+            .on_conflict_do_update(index_elements=[PostScore.post_id], set_={"score": PostScore.score + sign * weight})
+        )
+    db.query(PostScore).filter(
+        PostScore.post_id.in_(list(weights)), PostScore.score < MIN_SCORE
+    ).delete(synchronize_session=False)
+    top_posts.stale = True
+
+
+def load_top_posts(db: Session):
+    def load(session):
+        return session.query(PostScore.post_id, PostScore.score).order_by(PostScore.score.desc()).limit(top_posts.k).all()
+
+    rows = gather(db, load, key=lambda row: -row.score)[:top_posts.k]
+    epoch_row = db.get(TrendingEpoch, 1)
+    top_posts.replace(rows, epoch_row.epoch if epoch_row else time.time())
+
+
+def get_trending(db: Session, limit: int):
+    if top_posts.stale or time.monotonic() - top_posts.built_at > TRENDING_REBUILD_SECONDS:
+        load_top_posts(db)
+    entries, epoch = top_posts.top(limit)
+    decay = math.exp(-DECAY * (time.time() - epoch))
+    return [{"post_id": post_id, "score": score * decay} for post_id, score in entries]
+
+
+def rebuild_scores(db: Session, window_half_lives: int = 20):
+    """Recompute every score from the comments table, e.g. after changing the half-life."""
+    now = time.time()
+    # created_at is stored as naive UTC.
+    since = datetime.fromtimestamp(now - window_half_lives * TRENDING_HALF_LIFE_HOURS * 3600, UTC).replace(tzinfo=None)
+
+    def rebuild(session):
+        # Comments live on their post's shard, so each shard rebuilds its own scores.
+        scores: dict[int, float] = {}
+        comments = (
+            session.query(Comment.post_id, Comment.created_at)
+            .filter(Comment.created_at >= since, blocked == False)
+            .yield_per(10000)
+        )
+        for post_id, created_at in comments:
+            age = now - created_at.replace(tzinfo=UTC).timestamp()
+            scores[post_id] = scores.get(post_id, 0.0) + math.exp(-DECAY * age)
+
+        session.query(PostScore).delete(synchronize_session=False)
+        session.bulk_insert_mappings(PostScore, [
+            {"post_id": post_id, "score": score} for post_id, score in scores.items() if score >= MIN_SCORE
+        ])
+
+    scatter(db, rebuild)
+    current_epoch(db, now).epoch = now
+    db.commit()
+    load_top_posts(db)
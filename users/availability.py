@@ -0,0 +1,159 @@
+import hashlib
+import logging
+import math
+import os
+import threading
+import time
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from core import cache
+from database.engine import SessionLocal
+from database.sharding import session_factory
+from users.models import User
+
+logger = logging.getLogger(__name__)
+
+AVAILABILITY_FILTER_CAPACITY = int(os.getenv("AVAILABILITY_FILTER_CAPACITY", 1000000))
+AVAILABILITY_FILTER_ERROR_RATE = float(os.getenv("AVAILABILITY_FILTER_ERROR_RATE", 0.01))
+# Other workers' registrations only show up after a rebuild.
+AVAILABILITY_REBUILD_SECONDS = int(os.getenv("AVAILABILITY_REBUILD_SECONDS", 300))
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float):
+        self.size = max(64, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value: str):
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, value: str):
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value: str):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+
+def _key(field: str, value: str):
+    return f"{field}:{value}"
+
+
+class AvailabilityFilter:
+    """Usernames and emails that may be taken; a miss means the value is definitely free."""
+
+    def __init__(self, capacity: int = AVAILABILITY_FILTER_CAPACITY, error_rate: float = AVAILABILITY_FILTER_ERROR_RATE):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.built_at = 0.0
+        self._bloom = None
+        # Both in filter items, two per user.
+        self._limit = 0
+        self._count = 0
+        self._pending = None
+        self._lock = threading.Lock()
+        self._rebuilding = None
+
+    @property
+    def stale(self):
+        return (
+            self._bloom is None
+            or self._count > self._limit
+            or time.monotonic() - self.built_at > AVAILABILITY_REBUILD_SECONDS
+        )
+
+    def rebuild(self, db: Session):
+        with self._lock:
+            self._pending = []
+        count = db.query(func.count(User.id)).scalar()
+        limit = max(self.capacity, 2 * count)
+        bloom = BloomFilter(limit, self.error_rate)
+        for username, email in db.query(User.username, User.email).yield_per(10000):
+            bloom.add(_key("username", username))
+            bloom.add(_key("email", email))
+
+        with self._lock:
+            # Registrations that committed while the table was being scanned.
+            for value in self._pending:
+                bloom.add(value)
+            self._bloom, self._limit, self._count = bloom, limit, count * 2 + len(self._pending)
+            self._pending = None
+            self.built_at = time.monotonic()
+
+    def rebuild_in_background(self, make_session):
+        """Start a rebuild unless one is running; lookups keep using the current filter meanwhile."""
+        with self._lock:
+            if self._rebuilding is None or not self._rebuilding.is_alive():
+                self._rebuilding = threading.Thread(
+                    target=self._rebuild_with, args=(make_session,), name="availability-rebuild", daemon=True
+                )
+                self._rebuilding.start()
+            return self._rebuilding
+
+    def _rebuild_with(self, make_session):
+        try:
+            with make_session() as db:
+                self.rebuild(db)
+        except Exception:
+            logger.exception("Could not rebuild the availability filter")
+
+    def wait(self):
+        """Block until a running background rebuild has finished."""
+        with self._lock:
+            rebuilding = self._rebuilding
+        if rebuilding is not None:
+            rebuilding.join()
+
+    def add(self, username: str, email: str):
+        with self._lock:
+            values = (_key("username", username), _key("email", email))
+            if self._pending is not None:
+                self._pending.extend(values)
+            if self._bloom is not None:
+                for value in values:
+                    self._bloom.add(value)
+                self._count += len(values)
+
+    def might_contain(self, field: str, value: str):
+        with self._lock:
+            return self._bloom is None or _key(field, value) in self._bloom
+
+
+availability = AvailabilityFilter()
+
+FIELDS = {"username": User.username, "email": User.email}
+
+
+def is_available(db: Session, field: str, value: str):
+    # Until the first build finishes every lookup goes to the database.
+    if availability.stale:
+        availability.rebuild_in_background(session_factory(db))
+    if not availability.might_contain(field, value):
+        return True
+    return db.query(User.id).filter(FIELDS[field] == value).first() is None
+
+
+def record_user(username: str, email: str):
+    availability.add(username, email)
+
+
+def _registered_elsewhere(username, fields):
+    if "email" in fields:
+        availability.add(username, fields["email"])
+
+
+cache.on_invalidate("user", _registered_elsewhere)
+
+
+def warm_up():
+    try:
+        with SessionLocal() as db:
+            availability.rebuild(db)
+    except Exception:
+        logger.exception("Could not build the availability filter; it will be rebuilt in the background")
@@ -0,0 +1,82 @@
+"""Find password hashing costs that fit a target login latency on this machine.
+
+    python -m users.calibrate --target-ms 250
+
+Prints the settings to put in .env. Run it on production hardware.
+"""
+import argparse
+import statistics
+import sys
+import time
+
+from users.services import ARGON2_PARALLELISM, build_pwd_context
+
+ARGON2_MEMORY_COSTS = (19456, 47104, 65536, 131072, 262144)
+ARGON2_MAX_TIME_COST = 10
+BCRYPT_ROUNDS = range(10, 17)
+
+
+def hash_time(settings: dict, samples: int = 3):
+    context = build_pwd_context(**settings)
+    timings = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        context.hash("calibration password")
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def calibrate_argon2(target: float, parallelism: int = ARGON2_PARALLELISM, timer=hash_time):
+    """Most expensive (memory_cost * time_cost) setting that hashes within ``target`` seconds."""
+    best, best_work = None, 0
+    for memory_cost in ARGON2_MEMORY_COSTS:
+        for time_cost in range(1, ARGON2_MAX_TIME_COST + 1):
+            settings = {
+                "schemes": ("argon2",),
+                "argon2_time_cost": time_cost,
+                "argon2_memory_cost": memory_cost,
+                "argon2_parallelism": parallelism,
+            }
+            if timer(settings) > target:
+                break
+            if memory_cost * time_cost > best_work:
+                best, best_work = settings, memory_cost * time_cost
+    return best
+
+
+def calibrate_bcrypt(target: float, timer=hash_time):
+    best = None
+    for rounds in BCRYPT_ROUNDS:
+        settings = {"schemes": ("bcrypt",), "bcrypt_rounds": rounds}
+        if timer(settings) > target:
+            break
+        best = settings
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target-ms", type=float, default=250)
+    parser.add_argument("--parallelism", type=int, default=ARGON2_PARALLELISM)
+    args = parser.parse_args(argv)
+
+    target = args.target_ms / 1000
+    argon2 = calibrate_argon2(target, parallelism=args.parallelism)
+    bcrypt = calibrate_bcrypt(target)
+    if argon2 is None and bcrypt is None:
+        print(f"No candidate hashes within {args.target_ms:g} ms", file=sys.stderr)
+        return 1
+
+    print(f"# Password hashing settings for a {args.target_ms:g} ms target")
+    print("PASSWORD_SCHEMES=" + ("argon2,bcrypt" if argon2 else "bcrypt"))
+    if argon2:
+        print(f"ARGON2_TIME_COST={argon2['argon2_time_cost']}")
+        print(f"ARGON2_MEMORY_COST={argon2['argon2_memory_cost']}")
+        print(f"ARGON2_PARALLELISM={argon2['argon2_parallelism']}")
+    if bcrypt:
+        print(f"BCRYPT_ROUNDS={bcrypt['bcrypt_rounds']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,6 @@
-from sqlalchemy import Column, String, Integer
+import datetime
+
+from sqlalchemy import Boolean, Column, String, Integer, DateTime, ForeignKey
 from sqlalchemy.orm import relationship
 
 from database.engine import Base
@@ -12,6 +14,21 @@ class User(Base):
     username = Column(String(20), unique=True, nullable=False)
     email = Column(String(50), unique=True, nullable=False)
     password = Column(String, nullable=False)
+    is_admin = Column(Boolean, default=False, nullable=False)
 
     posts = relationship("Post", back_populates="user")
     comments = relationship("Comment", back_populates="user")
+
+
+class RefreshToken(Base):
+    __tablename__ = "refresh_tokens"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    # Every token rotated from the same login shares a family, so reuse revokes them all.
+    family_id = Column(String(32), nullable=False, index=True)
+    token_hash = Column(String(64), nullable=False, unique=True)
+    expires_at = Column(DateTime, nullable=False)
+    used_at = Column(DateTime, nullable=True)
+    revoked_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=lambda: datetime.datetime.now(datetime.UTC), nullable=False)
@@ -1,22 +1,33 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 from datetime import timedelta
 
+from core import cache
+from core.ratelimit import rate_limit
 from database.engine import get_db
+from users import availability, stats
 from users.models import User
-from users.schemas import Token, UserCreate
+from users.schemas import RefreshRequest, Token, UserCreate, UserStats
 from users.services import (
-    verify_password,
+    get_current_admin,
+    verify_and_update_password,
     create_access_token,
+    issue_refresh_token,
+    rotate_refresh_token,
+    revoke_refresh_token,
     ACCESS_TOKEN_EXPIRE_MINUTES, hase_password
 )
 
 users_router = APIRouter()
 
 
-@users_router.post("/register", status_code=status.HTTP_201_CREATED)
-async def register(user_data: UserCreate, db: Session = Depends(get_db)):
+@users_router.post(
+    "/register",
+    status_code=status.HTTP_201_CREATED,
+    dependencies=[Depends(rate_limit("register", "10/60"))]
+)
+def register(user_data: UserCreate, db: Session = Depends(get_db)):
     db_user = db.query(User).filter(
         (User.username == user_data.username) |
         (User.email == user_data.email)
@@ -37,27 +48,77 @@ async def register(user_data: UserCreate, db: Session = Depends(get_db)):
     db.add(user)
     db.commit()
     db.refresh(user)
+    availability.record_user(user_data.username, user_data.email)
+    cache.broadcast("user", user_data.username, email=user_data.email)
 
     return {"message": "User created successfully"}
 
 
-@users_router.post("/token", response_model=Token)
-async def login(
+@users_router.get("/users/availability", dependencies=[Depends(rate_limit("availability", "60/60"))])
+def check_availability(username: str | None = None, email: str | None = None, db: Session = Depends(get_db)):
+    if username is None and email is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Pass a username or an email")
+    return {
+        "username": None if username is None else availability.is_available(db, "username", username),
+        "email": None if email is None else availability.is_available(db, "email", email),
+    }
+
+
+@users_router.get("/users/stats", response_model=list[UserStats])
+def get_users_stats(
+        ids: list[int] = Query(..., min_length=1, max_length=stats.USER_STATS_BULK_LIMIT),
+        user: User = Depends(get_current_admin),
+        db: Session = Depends(get_db)
+):
+    return stats.get_user_stats(db, ids)
+
+
+@users_router.get("/users/{user_id}/stats", response_model=UserStats)
+def get_user_stats(user_id: int, user: User = Depends(get_current_admin), db: Session = Depends(get_db)):
+    found = stats.get_user_stats(db, [user_id])
+    if not found:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+    return found[0]
+
+
+@users_router.post("/token", response_model=Token, dependencies=[Depends(rate_limit("login", "10/60"))])
+def login(
         form_data: OAuth2PasswordRequestForm = Depends(),
         db: Session = Depends(get_db)
 ):
     user = db.query(User).filter(User.username == form_data.username).first()
-    if not user or not verify_password(form_data.password, user.password):
+    verified, new_hash = verify_and_update_password(form_data.password, user.password) if user else (False, None)
+    if not verified:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    if new_hash:
+        user.password = new_hash
+    username = user.username
+    refresh_token = issue_refresh_token(db, user.id)
+    db.commit()
 
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user.username},
+        data={"sub": username},
         expires_delta=access_token_expires
     )
 
-    return {"access_token": access_token, "token_type": "bearer"}
+    return {"access_token": access_token, "token_type": "bearer", "refresh_token": refresh_token}
+
+
+@users_router.post("/token/refresh", response_model=Token, dependencies=[Depends(rate_limit("refresh", "30/60"))])
+def refresh(data: RefreshRequest, db: Session = Depends(get_db)):
+    username, refresh_token = rotate_refresh_token(db, data.refresh_token)
+    access_token = create_access_token(
+        data={"sub": username},
+        expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    )
+    return {"access_token": access_token, "token_type": "bearer", "refresh_token": refresh_token}
+
+
+@users_router.post("/token/revoke", status_code=status.HTTP_204_NO_CONTENT)
+def revoke(data: RefreshRequest, db: Session = Depends(get_db)):
+    revoke_refresh_token(db, data.refresh_token)
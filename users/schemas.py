@@ -1,9 +1,16 @@
+from datetime import datetime
+
 from pydantic import BaseModel
 
 
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: str | None = None
+
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
 
 
 class TokenData(BaseModel):
@@ -19,3 +26,12 @@ class UserCreate(BaseModel):
 class UserLogin(BaseModel):
     username: str
     password: str
+
+
+class UserStats(BaseModel):
+    user_id: int
+    posts: int
+    comments: int
+    blocked_comments: int
+    blocked_ratio: float
+    last_active_at: datetime | None = None
@@ -1,24 +1,70 @@
+import hashlib
+import hmac
 import os
-from datetime import datetime, timedelta
+import secrets
+from datetime import datetime, timedelta, UTC
 from typing import Optional
 
+import orjson
 from dotenv import load_dotenv
 from fastapi import HTTPException, status, Depends
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, make_transient_to_detached
 
+from core import cache
+from core.singleflight import single_flight
 from database.engine import get_db
-from users.models import User
+from users.models import RefreshToken, User
 
 load_dotenv()
 
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
-
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", 30))
+
+# The first scheme hashes new passwords; the others are only verified.
+PASSWORD_SCHEMES = [scheme.strip() for scheme in os.getenv("PASSWORD_SCHEMES", "argon2,bcrypt").split(",")]
+ARGON2_TIME_COST = int(os.getenv("ARGON2_TIME_COST", 3))
+ARGON2_MEMORY_COST = int(os.getenv("ARGON2_MEMORY_COST", 65536))
+ARGON2_PARALLELISM = int(os.getenv("ARGON2_PARALLELISM", 4))
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+# How long another worker may keep serving a user's old admin flag.
+PRINCIPAL_CACHE_TTL = int(os.getenv("PRINCIPAL_CACHE_TTL", 60))
+# The password hash stays out of the shared cache; it is loaded if a request needs it.
+PRINCIPAL_FIELDS = ("id", "username", "email", "is_admin")
+
+
+def build_pwd_context(
+        schemes=tuple(PASSWORD_SCHEMES),
+        argon2_time_cost=ARGON2_TIME_COST,
+        argon2_memory_cost=ARGON2_MEMORY_COST,
+        argon2_parallelism=ARGON2_PARALLELISM,
+        bcrypt_rounds=BCRYPT_ROUNDS,
+):
+    """Hashes from other schemes, or with other costs, are flagged for rehashing."""
+    options = {}
+    if "argon2" in schemes:
+        options.update(
+            argon2__rounds=argon2_time_cost,
+            argon2__min_rounds=argon2_time_cost,
+            argon2__max_rounds=argon2_time_cost,
+            argon2__memory_cost=argon2_memory_cost,
+            argon2__parallelism=argon2_parallelism,
+        )
+    if "bcrypt" in schemes:
+        options.update(
+            bcrypt__rounds=bcrypt_rounds,
+            bcrypt__min_rounds=bcrypt_rounds,
+            bcrypt__max_rounds=bcrypt_rounds,
+        )
+    return CryptContext(schemes=list(schemes), deprecated="auto", **options)
+
+
+pwd_context = build_pwd_context()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/token")
 
 
@@ -34,10 +80,84 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 
+def hash_refresh_token(token: str):
+    return hmac.new(SECRET_KEY.encode(), token.encode(), hashlib.sha256).hexdigest()
+
+
+def _now():
+    return datetime.now(UTC).replace(tzinfo=None)
+
+
+def issue_refresh_token(db: Session, user_id: int, family_id: str | None = None):
+    """Store a new refresh token and return it; only its HMAC is kept."""
+    token = secrets.token_urlsafe(32)
+    db.add(RefreshToken(
+        user_id=user_id,
+        family_id=family_id or secrets.token_hex(16),
+        token_hash=hash_refresh_token(token),
+        expires_at=_now() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS),
+    ))
+    return token
+
+
+def revoke_token_family(db: Session, family_id: str):
+    db.query(RefreshToken).filter(
+        RefreshToken.family_id == family_id, RefreshToken.revoked_at.is_(None)
+    ).update({"revoked_at": _now()})
+
+
+def rotate_refresh_token(db: Session, token: str):
+    """Exchange a refresh token for ``(username, new refresh token)``.
+
+    Presenting a token that was already rotated means it leaked, so its whole family is revoked.
+    """
+    invalid = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid refresh token",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    row = (
+        db.query(RefreshToken, User.username)
+        .join(User, User.id == RefreshToken.user_id)
+        .filter(RefreshToken.token_hash == hash_refresh_token(token))
+        .first()
+    )
+    if row is None:
+        raise invalid
+    refresh_token, username = row
+    now = _now()
+    if refresh_token.revoked_at is not None or refresh_token.expires_at <= now:
+        raise invalid
+
+    used = db.query(RefreshToken).filter(
+        RefreshToken.id == refresh_token.id, RefreshToken.used_at.is_(None)
+    ).update({"used_at": now})
+    if not used:
+        revoke_token_family(db, refresh_token.family_id)
+        db.commit()
+        raise invalid
+
+    new_token = issue_refresh_token(db, refresh_token.user_id, refresh_token.family_id)
+    db.commit()
+    return username, new_token
+
+
+def revoke_refresh_token(db: Session, token: str):
+    refresh_token = db.query(RefreshToken).filter(RefreshToken.token_hash == hash_refresh_token(token)).first()
+    if refresh_token is not None:
+        revoke_token_family(db, refresh_token.family_id)
+        db.commit()
+
+
 def verify_password(plain_password: str, hashed_password: str):
     return pwd_context.verify(plain_password, hashed_password)
 
 
+def verify_and_update_password(plain_password: str, hashed_password: str):
+    """Return ``(verified, new_hash)``; ``new_hash`` is set when the stored hash is outdated."""
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
 def hase_password(password):
     password = pwd_context.hash(password)
     return password
@@ -59,8 +179,29 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
     except JWTError:
         raise credentials_exception
 
-    user = db.query(User).filter(User.username == username).first()
+    def load():
+        key = f"principal:{username}"
+        cached = cache.backend.get(key)
+        if cached is not None:
+            user = User(**orjson.loads(cached))
+            make_transient_to_detached(user)
+            return user
+        user = db.query(User).filter(User.username == username).first()
+        if user is not None:
+            db.expunge(user)
+            fields = {field: getattr(user, field) for field in PRINCIPAL_FIELDS}
+            cache.backend.set(key, orjson.dumps(fields), ttl=PRINCIPAL_CACHE_TTL)
+        return user
+
+    user = await run_in_threadpool(single_flight.do, ("user", username), load)
     if user is None:
         raise credentials_exception
 
+    # The shared instance is detached; give each request its own copy in its session.
+    return db.merge(user, load=False)
+
+
+async def get_current_admin(user: User = Depends(get_current_user)):
+    if not user.is_admin:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
     return user
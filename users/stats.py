@@ -0,0 +1,165 @@
+"""Per-user activity numbers for moderators, cached until the user next writes.
+
+Each user has a version token in the shared cache and their stats are
+stored under it. Committing a post or comment by the user replaces the
+token, so stale entries are never read again and simply expire.
+"""
+import os
+import uuid
+from itertools import chain
+
+import orjson
+from sqlalchemy import case, event, func, inspect, literal, select, union_all
+from sqlalchemy.orm import Session
+
+from comments import archive
+from comments.crud import blocked_expression
+from comments.models import Comment
+from core import cache
+from database.sharding import on_global, scatter
+from posts.models import Post
+from users.models import User
+
+USER_STATS_CACHE_TTL = int(os.getenv("USER_STATS_CACHE_TTL", 300))
+USER_STATS_BULK_LIMIT = 100
+
+
+def _version_key(user_id: int):
+    return f"user-stats-version:{user_id}"
+
+
+def _version(user_id: int) -> str:
+    version = cache.backend.get(_version_key(user_id))
+    if version is None:
+        version = uuid.uuid4().hex.encode()
+        cache.backend.set(_version_key(user_id), version)
+    return version.decode()
+
+
+def mark_changed(session: Session, user_id: int | None):
+    """For bulk writes the flush events cannot see; the version is bumped on commit."""
+    if user_id is not None:
+        session.info.setdefault("stats_authors", set()).add(user_id)
+
+
+def bump_versions(user_ids):
+    for user_id in user_ids:
+        cache.backend.set(_version_key(user_id), uuid.uuid4().hex.encode())
+
+
+def _activity(columns, user_ids, is_post: bool):
+    is_blocked = literal(0) if is_post else case((blocked_expression(columns), 1), else_=0)
+    query = select(
+        columns.user_id.label("user_id"),
+        columns.created_at.label("created_at"),
+        literal(1 if is_post else 0).label("posts"),
+        literal(0 if is_post else 1).label("comments"),
+        is_blocked.label("blocked"),
+    ).where(columns.user_id.in_(user_ids))
+    return query.where(columns.deleted_at.is_(None)) if is_post else query
+
+
+def compute_stats(db: Session, user_ids: list[int], archives=None):
+    """Totals for the given users that exist, in one grouped query over live posts and comments.
+
+    With ``archives``, the totals over those archived comment tables instead.
+    """
+    if archives:
+        sources = [_activity(table.c, user_ids, is_post=False) for table in archives]
+    else:
+        sources = [_activity(Post, user_ids, is_post=True), _activity(Comment, user_ids, is_post=False)]
+    activity = union_all(*sources).subquery()
+    return (
+        db.query(
+            User.id,
+            func.coalesce(func.sum(activity.c.posts), 0),
+            func.coalesce(func.sum(activity.c.comments), 0),
+            func.coalesce(func.sum(activity.c.blocked), 0),
+            func.max(activity.c.created_at),
+        )
+        .outerjoin(activity, activity.c.user_id == User.id)
+        .filter(User.id.in_(user_ids))
+        .group_by(User.id)
+        .all()
+    )
+
+
+def _load(db: Session, user_ids: list[int]):
+    totals = {}
+    # Posts and comments may be spread over shards, while the archive lives once in the
+    # main database; add up what each one saw.
+    parts = scatter(db, lambda session: compute_stats(session, user_ids))
+    archives = archive.all_tables(db)
+    if archives:
+        parts.append(on_global(db, lambda session: compute_stats(session, user_ids, archives)))
+    for rows in parts:
+        for user_id, posts, comments, blocked, last_active_at in rows:
+            previous = totals.get(user_id, (0, 0, 0, None))
+            latest = max(filter(None, (previous[3], last_active_at)), default=None)
+            totals[user_id] = (previous[0] + posts, previous[1] + comments, previous[2] + blocked, latest)
+
+    return [
+        {
+            "user_id": user_id,
+            "posts": posts,
+            "comments": comments,
+            "blocked_comments": blocked,
+            "blocked_ratio": blocked / comments if comments else 0.0,
+            "last_active_at": last_active_at,
+        }
+        for user_id, (posts, comments, blocked, last_active_at) in totals.items()
+    ]
+
+
+def get_user_stats(db: Session, user_ids: list[int]):
+    """Stats for every existing user in ``user_ids``, in the order asked for."""
+    user_ids = list(dict.fromkeys(user_ids))
+    keys = {user_id: f"user-stats:{user_id}:{_version(user_id)}" for user_id in user_ids}
+
+    found, missing = {}, []
+    for user_id, key in keys.items():
+        cached = cache.backend.get(key)
+        if cached is None:
+            missing.append(user_id)
+        else:
+            found[user_id] = orjson.loads(cached)
+
+    if missing:
+        for stats in _load(db, missing):
+            # Stored under the version read before querying, so a write committed meanwhile wins.
+            cache.backend.set(keys[stats["user_id"]], orjson.dumps(stats), ttl=USER_STATS_CACHE_TTL)
+            found[stats["user_id"]] = stats
+    return [found[user_id] for user_id in user_ids if user_id in found]
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_authors(session, flush_context):
+    authors = session.info.setdefault("stats_authors", set())
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, (Post, Comment)):
+            user_id = inspect(obj).dict.get("user_id")
+            if user_id is not None:
+                authors.add(user_id)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_authors(session):
+    authors = session.info.pop("stats_authors", None)
+    if authors:
+        bump_versions(authors)
+        for user_id in authors:
+            cache.broadcast("user-stats", user_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_authors(session):
+    session.info.pop("stats_authors", None)
+
+
+def _changed_elsewhere(key, fields):
+    # A shared backend already holds the new version.
+    if not cache.backend.shared:
+        bump_versions([int(key)])
+
+
+cache.on_invalidate("user-stats", _changed_elsewhere)
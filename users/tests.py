@@ -1,3 +1,6 @@
+import threading
+from datetime import datetime
+
 import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
@@ -5,10 +8,17 @@ from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import StaticPool
 from jose import jwt
 
+from comments.models import Comment
+from core import cache, ratelimit
+from core.cache import LocalBackend
 from database.engine import Base, get_db
 from main import app
-from users.services import SECRET_KEY, ALGORITHM, hase_password
-from users.models import User
+from posts.models import Post
+from users import availability, services
+from users.availability import AvailabilityFilter, BloomFilter
+from users.calibrate import calibrate_argon2, calibrate_bcrypt
+from users.services import SECRET_KEY, ALGORITHM, build_pwd_context, hase_password
+from users.models import RefreshToken, User
 
 # Setup test database
 SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
@@ -36,6 +46,11 @@ app.dependency_overrides[get_db] = override_get_db
 client = TestClient(app)
 
 
+@pytest.fixture(autouse=True)
+def reset_rate_limits():
+    ratelimit.backend.reset()
+
+
 @pytest.fixture
 def test_db():
     # Bind the testing database session
@@ -153,3 +168,280 @@ def test_password_hashing():
 
     assert verify_password(password, hashed)
     assert not verify_password("wrongpassword", hashed)
+
+
+def test_login_query_count(create_test_user, max_queries):
+    # Look up the user, store the refresh token.
+    with max_queries(engine, 2):
+        response = client.post(
+            "/token",
+            data={"username": "testuser", "password": "testpassword"},
+            headers={"Content-Type": "application/x-www-form-urlencoded"}
+        )
+        assert response.status_code == 200
+        assert response.json()["token_type"] == "bearer"
+
+
+def test_authenticated_request(create_test_user):
+    token = client.post(
+        "/token",
+        data={"username": "testuser", "password": "testpassword"},
+        headers={"Content-Type": "application/x-www-form-urlencoded"}
+    ).json()["access_token"]
+
+    response = client.post(
+        "/posts/",
+        json={"title": "Title", "content": "Content", "auto_replay_enabled": False, "auto_replay_delay": 0},
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    assert response.status_code == 200
+    assert response.json()["user_id"] == create_test_user.id
+
+
+def test_invalid_token_is_rejected():
+    response = client.post(
+        "/posts/",
+        json={"title": "Title", "content": "Content", "auto_replay_enabled": False, "auto_replay_delay": 0},
+        headers={"Authorization": "Bearer invalid"}
+    )
+    assert response.status_code == 401
+
+
+def login(username="testuser", password="testpassword"):
+    return client.post(
+        "/token",
+        data={"username": username, "password": password},
+        headers={"Content-Type": "application/x-www-form-urlencoded"}
+    )
+
+
+def test_login_upgrades_legacy_bcrypt_hash(test_db):
+    legacy = build_pwd_context(schemes=("bcrypt",), bcrypt_rounds=4).hash("testpassword")
+    test_db.add(User(username="legacy", email="legacy@example.com", password=legacy))
+    test_db.commit()
+
+    assert login("legacy").status_code == 200
+
+    test_db.expire_all()
+    upgraded = test_db.query(User).filter(User.username == "legacy").one().password
+    assert upgraded.startswith("$argon2id$")
+    assert login("legacy").status_code == 200
+
+
+def test_login_rehashes_when_cost_changes(monkeypatch, create_test_user, test_db):
+    monkeypatch.setattr(services, "pwd_context", build_pwd_context(argon2_time_cost=1, argon2_memory_cost=1024))
+    assert login().status_code == 200
+
+    test_db.expire_all()
+    assert "m=1024,t=1" in test_db.get(User, create_test_user.id).password
+
+
+def test_failed_login_does_not_rehash(create_test_user, test_db):
+    original = create_test_user.password
+    assert login(password="wrong").status_code == 401
+    test_db.expire_all()
+    assert test_db.get(User, create_test_user.id).password == original
+
+
+def test_calibrate_picks_most_expensive_setting_within_target():
+    def timer(settings):
+        if "bcrypt_rounds" in settings:
+            return 0.01 * 2 ** (settings["bcrypt_rounds"] - 10)
+        return settings["argon2_time_cost"] * settings["argon2_memory_cost"] / 1_000_000
+
+    assert calibrate_bcrypt(0.05, timer=timer)["bcrypt_rounds"] == 12
+    argon2 = calibrate_argon2(0.25, timer=timer)
+    assert (argon2["argon2_memory_cost"], argon2["argon2_time_cost"]) == (47104, 5)
+
+
+def refresh(token):
+    return client.post("/token/refresh", json={"refresh_token": token})
+
+
+def test_refresh_rotates_token(create_test_user, test_db, max_queries):
+    first = login().json()["refresh_token"]
+
+    # Look up the token with its user, mark it used, store the next one.
+    with max_queries(engine, 3):
+        response = refresh(first)
+    assert response.status_code == 200
+    data = response.json()
+    assert jwt.decode(data["access_token"], SECRET_KEY, algorithms=[ALGORITHM])["sub"] == "testuser"
+    assert data["refresh_token"] != first
+    assert refresh(data["refresh_token"]).status_code == 200
+
+
+def test_refresh_tokens_are_stored_hashed(create_test_user, test_db):
+    token = login().json()["refresh_token"]
+    stored = test_db.query(RefreshToken).one()
+    assert stored.token_hash != token
+    assert stored.token_hash == services.hash_refresh_token(token)
+
+
+def test_reused_refresh_token_revokes_family(create_test_user):
+    first = login().json()["refresh_token"]
+    second = refresh(first).json()["refresh_token"]
+
+    assert refresh(first).status_code == 401
+    assert refresh(second).status_code == 401
+
+
+def test_revoked_refresh_token_is_rejected(create_test_user):
+    token = login().json()["refresh_token"]
+    other_session = login().json()["refresh_token"]
+
+    assert client.post("/token/revoke", json={"refresh_token": token}).status_code == 204
+    assert refresh(token).status_code == 401
+    assert refresh(other_session).status_code == 200
+
+
+def test_expired_refresh_token_is_rejected(create_test_user, test_db):
+    token = login().json()["refresh_token"]
+    test_db.query(RefreshToken).update({"expires_at": datetime(2000, 1, 1)})
+    test_db.commit()
+
+    assert refresh(token).status_code == 401
+    assert refresh("unknown").status_code == 401
+
+
+# Availability
+@pytest.fixture
+def fresh_filter(monkeypatch):
+    monkeypatch.setattr(availability, "availability", AvailabilityFilter(capacity=1000))
+    yield availability.availability
+    availability.availability.wait()
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    values = [f"user{i}" for i in range(1000)]
+    for value in values:
+        bloom.add(value)
+
+    assert all(value in bloom for value in values)
+    false_positives = sum(f"other{i}" in bloom for i in range(10000))
+    assert false_positives < 300
+
+
+def test_availability_endpoint(create_test_user, fresh_filter):
+    response = client.get("/users/availability", params={"username": "testuser", "email": "free@example.com"})
+    assert response.status_code == 200
+    assert response.json() == {"username": False, "email": True}
+
+    assert client.get("/users/availability").status_code == 400
+
+
+def test_free_values_skip_the_database(create_test_user, fresh_filter, max_queries):
+    client.get("/users/availability", params={"username": "someone"})
+    fresh_filter.wait()
+    with max_queries(engine, 0):
+        response = client.get("/users/availability", params={"username": "nobody", "email": "nobody@example.com"})
+    assert response.json() == {"username": True, "email": True}
+
+
+def test_registration_updates_filter(test_db, fresh_filter):
+    client.get("/users/availability", params={"username": "someone"})
+    fresh_filter.wait()
+    client.post("/register", json={"username": "newuser", "email": "new@example.com", "password": "newpassword123"})
+
+    assert fresh_filter.might_contain("username", "newuser")
+    response = client.get("/users/availability", params={"username": "newuser"})
+    assert response.json()["username"] is False
+
+
+def test_filter_rebuilds_when_over_capacity(test_db, fresh_filter):
+    fresh_filter.rebuild(test_db)
+    # Two items per user, so 500 users fill a capacity of 1000.
+    for i in range(500):
+        fresh_filter.add(f"user{i}", f"user{i}@example.com")
+    assert not fresh_filter.stale
+    fresh_filter.add("user500", "user500@example.com")
+    assert fresh_filter.stale
+
+
+def test_stale_filter_is_rebuilt_in_the_background(create_test_user, test_db, fresh_filter, monkeypatch):
+    fresh_filter.rebuild(test_db)
+    started, release = threading.Event(), threading.Event()
+    rebuild = fresh_filter.rebuild
+
+    def slow_rebuild(db):
+        started.set()
+        release.wait(5)
+        rebuild(db)
+
+    monkeypatch.setattr(fresh_filter, "rebuild", slow_rebuild)
+    monkeypatch.setattr(availability, "AVAILABILITY_REBUILD_SECONDS", -1)
+    response = client.get("/users/availability", params={"username": "testuser", "email": "free@example.com"})
+    assert response.json() == {"username": False, "email": True}
+    assert started.wait(5)
+    # Answered from the old filter while the rebuild is still scanning.
+    response = client.get("/users/availability", params={"username": "someone"})
+    assert response.json() == {"username": True, "email": None}
+
+    release.set()
+    fresh_filter.wait()
+    monkeypatch.setattr(availability, "AVAILABILITY_REBUILD_SECONDS", 300)
+    assert not fresh_filter.stale
+
+
+# Stats
+@pytest.fixture
+def activity(create_test_user, test_db, monkeypatch):
+    monkeypatch.setattr(cache, "backend", LocalBackend())
+    create_test_user.is_admin = True
+    other = User(username="other", email="other@example.com", password="x")
+    post = Post(title="Title", content="Content", user_id=create_test_user.id, created_at=datetime(2024, 1, 1))
+    test_db.add_all([other, post])
+    test_db.flush()
+    test_db.add_all([
+        Comment(content="Fine", post_id=post.id, user_id=create_test_user.id, created_at=datetime(2024, 1, 2)),
+        Comment(content="Rude", post_id=post.id, user_id=create_test_user.id, is_blocked=True, created_at=datetime(2024, 1, 3)),
+        Comment(content="Reply", post_id=post.id, user_id=other.id, created_at=datetime(2024, 1, 4)),
+    ])
+    test_db.commit()
+    token = login().json()["access_token"]
+    return {"user": create_test_user.id, "other": other.id, "post": post.id, "headers": {"Authorization": f"Bearer {token}"}}
+
+
+def test_user_stats(activity):
+    response = client.get(f"/users/{activity['user']}/stats", headers=activity["headers"])
+    assert response.status_code == 200
+    assert response.json() == {
+        "user_id": activity["user"],
+        "posts": 1,
+        "comments": 2,
+        "blocked_comments": 1,
+        "blocked_ratio": 0.5,
+        "last_active_at": "2024-01-03T00:00:00",
+    }
+    assert client.get("/users/999/stats", headers=activity["headers"]).status_code == 404
+    assert client.get(f"/users/{activity['user']}/stats").status_code == 401
+
+
+def test_user_stats_are_admin_only(activity):
+    headers = {"Authorization": f"Bearer {services.create_access_token({'sub': 'other'})}"}
+    assert client.get(f"/users/{activity['user']}/stats", headers=headers).status_code == 403
+    assert client.get("/users/stats", params={"ids": [activity["user"]]}, headers=headers).status_code == 403
+
+
+def test_user_stats_are_cached_until_the_user_writes(activity, test_db, max_queries):
+    url = f"/users/{activity['other']}/stats"
+    client.get(url, headers=activity["headers"])
+    # The token's user and the stats both come from the cache.
+    with max_queries(engine, 0):
+        assert client.get(url, headers=activity["headers"]).json()["comments"] == 1
+
+    test_db.add(Comment(content="More", post_id=activity["post"], user_id=activity["other"]))
+    test_db.commit()
+    assert client.get(url, headers=activity["headers"]).json()["comments"] == 2
+
+
+def test_bulk_user_stats_use_one_query(activity, max_queries):
+    ids = [activity["other"], 999, activity["user"]]
+    # The token's user, the archive lookup and the grouped stats query.
+    with max_queries(engine, 3):
+        response = client.get("/users/stats", params={"ids": ids}, headers=activity["headers"])
+    assert [(row["user_id"], row["posts"], row["comments"]) for row in response.json()] == [
+        (activity["other"], 0, 1), (activity["user"], 1, 2)
+    ]
+    assert client.get("/users/stats", params={"ids": list(range(101))}, headers=activity["headers"]).status_code == 422